@@ -11,11 +11,17 @@ This file intentionally omits core implementations and replaces them with
 clear specifications and TODOs.
 """
 
-from typing import List, Callable, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Callable, Dict, Any, Optional, Tuple, Awaitable
+import asyncio
 import time
 
 from response_parser import ResponseParser
-from llm import LLM, OpenAIModel
+from llm import LLM, OpenAIModel, FatalLLMError
+from context import ContextPolicy, estimate_prompt_tokens
+from output_store import OutputStore
+from checkpoint import Checkpoint
+from trajectory import TrajectoryWriter
 import inspect
 
 class ReactAgent:
@@ -25,13 +31,46 @@ class ReactAgent:
     - Builds the LLM context from the message list
     - Registers callable tools with auto-generated docstrings in the system prompt
     - Runs a Reason-Act loop until `finish` is called or MAX_STEPS is reached
+
+    With a multi-call parser (`ResponseParser(multi_call=True)`) every response may
+    contain several calls: consecutive read-only tools run concurrently, all other
+    tools one at a time in order, and each result is added as its own tool message.
+    A failed call that is not read-only stops the calls after it.
     """
 
-    def __init__(self, name: str, parser: ResponseParser, llm: LLM):
+    # Tools without side effects, safe to run concurrently within one response
+    READ_ONLY_TOOLS = frozenset({"show_file", "search_in_files", "find_file", "list_directory", "read_output", "grep_output"})
+
+    def __init__(
+        self,
+        name: str,
+        parser: ResponseParser,
+        llm: LLM,
+        context_policies: Optional[List[ContextPolicy]] = None,
+        output_store: Optional[OutputStore] = None,
+    ):
         self.name: str = name
         self.parser = parser
         self.llm = llm
 
+        # Oversized tool outputs are stored here and replaced by an excerpt with a handle
+        self.output_store = output_store
+
+        # Per-step checkpoint (see `restore`); `files_changed` is set by steps that
+        # called a tool which may modify files since the last checkpoint
+        self.checkpoint: Optional[Checkpoint] = None
+        self.start_step = 0
+        self.files_changed = False
+
+        # Streaming trajectory (see `set_trajectory_writer`) and the step being run
+        self.trajectory: Optional[TrajectoryWriter] = None
+        self.current_step = 0
+
+        # Policies applied (in order) to the rendered messages before each LLM call
+        self.context_policies: List[ContextPolicy] = list(context_policies or [])
+        # Per-step prompt size records: {"step", "num_messages", "prompt_tokens"}
+        self.step_stats: List[Dict[str, Any]] = []
+
         # Message list storage
         self.id_to_message: List[Dict[str, Any]] = []
         self.root_message_id: int = -1
@@ -39,6 +78,13 @@ class ReactAgent:
 
         # Registered tools
         self.function_map: Dict[str, Callable] = {}
+        # Tool description block, rebuilt only when add_functions changes the tool set
+        self.tool_descriptions: str = ""
+
+        # Rendered messages in OpenAI API format, kept in sync with id_to_message.
+        # Only messages whose id is in `_dirty_message_ids` are (re-)rendered.
+        self._rendered_messages: List[Dict[str, str]] = []
+        self._dirty_message_ids: set = set()
 
         # Set up the initial structure of the history
         # Create required root nodes and a user node (task)
@@ -185,14 +231,21 @@ Fix the bug in <20 steps. Keep it SIMPLE. Understand root cause, make minimal fi
         self.user_message_id = self.add_message("user", "")
         # NOTE: mandatory finish function that terminates the agent
         self.add_functions([self.finish])
+        if output_store is not None:
+            self.add_functions([output_store.read_output, output_store.grep_output])
 
     # -------------------- MESSAGE LIST --------------------
-    def add_message(self, role: str, content: str) -> int:
+    def add_message(self, role: str, content: str, tool_call: Optional[Dict[str, Any]] = None) -> int:
         """
         Create a new message and add it to the list.
 
         The message must include fields: role, content, timestamp, unique_id.
+        Tool results may also record the call that produced them ({"name", "arguments"})
+        and are stored out of line if they exceed the output store's limit.
         """
+        if role == "tool" and self.output_store is not None:
+            content = self.output_store.excerpt(content)
+
         # Use list index as unique_id for O(1) access
         unique_id = len(self.id_to_message)
         
@@ -202,8 +255,14 @@ Fix the bug in <20 steps. Keep it SIMPLE. Understand root cause, make minimal fi
             "timestamp": time.time(),
             "unique_id": unique_id
         }
+        if tool_call is not None:
+            message["tool_call"] = tool_call
         
         self.id_to_message.append(message)
+        self._rendered_messages.append(None)
+        self._dirty_message_ids.add(unique_id)
+        if self.trajectory is not None:
+            self.trajectory.message(message)
         return unique_id
 
     def set_message_content(self, message_id: int, content: str) -> None:
@@ -211,15 +270,84 @@ Fix the bug in <20 steps. Keep it SIMPLE. Understand root cause, make minimal fi
         Update message content by id.
         """
         self.id_to_message[message_id]["content"] = content
+        self._dirty_message_ids.add(message_id)
+        if self.trajectory is not None:
+            self.trajectory.message(self.id_to_message[message_id])
 
     def get_context(self) -> str:
         """
         Build the full LLM context from the message list.
         """
-        context_parts = []
+        return "".join(message["content"] for message in self.get_messages())
+
+    def get_messages(self) -> List[Dict[str, str]]:
+        """
+        Return the message history in OpenAI API format.
+
+        Messages are rendered once and cached; only messages added or modified since
+        the previous call are converted with `message_id_to_context`.
+        """
+        for message_id in sorted(self._dirty_message_ids):
+            role = self.id_to_message[message_id]["role"]
+            # Map "tool" role to "user" for OpenAI API compatibility
+            if role == "tool":
+                role = "user"
+            self._rendered_messages[message_id] = {
+                "role": role,
+                "content": self._render_message(message_id),
+            }
+        self._dirty_message_ids.clear()
+        return list(self._rendered_messages)
+
+    def build_prompt(self, step: int) -> List[Dict[str, str]]:
+        """
+        Build the messages sent to the LLM for `step` by applying the context policies
+        to the rendered history, and record the resulting prompt size.
+        """
+        messages = self.get_messages()
+        for policy in self.context_policies:
+            messages = policy.apply(self, messages)
+        self.step_stats.append({
+            "step": step,
+            "num_messages": len(messages),
+            "prompt_tokens": estimate_prompt_tokens(messages),
+        })
+        return messages
+
+    def get_context_stats(self) -> Dict[str, Any]:
+        """
+        Per-step prompt sizes and per-policy metrics, for the trajectory.
+        """
+        return {
+            "steps": self.step_stats,
+            "policies": {policy.name: policy.stats() for policy in self.context_policies},
+        }
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        """
+        Continue from a checkpoint state ({"step", "messages"}): the message list is
+        replaced and `run` / `arun` start at the saved step.
+        """
+        self.id_to_message = [dict(message) for message in state["messages"]]
+        self._rendered_messages = [None] * len(self.id_to_message)
+        self._dirty_message_ids = set(range(len(self.id_to_message)))
+        self.start_step = state["step"]
+        if self.trajectory is not None:
+            for message in self.id_to_message:
+                self.trajectory.message(message)
+
+    def set_trajectory_writer(self, writer: TrajectoryWriter) -> None:
+        """
+        Stream messages (from now on and those already present) and tool timings to `writer`.
+        """
+        self.trajectory = writer
         for message in self.id_to_message:
-            context_parts.append(self.message_id_to_context(message["unique_id"]))
-        return "".join(context_parts)
+            writer.message(message)
+
+    def _save_checkpoint(self, step: int) -> None:
+        if self.checkpoint is not None and step > self.start_step:
+            self.checkpoint.save(self, step, self.files_changed)
+            self.files_changed = False
 
     # -------------------- REQUIRED TOOLS --------------------
     def add_functions(self, tools: List[Callable]):
@@ -233,6 +361,16 @@ Fix the bug in <20 steps. Keep it SIMPLE. Understand root cause, make minimal fi
         for tool in tools:
             # Use function.__name__ as the key in the function map
             self.function_map[tool.__name__] = tool
+
+        tool_descriptions = []
+        for tool in self.function_map.values():
+            signature = inspect.signature(tool)
+            docstring = inspect.getdoc(tool)
+            tool_descriptions.append(f"Function: {tool.__name__}{signature}\n{docstring}\n")
+        self.tool_descriptions = "\n".join(tool_descriptions)
+
+        # The system message embeds the tool descriptions and must be re-rendered
+        self._dirty_message_ids.add(self.system_message_id)
     
     def finish(self, result: str):
         """The agent must call this function with the final result when it has solved the given task. The function calls "git add -A and git diff --cached" to generate a patch and returns the patch as submission.
@@ -264,93 +402,313 @@ Fix the bug in <20 steps. Keep it SIMPLE. Understand root cause, make minimal fi
         # Enforce max_steps cap at 100
         max_steps = min(max_steps, 100)
         
-        # Main ReAct loop
-        for step in range(max_steps):
-            # Build context from message history
-            context = self.get_context()
-            
-            # Convert message history to OpenAI API format
-            messages = []
-            for msg in self.id_to_message:
-                role = msg["role"]
-                # Map "tool" role to "user" for OpenAI API compatibility
-                if role == "tool":
-                    role = "user"
-                
-                messages.append({
-                    "role": role,
-                    "content": self.message_id_to_context(msg["unique_id"])
-                })
+        # Main ReAct loop (resumed runs start after the last checkpointed step)
+        for step in range(self.start_step, max_steps):
+            self._save_checkpoint(step)
+            self.current_step = step
+
+            # Convert message history to OpenAI API format and apply context policies
+            messages = self.build_prompt(step)
             
             # Query the LLM
             try:
                 response = self.llm.generate(messages)
+            except FatalLLMError:
+                raise
             except Exception as e:
                 # LLM API failure - add error and continue
                 error_msg = f"LLM API error: {str(e)}"
                 self.add_message("tool", error_msg)
                 continue
-            
-            # Add the LLM response as an assistant message
-            self.add_message("assistant", response)
-            
-            # Parse the response to extract function call
-            try:
-                parsed = self.parser.parse(response)
-            except ValueError as e:
-                # Parse error - add error message and continue
-                error_msg = f"Parse error: {str(e)}"
-                self.add_message("tool", error_msg)
+
+            if self.parser.multi_call:
+                calls = self._parse_calls(response)
+                if calls is None:
+                    continue
+                finished, result = self._run_calls(calls)
+                if finished:
+                    return result
                 continue
             
-            # Look up the function in the function map
-            func_name = parsed["name"]
-            if func_name not in self.function_map:
-                # Unknown function - add error message and continue
-                error_msg = f"Unknown function: {func_name}"
-                self.add_message("tool", error_msg)
+            call = self._parse_call(response)
+            if call is None:
                 continue
             
             # Execute the function with parsed arguments
-            func = self.function_map[func_name]
+            func_name, func, arguments = call
+            ok, result = self._call_tool(call)
+            if not ok:
+                # Function execution error - add error message and continue
+                self.add_message("tool", result)
+                continue
+            
+            # Check if finish was called
+            if func_name == "finish":
+                return result
+            
+            # Add the function result as a tool message
+            self.add_message("tool", str(result), tool_call={"name": func_name, "arguments": arguments})
+        
+        # Max steps reached without calling finish
+        return ""
+
+    async def arun(self, task: str, max_steps: int, call_tool: Optional[Callable[..., Awaitable[Any]]] = None) -> str:
+        """
+        Async variant of `run` for driving many agents on one event loop.
+
+        The LLM is queried with `llm.agenerate`. Tools are executed with
+        `await call_tool(func, **arguments)` if given (e.g. `SWEEnvironment.acall`),
+        otherwise coroutine functions are awaited and plain functions run in a thread.
+        """
+        # Set the user task message
+        self.set_message_content(self.user_message_id, task)
+        
+        # Enforce max_steps cap at 100
+        max_steps = min(max_steps, 100)
+        
+        for step in range(self.start_step, max_steps):
+            # Snapshotting the working tree runs a blocking docker exec
+            await asyncio.to_thread(self._save_checkpoint, step)
+            self.current_step = step
+            messages = self.build_prompt(step)
+            
             try:
-                result = func(**parsed["arguments"])
-                
-                # Check if finish was called
-                if func_name == "finish":
-                    return result
-                
-                # Add the function result as a tool message
-                self.add_message("tool", str(result))
-                
+                response = await self.llm.agenerate(messages)
+            except FatalLLMError:
+                raise
             except Exception as e:
-                # Function execution error - add error message and continue
-                error_msg = f"Function execution error: {str(e)}"
+                error_msg = f"LLM API error: {str(e)}"
                 self.add_message("tool", error_msg)
                 continue
+
+            if self.parser.multi_call:
+                calls = self._parse_calls(response)
+                if calls is None:
+                    continue
+                finished, result = await self._arun_calls(calls, call_tool)
+                if finished:
+                    return result
+                continue
+            
+            call = self._parse_call(response)
+            if call is None:
+                continue
+            
+            func_name, func, arguments = call
+            ok, result = await self._acall_tool(call, call_tool)
+            if not ok:
+                self.add_message("tool", result)
+                continue
+            
+            if func_name == "finish":
+                return result
+            
+            self.add_message("tool", str(result), tool_call={"name": func_name, "arguments": arguments})
         
-        # Max steps reached without calling finish
         return ""
 
+    def _parse_call(self, response: str) -> Optional[Tuple[str, Callable, Dict[str, str]]]:
+        """
+        Record the LLM response and resolve the function call it ends with.
+
+        Returns (function name, function, arguments), or None after recording a
+        parse / unknown-function error as a tool message.
+        """
+        # Add the LLM response as an assistant message
+        self.add_message("assistant", response)
+        
+        # Parse the response to extract function call
+        try:
+            parsed = self.parser.parse(response)
+        except ValueError as e:
+            # Parse error - add error message and continue
+            error_msg = f"Parse error: {str(e)}"
+            self.add_message("tool", error_msg)
+            return None
+        
+        # Look up the function in the function map
+        func_name = parsed["name"]
+        if func_name not in self.function_map:
+            # Unknown function - add error message and continue
+            error_msg = f"Unknown function: {func_name}"
+            self.add_message("tool", error_msg)
+            return None
+        
+        return func_name, self.function_map[func_name], parsed["arguments"]
+
+    # -------------------- MULTI-CALL RESPONSES --------------------
+    def _parse_calls(self, response: str) -> Optional[List[Tuple[str, Optional[Callable], Dict[str, str]]]]:
+        """
+        Record the LLM response and resolve all the function calls it contains, up to
+        and including the first `finish`. Unknown functions are kept with func None.
+
+        Returns a list of (function name, function, arguments), or None after recording
+        a parse error as a tool message.
+        """
+        self.add_message("assistant", response)
+        try:
+            parsed_calls = self.parser.parse_all(response)
+        except ValueError as e:
+            self.add_message("tool", f"Parse error: {str(e)}")
+            return None
+
+        calls = []
+        for parsed in parsed_calls:
+            func_name = parsed["name"]
+            calls.append((func_name, self.function_map.get(func_name), parsed["arguments"]))
+            if func_name == "finish":
+                break
+        return calls
+
+    def _call_batches(self, calls: list) -> List[List[int]]:
+        """
+        Split call indices into batches that run together: runs of consecutive
+        read-only calls, and every other call on its own.
+        """
+        batches = []
+        for i, (func_name, func, _) in enumerate(calls):
+            read_only = func is not None and func_name in self.READ_ONLY_TOOLS
+            if read_only and batches and batches[-1][1]:
+                batches[-1][0].append(i)
+            else:
+                batches.append(([i], read_only))
+        return [indices for indices, _ in batches]
+
+    def _call_tool(self, call: tuple) -> Tuple[bool, Any]:
+        """
+        Execute one call. Returns (True, result) or (False, error message).
+        """
+        func_name, func, arguments = call
+        if func is None:
+            return False, f"Unknown function: {func_name}"
+        start = time.monotonic()
+        try:
+            outcome = True, func(**arguments)
+        except Exception as e:
+            outcome = False, f"Function execution error: {str(e)}"
+        self._track_changes(func_name, outcome[0])
+        self._trace_tool_call(func_name, start, outcome[0])
+        return outcome
+
+    def _track_changes(self, func_name: str, success: bool) -> None:
+        # Only a successful call of a tool that can write files changes the working tree
+        if success and func_name not in self.READ_ONLY_TOOLS and func_name != "finish":
+            self.files_changed = True
+
+    async def _acall_tool(self, call: tuple, call_tool: Optional[Callable[..., Awaitable[Any]]]) -> Tuple[bool, Any]:
+        """
+        Async variant of `_call_tool` (see `arun` for how tools are executed).
+        """
+        func_name, func, arguments = call
+        if func is None:
+            return False, f"Unknown function: {func_name}"
+        start = time.monotonic()
+        try:
+            if call_tool is not None:
+                outcome = True, await call_tool(func, **arguments)
+            elif inspect.iscoroutinefunction(func):
+                outcome = True, await func(**arguments)
+            else:
+                outcome = True, await asyncio.to_thread(func, **arguments)
+        except Exception as e:
+            outcome = False, f"Function execution error: {str(e)}"
+        self._track_changes(func_name, outcome[0])
+        self._trace_tool_call(func_name, start, outcome[0])
+        return outcome
+
+    def _trace_tool_call(self, func_name: str, start: float, success: bool) -> None:
+        if self.trajectory is not None:
+            self.trajectory.tool_call(self.current_step, func_name, time.monotonic() - start, success)
+
+    def _run_calls(self, calls: list) -> Tuple[bool, Any]:
+        """
+        Execute the calls of one response and record their results.
+        Returns (True, result) if `finish` was called successfully, else (False, None).
+        """
+        outcomes: List[Tuple[bool, Any]] = [None] * len(calls)
+        for batch in self._call_batches(calls):
+            if self._skip_batch(calls, outcomes, batch):
+                continue
+            if len(batch) == 1:
+                outcomes[batch[0]] = self._call_tool(calls[batch[0]])
+                continue
+            with ThreadPoolExecutor(max_workers=len(batch), thread_name_prefix="tool-call") as pool:
+                for i, outcome in zip(batch, pool.map(lambda i: self._call_tool(calls[i]), batch)):
+                    outcomes[i] = outcome
+        return self._record_outcomes(calls, outcomes)
+
+    async def _arun_calls(self, calls: list, call_tool: Optional[Callable[..., Awaitable[Any]]]) -> Tuple[bool, Any]:
+        """
+        Async variant of `_run_calls`.
+        """
+        outcomes: List[Tuple[bool, Any]] = [None] * len(calls)
+        for batch in self._call_batches(calls):
+            if self._skip_batch(calls, outcomes, batch):
+                continue
+            results = await asyncio.gather(*(self._acall_tool(calls[i], call_tool) for i in batch))
+            for i, outcome in zip(batch, results):
+                outcomes[i] = outcome
+        return self._record_outcomes(calls, outcomes)
+
+    def _skip_batch(self, calls: list, outcomes: list, batch: List[int]) -> bool:
+        """
+        Mark the calls of `batch` as not executed if an earlier call of the response
+        failed that they may depend on: any call that is not read-only, or any call at
+        all before `finish`. Returns True if the batch is skipped.
+        """
+        finishing = calls[batch[0]][0] == "finish"
+        for i in range(batch[0]):
+            func_name, func, _ = calls[i]
+            read_only = func is not None and func_name in self.READ_ONLY_TOOLS
+            if not outcomes[i][0] and (finishing or not read_only):
+                for j in batch:
+                    outcomes[j] = False, f"Not executed: call {i + 1} ({func_name}) failed"
+                return True
+        return False
+
+    def _record_outcomes(self, calls: list, outcomes: list) -> Tuple[bool, Any]:
+        """
+        Add the result of each of one response's calls as a tool message, unless the
+        response ends with a successful `finish` (only reached if no earlier call failed).
+        """
+        func_name, _, arguments = calls[-1]
+        ok, result = outcomes[-1]
+        if func_name == "finish" and ok:
+            return True, result
+
+        # One message per call keeps the call metadata used by the context policies
+        for (func_name, _, arguments), (ok, result) in zip(calls, outcomes):
+            if ok:
+                self.add_message("tool", str(result), tool_call={"name": func_name, "arguments": arguments})
+            else:
+                self.add_message("tool", result)
+        return False, None
+
     def message_id_to_context(self, message_id: int) -> str:
         """
         Helper function to convert a message id to a context string.
         """
+        if message_id in self._dirty_message_ids or self._rendered_messages[message_id] is None:
+            return self._render_message(message_id)
+        return self._rendered_messages[message_id]["content"]
+
+    def message_header(self, message: Dict[str, Any]) -> str:
+        """
+        Header line that precedes every message in the context.
+        """
+        return f'----------------------------\n|MESSAGE(role="{message["role"]}", id={message["unique_id"]})|\n'
+
+    def _render_message(self, message_id: int) -> str:
+        """
+        Render a single message (header, content and, for the system message, tools).
+        """
         message = self.id_to_message[message_id]
-        header = f'----------------------------\n|MESSAGE(role="{message["role"]}", id={message["unique_id"]})|\n'
+        header = self.message_header(message)
         content = message["content"]
         if message["role"] == "system":
-            tool_descriptions = []
-            for tool in self.function_map.values():
-                signature = inspect.signature(tool)
-                docstring = inspect.getdoc(tool)
-                tool_description = f"Function: {tool.__name__}{signature}\n{docstring}\n"
-                tool_descriptions.append(tool_description)
-
-            tool_descriptions = "\n".join(tool_descriptions)
             return (
                 f"{header}{content}\n"
-                f"--- AVAILABLE TOOLS ---\n{tool_descriptions}\n\n"
+                f"--- AVAILABLE TOOLS ---\n{self.tool_descriptions}\n\n"
                 f"--- RESPONSE FORMAT ---\n{self.parser.response_format}\n"
             )
         else:
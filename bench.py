@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the agent's hot paths. These do not touch docker or the OpenAI API.
+
+Usage:
+    python bench.py context [--steps N] [--output-kb K]
+    python bench.py parser [--size-kb K] [--chunk-bytes B] [--repeat R]
+    python bench.py shell [--calls N] [--container CONTAINER_ID]
+    python bench.py imports [--module MODULE] [--repeat R] [--max-ms MS]
+"""
+
+import sys
+import time
+
+from response_parser import ResponseParser
+
+
+class ScriptedLLM:
+    """LLM stand-in that always issues the same tool call."""
+
+    model_name = "scripted"
+
+    def __init__(self, response: str):
+        self.response = response
+
+    def generate(self, messages: list) -> str:
+        return self.response
+
+
+def bench_context(steps: int = 100, output_kb: int = 20) -> None:
+    """
+    Measure the per-step overhead of building the LLM context as the history grows.
+
+    Each step appends a tool output of `output_kb` KB. With incremental rendering the
+    per-step time should stay flat instead of growing with the number of messages.
+    """
+    from agent import ReactAgent
+
+    payload = "x" * 79 + "\n"
+    tool_output = payload * (output_kb * 1024 // len(payload))
+
+    def show_file(file_path: str) -> str:
+        """Return a large, fixed file view."""
+        return tool_output
+
+    response = (
+        "Looking at the file.\n"
+        f"{ResponseParser.BEGIN_CALL}\nshow_file\n{ResponseParser.ARG_SEP}\nfile_path\n"
+        f"{ResponseParser.VALUE_SEP}\nsrc/app.py\n{ResponseParser.END_CALL}"
+    )
+    agent = ReactAgent("bench-agent", ResponseParser(), ScriptedLLM(response))
+    agent.add_functions([show_file])
+    agent.set_message_content(agent.user_message_id, "Benchmark task")
+
+    timings = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        agent.get_messages()
+        timings.append(time.perf_counter() - start)
+        agent.add_message("assistant", response)
+        agent.add_message("tool", show_file("src/app.py"))
+
+    bucket = max(steps // 10, 1)
+    print(f"context rendering: {steps} steps, {output_kb} KB tool outputs")
+    print(f"{'steps':>12}  {'messages':>8}  {'mean us/step':>12}")
+    for i in range(0, steps, bucket):
+        chunk = timings[i:i + bucket]
+        print(f"{i:>5}-{i + len(chunk) - 1:<6}  {2 + 2 * i:>8}  {1e6 * sum(chunk) / len(chunk):>12.1f}")
+
+
+def bench_parser(size_kb: int = 500, chunk_bytes: int = 64, repeat: int = 20) -> None:
+    """
+    Measure ResponseParser on a response whose `new_str` argument is `size_kb` KB,
+    both on the complete string and fed incrementally in `chunk_bytes` chunks. The
+    stream is compared with the bare stop token scan it replaces in a streamed call.
+    """
+    line = "    value = compute(value)  # ----ARG-like---- noise\n"
+    payload = line * (size_kb * 1024 // len(line))
+    response = (
+        "I will rewrite the module.\n"
+        f"{ResponseParser.BEGIN_CALL}\nreplace_in_file\n"
+        f"{ResponseParser.ARG_SEP}\nfile_path\n{ResponseParser.VALUE_SEP}\nsrc/app.py\n"
+        f"{ResponseParser.ARG_SEP}\nold_str\n{ResponseParser.VALUE_SEP}\n{payload}"
+        f"{ResponseParser.ARG_SEP}\nnew_str\n{ResponseParser.VALUE_SEP}\n{payload}"
+        f"{ResponseParser.END_CALL}"
+    )
+    chunks = [response[i:i + chunk_bytes] for i in range(0, len(response), chunk_bytes)]
+    parser = ResponseParser()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parsed = parser.parse(response)
+    full = (time.perf_counter() - start) / repeat
+    assert parsed["arguments"]["new_str"] == payload.rstrip()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        streaming = parser.stream()
+        for chunk in chunks:
+            streaming.feed(chunk)
+        streamed = streaming.result()
+    incremental = (time.perf_counter() - start) / repeat
+    assert streamed == parsed
+
+    stop_token = ResponseParser.END_CALL
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parts, tail = [], ""
+        for chunk in chunks:
+            parts.append(chunk)
+            window = tail + chunk
+            if stop_token in window:
+                break
+            tail = window[-(len(stop_token) - 1):]
+        "".join(parts)
+    scan = (time.perf_counter() - start) / repeat
+
+    size_mb = len(response) / 2**20
+    print(f"parser: {len(response) / 1024:.0f} KB response, {len(chunks)} chunks of {chunk_bytes} B")
+    print(f"  parse (complete string): {1e3 * full:8.2f} ms  ({size_mb / full:8.1f} MB/s)")
+    print(f"  feed + result (stream):  {1e3 * incremental:8.2f} ms  ({size_mb / incremental:8.1f} MB/s)")
+    print(f"  stop token scan only:    {1e3 * scan:8.2f} ms  ({size_mb / scan:8.1f} MB/s)")
+
+
+def bench_shell(calls: int = 50, container: str = "") -> None:
+    """
+    Compare per-command latency of launching a process per command with the
+    persistent shell session. With `container`, both backends go through
+    `docker exec` into that running container; otherwise a local bash is used.
+    """
+    import subprocess
+
+    from shell import PersistentShell
+
+    if container:
+        launch = ["docker", "exec", "-w", "/testbed", container, "bash", "-lc"]
+        session = PersistentShell(["docker", "exec", "-i", "-w", "/testbed", container, "bash", "--noprofile", "--norc"], cwd="/testbed")
+    else:
+        launch = ["bash", "--noprofile", "--norc", "-c"]
+        session = PersistentShell(["bash", "--noprofile", "--norc"], login=False)
+    commands = ["test -f setup.py; echo $?", "ls | head -5", "pwd"]
+
+    def run(execute) -> list:
+        timings = []
+        for i in range(calls):
+            start = time.perf_counter()
+            execute(commands[i % len(commands)])
+            timings.append(time.perf_counter() - start)
+        return sorted(timings)
+
+    exec_timings = run(lambda command: subprocess.run(launch + [command], capture_output=True))
+    session.execute("true")  # start the session outside the measurement
+    session_timings = run(session.execute)
+    session.close()
+
+    print(f"shell: {calls} commands ({'docker container ' + container if container else 'local bash'})")
+    print(f"{'backend':>12}  {'p50 ms':>8}  {'p95 ms':>8}")
+    for name, timings in (("exec", exec_timings), ("persistent", session_timings)):
+        p50 = timings[len(timings) // 2]
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f"{name:>12}  {1e3 * p50:>8.2f}  {1e3 * p95:>8.2f}")
+
+
+# Loaded only on the code paths that need them (see bench_imports)
+HEAVY_MODULES = ("openai", "datasets", "swebench", "minisweagent", "pyarrow", "docker")
+
+
+def bench_imports(module: str = "run_agent", repeat: int = 5, max_ms: int = 0) -> None:
+    """
+    Measure how long a fresh interpreter takes to import `module` (`python -X importtime`)
+    and check that none of HEAVY_MODULES is imported with it. Exits with status 1 if
+    one is, or if the median import time exceeds `max_ms` (0 = no limit).
+    """
+    import statistics
+    import subprocess
+    from pathlib import Path
+
+    cwd = Path(__file__).resolve().parent
+    totals, entries = [], []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=cwd, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stderr.strip().splitlines()[-1])
+            sys.exit(1)
+        # Lines are "import time: <self us> | <cumulative us> | <indented name>"
+        entries = []
+        for line in result.stderr.splitlines():
+            fields = line.removeprefix("import time:").split("|")
+            if len(fields) == 3 and fields[1].strip().isdigit():
+                entries.append((int(fields[1]), fields[2].strip()))
+        totals.append(next(us for us, name in entries if name == module) / 1e3)
+    loaded = subprocess.run(
+        [sys.executable, "-c", f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"],
+        cwd=cwd, capture_output=True, text=True,
+    ).stdout.split()
+
+    median = statistics.median(totals)
+    print(f"imports: `import {module}` in a fresh interpreter, {repeat} runs")
+    print(f"  median {median:.1f} ms, min {min(totals):.1f} ms, max {max(totals):.1f} ms")
+    print(f"{'cumulative ms':>15}  module (last run)")
+    for us, name in sorted(entries, reverse=True)[:10]:
+        print(f"{us / 1e3:>15.1f}  {name}")
+    failures = []
+    if loaded:
+        failures.append(f"heavy modules imported: {', '.join(loaded)}")
+    if max_ms and median > max_ms:
+        failures.append(f"median import time {median:.1f} ms exceeds {max_ms} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+BENCHMARKS = {
+    "context": bench_context,
+    "parser": bench_parser,
+    "shell": bench_shell,
+    "imports": bench_imports,
+}
+
+
+def main(argv: list) -> None:
+    if not argv or argv[0] not in BENCHMARKS:
+        print(__doc__)
+        sys.exit(1)
+    name, args = argv[0], argv[1:]
+    kwargs = {}
+    for flag, value in zip(args[::2], args[1::2]):
+        kwargs[flag.lstrip("-").replace("-", "_")] = int(value) if value.isdigit() else value
+    BENCHMARKS[name](**kwargs)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Delta-encoded, buffered log of LLM calls.
+
+Each record stores only the messages that changed since the previous call of the same
+conversation: `offset` is the number of leading messages shared with the previous
+prompt and `new_messages` replaces everything from there on. Full prompts are
+rebuilt with `read_call_log`. Records are written by one background thread in
+batches, optionally gzip-compressed, and flushed at interpreter shutdown.
+
+Usage:
+    python call_log.py LOG_FILE [CONVERSATION_ID [CALL_NUMBER]]
+"""
+
+import atexit
+import gzip
+import json
+import queue
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+
+class CallLogWriter:
+    """
+    Background writer shared by all models of the process. `write` only enqueues;
+    the writer thread appends batches of lines to their files.
+    """
+
+    def __init__(self, batch_size: int = 256):
+        self.batch_size = batch_size
+        self.queue: queue.Queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="call-log-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, path: Path, record: dict) -> None:
+        self.queue.put((Path(path), record))
+
+    def close(self) -> None:
+        """
+        Write everything that is queued and stop the writer thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            batch = [item]
+            while item is not None and len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+            stop = batch[-1] is None
+            self._write_batch([entry for entry in batch if entry is not None])
+            if stop:
+                return
+
+    def _write_batch(self, batch: list) -> None:
+        lines_by_path: Dict[Path, list] = {}
+        for path, record in batch:
+            lines_by_path.setdefault(path, []).append(json.dumps(record) + "\n")
+        for path, lines in lines_by_path.items():
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                opener = gzip.open if path.suffix == ".gz" else open
+                with opener(path, "at") as f:
+                    f.writelines(lines)
+            except Exception as e:
+                print(f"Failed to write LLM call log {path}: {e}", file=sys.stderr)
+
+
+_WRITER: Optional[CallLogWriter] = None
+_WRITER_LOCK = threading.Lock()
+
+
+def get_log_writer() -> CallLogWriter:
+    """
+    The process-wide call log writer, started on first use and flushed at exit.
+    """
+    global _WRITER
+    with _WRITER_LOCK:
+        if _WRITER is None:
+            _WRITER = CallLogWriter()
+            atexit.register(_WRITER.close)
+        return _WRITER
+
+
+def flush_log_writer() -> None:
+    """
+    Flush and stop the process-wide writer (a new one is started on the next write).
+    """
+    global _WRITER
+    with _WRITER_LOCK:
+        writer, _WRITER = _WRITER, None
+    if writer is not None:
+        atexit.unregister(writer.close)
+        writer.close()
+
+
+class ConversationLog:
+    """
+    Tracks what has been logged for one conversation and produces delta records.
+    """
+
+    def __init__(self, path: Path, conversation_id: str):
+        self.path = Path(path)
+        self.conversation_id = conversation_id
+        self.logged_messages: list = []
+
+    def record(self, messages: list, entry: dict) -> None:
+        """
+        Enqueue `entry` with the messages that differ from the previously logged prompt.
+        """
+        offset = 0
+        limit = min(len(messages), len(self.logged_messages))
+        # Unchanged messages are usually the very same (cached) dicts
+        while offset < limit and (messages[offset] is self.logged_messages[offset] or messages[offset] == self.logged_messages[offset]):
+            offset += 1
+        self.logged_messages = list(messages)
+        get_log_writer().write(self.path, {
+            "conversation_id": self.conversation_id,
+            **entry,
+            "offset": offset,
+            "new_messages": messages[offset:],
+        })
+
+
+def read_call_log(path: Path) -> Iterator[dict]:
+    """
+    Yield log records in order with the full prompt rebuilt under "messages".
+    Records written before delta encoding (with a full "messages" list) are passed through.
+    """
+    path = Path(path)
+    opener = gzip.open if path.suffix == ".gz" else open
+    prompts: Dict[str, list] = {}
+    with opener(path, "rt") as f:
+        for line in f:
+            record = json.loads(line)
+            if "new_messages" in record:
+                previous = prompts.get(record["conversation_id"], [])
+                record["messages"] = previous[:record.pop("offset")] + record.pop("new_messages")
+            prompts[record.get("conversation_id")] = record["messages"]
+            yield record
+
+
+def reconstruct_prompt(path: Path, conversation_id: str, call_number: int) -> list:
+    """
+    The full message list sent in call `call_number` of `conversation_id`.
+    """
+    for record in read_call_log(path):
+        if record.get("conversation_id") == conversation_id and record["call_number"] == call_number:
+            return record["messages"]
+    raise KeyError(f"No call {call_number} for conversation {conversation_id} in {path}")
+
+
+def main(argv: list) -> None:
+    if not argv:
+        print(__doc__)
+        sys.exit(1)
+    path = Path(argv[0])
+    if len(argv) >= 3:
+        print(json.dumps(reconstruct_prompt(path, argv[1], int(argv[2])), indent=2))
+        return
+    for record in read_call_log(path):
+        if len(argv) == 2 and record.get("conversation_id") != argv[1]:
+            continue
+        print(json.dumps({
+            "conversation_id": record.get("conversation_id"),
+            "call_number": record["call_number"],
+            "success": record["success"],
+            "num_messages": len(record["messages"]),
+            "prompt_chars": sum(len(message["content"]) for message in record["messages"]),
+        }))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,74 @@
+"""
+Per-step checkpoints of an agent, so an interrupted instance can continue from its
+last completed step instead of starting over.
+
+A checkpoint is a JSON-lines file: every record holds the step count reached, the
+messages added since the previous record and, after steps that may have changed
+files, a snapshot of the working tree as a patch. Loading concatenates the messages
+and keeps the latest patch, which is applied to the fresh container on resume.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+
+class Checkpoint:
+    """
+    Checkpoint file of one agent. `snapshot` returns the current working tree patch
+    (e.g. `SWEEnvironment.snapshot_patch`); without it only messages are saved.
+    """
+
+    def __init__(self, path: Path, snapshot: Optional[Callable[[], str]] = None):
+        self.path = Path(path)
+        self.snapshot = snapshot
+        # Number of the agent's messages already written
+        self.saved_messages = 0
+
+    def save(self, agent, step: int, files_changed: bool) -> None:
+        """
+        Record that `step` steps are complete, with the messages added since the last save.
+        """
+        record: Dict[str, Any] = {"step": step, "messages": agent.id_to_message[self.saved_messages:]}
+        if files_changed and self.snapshot is not None:
+            try:
+                record["patch"] = self.snapshot()
+            except Exception as e:
+                print(f"Could not snapshot working tree for checkpoint {self.path}: {e}")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One write per record: an interrupted write leaves at most one partial last line
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(record) + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
+        self.saved_messages = len(agent.id_to_message)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """
+        The saved state {"step", "messages", "patch"}, or None if there is no checkpoint.
+        """
+        if not self.path.exists():
+            return None
+        data = self.path.read_bytes()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            # Drop a record cut short by the interruption so later appends start on a new line
+            os.truncate(self.path, complete)
+        state: Dict[str, Any] = {"step": 0, "messages": [], "patch": None}
+        for line in data[:complete].decode("utf-8").splitlines():
+            if line:
+                record = json.loads(line)
+                state["step"] = record["step"]
+                state["messages"].extend(record["messages"])
+                if "patch" in record:
+                    state["patch"] = record["patch"]
+        if not state["messages"]:
+            return None
+        self.saved_messages = len(state["messages"])
+        return state
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
+        self.saved_messages = 0
@@ -0,0 +1,292 @@
+"""
+Index of the repository inside a SWE-bench container, serving `find_file` and
+`search_in_files` from memory instead of running `find` / `grep` in the container
+on every call.
+
+The index is built once when the environment starts from two commands run in the
+container: the file list (`git ls-files`, tracked and untracked-but-not-ignored)
+and the contents of its text files (`git grep -I` for every line). Vendored,
+generated and binary paths are left out. The Python definitions (`def` / `class`
+lines) are extracted from the contents, and searches rank matching definitions
+above other matches. The contents take about as much memory as the repository's
+text files. After edits the index is refreshed incrementally from `git status`.
+"""
+
+import fnmatch
+import re
+import shlex
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# Definitions: optional indentation, optional `async`, then `def` or `class` and a name
+DEFINITION_RE = re.compile(r"^[ \t\f\v]*(?:async\s+)?(?:def|class)\s+[A-Za-z_][A-Za-z0-9_]*", re.MULTILINE)
+
+EXCLUDED_DIRS = {
+    ".git", ".tox", ".nox", ".venv", "venv", "node_modules", "vendor", "_vendor", "vendored",
+    "extern", "build", "dist", "__pycache__", ".eggs", "site-packages",
+}
+BINARY_SUFFIXES = {
+    ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ico", ".svg", ".pdf", ".gz", ".bz2", ".xz", ".zip",
+    ".tar", ".whl", ".egg", ".so", ".dll", ".dylib", ".o", ".a", ".pyc", ".pyo", ".mo", ".woff",
+    ".woff2", ".ttf", ".otf", ".eot", ".npy", ".npz", ".pkl", ".fits", ".h5", ".hdf5", ".db", ".sqlite3",
+}
+
+
+def _contents_command(paths: List[str]) -> str:
+    """
+    Command printing every line of the text files among `paths` (all files if empty)
+    as path, line number and line, the first two terminated by NUL. Excluded
+    directories are not read.
+    """
+    pathspecs = [shlex.quote(path) for path in paths] or [
+        shlex.quote(f":(exclude,glob)**/{name}/**") for name in sorted(EXCLUDED_DIRS | {"*.egg-info"})
+    ]
+    return f"git grep --untracked -z -n -I -e '' -- {' '.join(pathspecs)} 2>/dev/null || true"
+
+
+def is_indexed_path(path: str) -> bool:
+    """
+    Whether `path` belongs in the index (not vendored, generated or binary).
+    """
+    parts = path.split("/")
+    if any(part in EXCLUDED_DIRS or part.endswith(".egg-info") for part in parts[:-1]):
+        return False
+    dot = parts[-1].rfind(".")
+    return dot == -1 or parts[-1][dot:].lower() not in BINARY_SUFFIXES
+
+
+def bre_to_regex(pattern: str) -> re.Pattern:
+    """
+    Translate a grep basic regular expression into a Python regex
+    (in BRE, `( ) { } | + ?` are literal unless backslash-escaped).
+    """
+    out = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\" and i + 1 < len(pattern):
+            following = pattern[i + 1]
+            out.append(following if following in "(){}|+?" else char + following)
+            i += 2
+            continue
+        out.append(re.escape(char) if char in "(){}|+?" else char)
+        i += 1
+    try:
+        return re.compile("".join(out))
+    except re.error:
+        return re.compile(re.escape(pattern))
+
+
+def required_literal(pattern: str) -> str:
+    """
+    The longest text that every match of the grep basic regular expression `pattern`
+    contains ("" if none is known), to skip files cheaply with `in`.
+    """
+    if "\\|" in pattern or "\\(" in pattern:
+        return ""
+    runs, run = [], ""
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("\\{", i):
+            # Skip the interval expression
+            end = pattern.find("\\}", i + 2)
+            token, literal = pattern[i:end + 2] if end != -1 else pattern[i:], False
+            i = end + 2 if end != -1 else len(pattern)
+        elif char == "\\" and i + 1 < len(pattern):
+            token, literal = pattern[i:i + 2], pattern[i + 1] in ".*[]^$\\/"
+            i += 2
+        elif char == "[":
+            # Skip the bracket expression ("]" right after "[" or "[^" is part of it)
+            end = i + 1 + (pattern[i + 1:i + 2] == "^")
+            end = pattern.find("]", end + 1)
+            token, literal = pattern[i:end + 1] if end != -1 else pattern[i:], False
+            i = end + 1 if end != -1 else len(pattern)
+        else:
+            token, literal = char, char not in ".*" and not (char == "^" and i == 0) and not (char == "$" and i == len(pattern) - 1)
+            i += 1
+        optional = pattern.startswith("*", i) or pattern.startswith("\\?", i) or pattern.startswith("\\{", i)
+        if literal and not optional:
+            run += token[-1]
+        else:
+            # A repeated or optional character may be absent
+            runs.append(run)
+            run = ""
+    runs.append(run)
+    return max(runs, key=len)
+
+
+class CodeIndex:
+    """
+    File list, text file contents and definition index of the repository in the
+    working directory, kept in sync with edits. `execute` runs a shell command in
+    the container and returns its output.
+    """
+
+    def __init__(self, execute: Callable[[str], str]):
+        self.execute = execute
+        self.files: Set[str] = set()
+        # Text files only (binary files are listed but not searched, like `grep -I`)
+        self.contents: Dict[str, str] = {}
+        self.definitions: Dict[str, List[Tuple[int, str]]] = {}
+        # Paths edited since the last refresh; None means "unknown, ask git"
+        self.dirty: Optional[Set[str]] = set()
+        # Every path refreshed so far, re-checked on a full refresh in case it was reverted
+        self.touched: Set[str] = set()
+        # Queries may run concurrently; refreshes must not interleave
+        self.lock = threading.Lock()
+        self.build()
+
+    # -------------------- BUILDING --------------------
+    def build(self) -> None:
+        listing = self.execute("git ls-files -z --cached --others --exclude-standard 2>/dev/null")
+        self.files = {path for path in listing.split("\0") if path and is_indexed_path(path)}
+        self.contents = {}
+        self.definitions = {}
+        self._add_contents(self.execute(_contents_command([])))
+
+    def _add_contents(self, grep_output: str) -> None:
+        lines_by_path: Dict[str, List[str]] = {}
+        for line in grep_output.split("\n"):
+            path, _, rest = line.partition("\0")
+            _, _, text = rest.partition("\0")
+            if path in self.files:
+                lines_by_path.setdefault(path, []).append(text)
+        for path, lines in lines_by_path.items():
+            content = "\n".join(lines)
+            self.contents[path] = content
+            if path.endswith(".py"):
+                self._add_definitions(path, content)
+
+    def _add_definitions(self, path: str, content: str) -> None:
+        definitions = []
+        lineno, position = 1, 0
+        for match in DEFINITION_RE.finditer(content):
+            lineno += content.count("\n", position, match.start())
+            position = match.start()
+            end = content.find("\n", position)
+            definitions.append((lineno, content[position:end if end != -1 else len(content)]))
+        if definitions:
+            self.definitions[path] = definitions
+
+    def mark_dirty(self, path: Optional[str] = None) -> None:
+        """
+        Record an edit: `path` was changed, or (None) anything may have changed.
+        """
+        if path is None:
+            self.dirty = None
+        elif self.dirty is not None:
+            self.dirty.add(normalize_path(path))
+
+    def refresh(self) -> None:
+        """
+        Bring the index up to date with the edits recorded by `mark_dirty`.
+        """
+        if self.dirty == set():
+            return
+        with self.lock:
+            self._refresh()
+
+    def _refresh(self) -> None:
+        if self.dirty == set():
+            return
+        if self.dirty is None:
+            changed = self._changed_paths() | self.touched
+        else:
+            changed = self.dirty
+        self.dirty = set()
+        self.touched |= changed
+
+        existing = set()
+        if changed:
+            quoted = " ".join(shlex.quote(path) for path in sorted(changed))
+            listing = self.execute(f"for f in {quoted}; do [ -f \"$f\" ] && printf '%s\\0' \"$f\"; done; true")
+            existing = {path for path in listing.split("\0") if path}
+        reread = []
+        for path in changed:
+            self.contents.pop(path, None)
+            self.definitions.pop(path, None)
+            if path in existing and is_indexed_path(path):
+                self.files.add(path)
+                reread.append(path)
+            else:
+                self.files.discard(path)
+        if reread:
+            self._add_contents(self.execute(_contents_command(sorted(reread))))
+
+    def _changed_paths(self) -> Set[str]:
+        status = self.execute("git status --porcelain -z --untracked-files=all 2>/dev/null")
+        entries = status.split("\0")
+        changed = set()
+        i = 0
+        while i < len(entries):
+            entry = entries[i]
+            i += 1
+            if len(entry) < 4:
+                continue
+            changed.add(entry[3:])
+            # Renames and copies are followed by the original path
+            if entry[0] in "RC":
+                if i < len(entries) and entries[i]:
+                    changed.add(entries[i])
+                i += 1
+        return changed
+
+    # -------------------- QUERIES --------------------
+    def find_files(self, filename: str, limit: int = 20) -> List[str]:
+        """
+        Indexed paths whose base name matches the glob `filename` (like `find -name`).
+        """
+        self.refresh()
+        matches = [path for path in self.files if fnmatch.fnmatchcase(path.rsplit("/", 1)[-1], filename)]
+        return sorted(matches)[:limit]
+
+    def search(self, pattern: str, file_pattern: str = "*", limit: int = 50) -> List[str]:
+        """
+        grep-style `./path:line:text` matches of the grep basic regular expression
+        `pattern` in indexed text files whose base name matches `file_pattern`, with
+        definitions ranked first.
+        """
+        self.refresh()
+        regex = bre_to_regex(pattern)
+        results = []
+        seen = set()
+        for path in sorted(self.definitions):
+            if not fnmatch.fnmatchcase(path.rsplit("/", 1)[-1], file_pattern):
+                continue
+            for lineno, text in self.definitions[path]:
+                if regex.search(text):
+                    results.append(f"./{path}:{lineno}:{text}")
+                    seen.add((path, lineno))
+        if len(results) >= limit:
+            return results[:limit]
+
+        # A file with a matching line also matches as a whole (with ^ and $ at line
+        # boundaries), so most files are skipped by one search over their contents
+        anywhere = re.compile(regex.pattern, re.MULTILINE)
+        literal = required_literal(pattern)
+        for path in sorted(self.contents):
+            if not fnmatch.fnmatchcase(path.rsplit("/", 1)[-1], file_pattern):
+                continue
+            content = self.contents[path]
+            if literal not in content or anywhere.search(content) is None:
+                continue
+            for lineno, text in enumerate(content.split("\n"), 1):
+                if (path, lineno) in seen or not regex.search(text):
+                    continue
+                results.append(f"./{path}:{lineno}:{text}")
+                if len(results) >= limit:
+                    return results
+        return results
+
+
+def normalize_path(path: str) -> str:
+    """
+    Path relative to the repository root (`/testbed`), as stored in the index.
+    """
+    path = path.strip()
+    if path.startswith("/testbed/"):
+        path = path[len("/testbed/"):]
+    while path.startswith("./"):
+        path = path[2:]
+    return path
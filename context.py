@@ -0,0 +1,220 @@
+"""
+Context policies applied to the rendered message list before it is sent to the LLM.
+
+A policy receives the agent and the messages in OpenAI API format (one entry per
+message in `agent.id_to_message`, same order) and returns a new list of the same
+length. Policies never drop messages, so `messages[i]` always corresponds to the
+message with unique_id `i`; they only replace content with a shorter stand-in.
+"""
+
+from abc import ABC, abstractmethod
+import hashlib
+from typing import Any, Dict, List
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token for English text and code).
+    """
+    return (len(text) + 3) // 4
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    """
+    Estimate the prompt size of a list of OpenAI-format messages.
+    """
+    return sum(estimate_tokens(message["content"]) for message in messages)
+
+
+class ContextPolicy(ABC):
+    """Abstract base class for context policies."""
+
+    name: str = "context_policy"
+
+    @abstractmethod
+    def apply(self, agent: Any, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        Return the messages to send to the LLM for the current step.
+        Must not modify `messages` or its entries in place.
+        """
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Metrics to record in the trajectory.
+        """
+        return {}
+
+
+class TokenBudgetPolicy(ContextPolicy):
+    """
+    Keeps the prompt under a token budget by eliding old tool outputs.
+
+    The system prompt, the task and the most recent `keep_recent_turns` turns
+    (assistant message + tool result) are always sent verbatim. Older tool outputs
+    are replaced, oldest first, by a head/tail excerpt until the prompt fits.
+    Elisions are sticky: once a message is elided it stays elided, so the prompt
+    prefix does not change between steps unless something new has to be elided.
+    """
+
+    name = "token_budget"
+
+    def __init__(self, max_tokens: int, keep_recent_turns: int = 5, excerpt_chars: int = 400):
+        self.max_tokens = max_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.excerpt_chars = excerpt_chars
+
+        # message id -> number of characters elided
+        self.elided: Dict[int, int] = {}
+
+    def apply(self, agent: Any, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        messages = list(messages)
+        protected = {agent.system_message_id, agent.user_message_id}
+        protected.update(range(max(len(messages) - 2 * self.keep_recent_turns, 0), len(messages)))
+
+        for message_id in self.elided:
+            messages[message_id] = self._elide(agent, message_id, messages[message_id])
+
+        prompt_tokens = estimate_prompt_tokens(messages)
+        for message_id, message in enumerate(agent.id_to_message):
+            if prompt_tokens <= self.max_tokens:
+                break
+            if message_id in protected or message_id in self.elided or message["role"] != "tool":
+                continue
+            before = estimate_tokens(messages[message_id]["content"])
+            elided = self._elide(agent, message_id, messages[message_id])
+            after = estimate_tokens(elided["content"])
+            if after >= before:
+                # The excerpt and its marker are not shorter than this output
+                continue
+            messages[message_id] = elided
+            self.elided[message_id] = len(message["content"])
+            prompt_tokens -= before - after
+        return messages
+
+    def _elide(self, agent: Any, message_id: int, rendered: Dict[str, str]) -> Dict[str, str]:
+        # Excerpt what earlier policies left of the message, not its raw content
+        header = agent.message_header(agent.id_to_message[message_id])
+        content = rendered["content"].removeprefix(header).removesuffix("\n")
+        half = self.excerpt_chars // 2
+        if len(content) <= self.excerpt_chars:
+            return rendered
+        excerpt = (
+            f"[tool output elided to save context: {len(content)} chars, showing first and last {half}]\n"
+            f"{content[:half]}\n...\n{content[-half:]}"
+        )
+        elided = {"role": rendered["role"], "content": f"{header}{excerpt}\n"}
+        return elided if len(elided["content"]) < len(rendered["content"]) else rendered
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_tokens": self.max_tokens,
+            "elided_message_ids": sorted(self.elided),
+            "elided_chars": sum(self.elided.values()),
+        }
+
+
+class DeduplicationPolicy(ContextPolicy):
+    """
+    Replaces redundant tool outputs with a short back-reference to a newer message.
+
+    A tool output is redundant when a later tool message has identical content
+    (compared by content hash), or when it is a `show_file` view and a later
+    `show_file` of the same path covers the same line range. The newest copy is
+    always kept verbatim.
+    """
+
+    name = "deduplication"
+
+    def __init__(self, min_chars: int = 200):
+        self.min_chars = min_chars
+
+        # message id -> (content length, sha1 digest); tool outputs never change after creation
+        self._digests: Dict[int, tuple] = {}
+        self.deduplicated: Dict[int, int] = {}
+        self.tokens_saved_last_step = 0
+        self.tokens_saved_total = 0
+
+    def apply(self, agent: Any, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        messages = list(messages)
+        newest_by_digest: Dict[str, int] = {}
+        newest_views: Dict[str, List[tuple]] = {}
+        tokens_saved = 0
+
+        for message_id in range(len(agent.id_to_message) - 1, -1, -1):
+            message = agent.id_to_message[message_id]
+            if message["role"] != "tool" or len(message["content"]) < self.min_chars:
+                continue
+
+            digest = self._digest(message)
+            newer_id = newest_by_digest.setdefault(digest, message_id)
+            if newer_id == message_id:
+                newer_id = self._covering_view(message, newest_views)
+            view = _file_view(message)
+            if view is not None:
+                newest_views.setdefault(view[0], []).append((view[1], view[2], message_id))
+            if newer_id is None or newer_id == message_id:
+                continue
+
+            before = estimate_tokens(messages[message_id]["content"])
+            messages[message_id] = {
+                "role": messages[message_id]["role"],
+                "content": (
+                    f"{agent.message_header(message)}"
+                    f"[output omitted: superseded by the output of message id={newer_id}]\n"
+                ),
+            }
+            tokens_saved += before - estimate_tokens(messages[message_id]["content"])
+            self.deduplicated[message_id] = newer_id
+
+        self.tokens_saved_last_step = tokens_saved
+        self.tokens_saved_total += tokens_saved
+        return messages
+
+    def _digest(self, message: Dict[str, Any]) -> str:
+        cached = self._digests.get(message["unique_id"])
+        if cached is None or cached[0] != len(message["content"]):
+            digest = hashlib.sha1(message["content"].encode("utf-8", errors="replace")).hexdigest()
+            cached = (len(message["content"]), digest)
+            self._digests[message["unique_id"]] = cached
+        return cached[1]
+
+    @staticmethod
+    def _covering_view(message: Dict[str, Any], newest_views: Dict[str, List[tuple]]):
+        view = _file_view(message)
+        if view is None:
+            return None
+        path, start, end = view
+        for newer_start, newer_end, newer_id in newest_views.get(path, []):
+            if newer_start <= start and (newer_end is None or (end is not None and newer_end >= end)):
+                return newer_id
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "deduplicated_message_ids": sorted(self.deduplicated),
+            "tokens_saved_last_step": self.tokens_saved_last_step,
+            "tokens_saved_total": self.tokens_saved_total,
+        }
+
+
+def _file_view(message: Dict[str, Any]):
+    """
+    Return (path, start_line, end_line) for a successful `show_file` result, else None.
+    """
+    tool_call = message.get("tool_call")
+    if not tool_call or tool_call["name"] != "show_file":
+        return None
+    if message["content"].startswith("Error reading file"):
+        return None
+    arguments = tool_call["arguments"]
+    try:
+        start = int(arguments.get("start_line", 1))
+        end = arguments.get("end_line")
+        end = int(end) if end not in (None, "", "None") else None
+    except (TypeError, ValueError):
+        return None
+    path = str(arguments.get("file_path", "")).strip()
+    if path.startswith("./"):
+        path = path[2:]
+    return path, start, end
@@ -0,0 +1,133 @@
+"""
+Local cache of dataset instances, for fast startup.
+
+Resolving a dataset with `datasets.load_dataset` takes seconds even when it is
+already downloaded. The instances of a (dataset, split) are therefore stored once
+as an Arrow IPC file, which is memory-mapped on later starts: selecting instances
+reads only the `instance_id` column, and only the selected rows are converted to
+Python objects. Without pyarrow the cache is a JSON-lines file.
+"""
+
+import importlib.util
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+DEFAULT_CACHE_DIR = Path("~/.cache/cs264/datasets").expanduser()
+
+
+def parse_slice(spec: str) -> slice:
+    """
+    Parse a Python slice "start:stop[:step]" (e.g. "0:5", "-3:", "::2"); a single number selects one item.
+    """
+    parts = spec.split(":")
+    try:
+        if len(parts) == 1:
+            index = int(parts[0])
+            return slice(index, index + 1 or None)
+        if len(parts) > 3:
+            raise ValueError
+        return slice(*(int(part) if part.strip() else None for part in parts))
+    except ValueError:
+        raise ValueError(f"Invalid slice {spec!r}, expected start:stop[:step]") from None
+
+
+def select_ids(
+    ids: List[str],
+    instance_ids: Optional[Iterable[str]] = None,
+    pattern: str = "",
+    selection: Optional[slice] = None,
+) -> List[int]:
+    """
+    Indices of the selected instances in dataset order: those listed in
+    `instance_ids` (all if None), whose id matches `pattern`, then `selection` of these.
+    """
+    wanted = set(instance_ids) if instance_ids is not None else None
+    if wanted is not None and (missing := wanted - set(ids)):
+        raise ValueError(f"Unknown instance ids: {', '.join(sorted(missing))}")
+    regex = re.compile(pattern) if pattern else None
+    indices = [
+        index for index, instance_id in enumerate(ids)
+        if (wanted is None or instance_id in wanted) and (regex is None or regex.search(instance_id))
+    ]
+    return indices[selection] if selection is not None else indices
+
+
+def _arrow():
+    # Imported on first use, it is slow to import
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def cache_path(cache_dir: Path, dataset: str, split: str) -> Path:
+    key = re.sub(r"[^A-Za-z0-9._-]+", "_", f"{dataset}--{split}").strip("_")
+    # Only the suffix depends on pyarrow, so it is looked up without importing it
+    has_arrow = importlib.util.find_spec("pyarrow") is not None
+    return Path(cache_dir) / (f"{key}.arrow" if has_arrow else f"{key}.jsonl")
+
+
+def _write_cache(path: Path, instances: list) -> None:
+    pa = _arrow()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        if pa is not None:
+            os.close(fd)
+            table = pa.Table.from_pylist(instances)
+            with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        else:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(instance) + "\n" for instance in instances)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def _read_cache(path: Path, select) -> list:
+    pa = _arrow()
+    if pa is not None:
+        with pa.memory_map(str(path)) as source:
+            table = pa.ipc.open_file(source).read_all()
+            indices = select(table.column("instance_id").to_pylist())
+            return table.take(indices).to_pylist()
+    with open(path, encoding="utf-8") as f:
+        instances = [json.loads(line) for line in f]
+    return [instances[index] for index in select([instance["instance_id"] for instance in instances])]
+
+
+def load_instances(
+    dataset: str,
+    split: str,
+    cache_dir: Optional[Path] = DEFAULT_CACHE_DIR,
+    refresh: bool = False,
+    instance_ids: Optional[Iterable[str]] = None,
+    pattern: str = "",
+    selection: Optional[slice] = None,
+) -> list:
+    """
+    The selected instances of a dataset split (see `select_ids`), from the local
+    cache if present (`cache_dir` None = no cache, `refresh` = reload it).
+    """
+    select = lambda ids: select_ids(ids, instance_ids, pattern, selection)
+    path = cache_path(cache_dir, dataset, split) if cache_dir is not None else None
+    if path is not None and path.exists() and not refresh:
+        return _read_cache(path, select)
+
+    from datasets import load_dataset
+
+    instances = list(load_dataset(dataset, split=split))
+    if path is not None:
+        try:
+            _write_cache(path, instances)
+        except Exception as e:
+            print(f"Could not cache dataset {dataset} ({split}) in {path}: {e}")
+    return [instances[index] for index in select([instance["instance_id"] for instance in instances])]
@@ -1,6 +1,41 @@
 from utils import get_sb_environment
+from shell import PersistentShell, docker_exec_argv
+from code_index import CodeIndex
+from file_cache import FileCache, number_lines
+from scheduler import LOAD_SIGNALS
+from file_edit import decode, encode, parse_edits, read_files, replace_once, unified_diff, write_files
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+import asyncio
+import functools
 import subprocess
-import swebench
+import threading
+import time
+
+# Shared pool that runs blocking tool calls (docker exec) for async agents
+_TOOL_EXECUTOR = None
+_TOOL_EXECUTOR_LOCK = threading.Lock()
+DEFAULT_TOOL_WORKERS = 64
+
+
+def configure_tool_executor(max_workers: int) -> None:
+    """
+    Set the number of threads used to run tool calls for async agents.
+    Must be called before the first `SWEEnvironment.acall`.
+    """
+    global _TOOL_EXECUTOR
+    with _TOOL_EXECUTOR_LOCK:
+        if _TOOL_EXECUTOR is not None:
+            _TOOL_EXECUTOR.shutdown(wait=False)
+        _TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+
+
+def _tool_executor() -> ThreadPoolExecutor:
+    global _TOOL_EXECUTOR
+    with _TOOL_EXECUTOR_LOCK:
+        if _TOOL_EXECUTOR is None:
+            _TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=DEFAULT_TOOL_WORKERS, thread_name_prefix="tool")
+        return _TOOL_EXECUTOR
 
 class LimitsExceeded(Exception):
     """Raised when the agent has reached its step limit."""
@@ -14,9 +49,68 @@ class SWEEnvironment:
     - execute(command: str) -> str: Run a shell command and return stdout, or raise ValueError on failure
     """
 
-    def __init__(self, instance: dict):
+    def __init__(self, instance: dict, shell: str = "exec", code_index: bool = False, file_cache: bool = False):
         self.env = get_sb_environment(instance)
         self.instance = instance  # Store instance for test execution
+        # "exec": one `docker exec` per command; "persistent": one long-lived bash session
+        self.shell = PersistentShell.for_docker(self.env) if shell == "persistent" else None
+        # File list, contents and definitions index serving find_file and search_in_files
+        self.index = None
+        if code_index:
+            try:
+                self.index = CodeIndex(self._run)
+            except Exception as e:
+                print(f"Could not build code index, falling back to find/grep: {e}")
+        # Contents of viewed files, serving show_file without re-reading them
+        self.file_cache = FileCache(self._run) if file_cache else None
+
+    def execute(self, command: str) -> dict | str:
+        """
+        Run a command in the container through the configured shell backend.
+        Falls back to a plain `docker exec` if the persistent session breaks.
+        """
+        if self.shell is not None:
+            try:
+                return self.shell.execute(command)
+            except RuntimeError as e:
+                print(f"Persistent shell failed, falling back to docker exec: {e}")
+                self.shell.close()
+        return self.env.execute(command)
+
+    def close(self) -> None:
+        """
+        Release the persistent shell session, if any, and stop the container.
+        """
+        if self.shell is not None:
+            self.shell.close()
+        if hasattr(self.env, "cleanup"):
+            self.env.cleanup()
+
+    @classmethod
+    async def acreate(cls, instance: dict, shell: str = "exec", code_index: bool = False, file_cache: bool = False) -> "SWEEnvironment":
+        """
+        Create the environment (image pull and container start) without blocking the event loop.
+        """
+        return await asyncio.to_thread(cls, instance, shell, code_index, file_cache)
+
+    def stats(self) -> dict:
+        """
+        Counters of the environment's caches, for the trajectory.
+        """
+        stats = {}
+        if self.file_cache is not None:
+            stats["file_cache"] = self.file_cache.stats()
+        return stats
+
+    async def acall(self, func: Callable, **kwargs) -> Any:
+        """
+        Run a tool of this environment without blocking the event loop.
+
+        Tool calls are short docker round trips, so they run on a shared, bounded
+        thread pool (see `configure_tool_executor`) while LLM calls stay on the loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_tool_executor(), functools.partial(func, **kwargs))
      
     # -------------------- REQUIRED TOOLS --------------------
     def run_bash_cmd(self, command: str) -> str:
@@ -30,8 +124,22 @@ class SWEEnvironment:
         Returns:
             The output of running the shell command
         """
+        # Arbitrary commands may create, delete or edit files
+        if self.index is not None:
+            self.index.mark_dirty()
+        if self.file_cache is not None:
+            self.file_cache.invalidate()
+        return self._run(command)
+
+    def _run(self, command: str, sample_latency: bool = False) -> str:
+        """
+        Run a command for a tool implementation (see `run_bash_cmd`). With
+        `sample_latency` (cheap commands of fixed cost only) its latency is reported
+        to the scheduler as a load signal.
+        """
+        start = time.monotonic()
         try:
-            output = self.env.execute(command)
+            output = self.execute(command)
             
             # Handle case where execute returns a dict instead of string
             if isinstance(output, dict):
@@ -42,14 +150,39 @@ class SWEEnvironment:
             raise ValueError(output)
         except TimeoutError:
             raise ValueError("TimeoutError")
+        finally:
+            if sample_latency:
+                LOAD_SIGNALS.record_tool_latency(time.monotonic() - start)
         return output
     
+    def snapshot_patch(self) -> str:
+        """
+        The current changes to the repository (including new and binary files) as a patch.
+        """
+        return self._run("git add -A && git diff --cached --binary")
+
+    def apply_patch(self, patch: str) -> None:
+        """
+        Re-apply a patch from `snapshot_patch` to a fresh container (e.g. to resume an agent).
+        """
+        if not patch.strip():
+            return
+        path = "/tmp/.resume.patch"
+        write_files(docker_exec_argv(self.env), {path: encode(patch)}, self.env.config.timeout)
+        output = self.execute(f"git apply --whitespace=nowarn {path}; status=$?; rm -f {path}; exit $status")
+        if isinstance(output, dict) and output.get("returncode"):
+            raise ValueError(f"Could not apply patch: {output.get('output', '')}")
+        if self.index is not None:
+            self.index.mark_dirty()
+        if self.file_cache is not None:
+            self.file_cache.invalidate()
+
     def generate_patch(self, result: str) -> str:
         """
         Generate a patch from the result (for SWE-Bench)
         """
         try:
-            patch_output = self.env.execute("git add -A && git diff --cached")
+            patch_output = self.execute("git add -A && git diff --cached")
             
             # Handle case where execute returns a dict instead of string
             if isinstance(patch_output, dict):
@@ -66,7 +199,7 @@ class SWEEnvironment:
     def replace_in_file(self, file_path: str, old_str: str, new_str: str) -> str:
         """
         Replace old_str with new_str in the specified file.
-        Uses Python to avoid shell escaping issues.
+        The file bytes are read and written directly, so no escaping is involved.
         
         Args:
             file_path (str): Path to the file to modify
@@ -77,31 +210,77 @@ class SWEEnvironment:
             Success message or error description
         """
         try:
-            # Use Python heredoc to avoid all shell escaping issues
-            python_cmd = f'''python3 << 'EOFMARKER'
-with open("{file_path}", "r") as f:
-    content = f.read()
+            content = read_files(self._run, [file_path])[file_path]
+            if content is None:
+                return f"Error: File not found: {file_path}"
+            new_text = replace_once(decode(content), old_str, new_str)
+            if new_text is None:
+                return "ERROR: Could not find the specified text in file\n"
+            self._write_texts({file_path: new_text})
+            return f"Successfully replaced text in {file_path}\n"
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    def apply_edits(self, edits: str) -> str:
+        """
+        Apply several exact-text replacements, in one or more files, all at once.
+        Either every edit is applied or (if any old text is not found) none is.
+        Each edit replaces the first occurrence of its old text, after the previous
+        edits of the same file. Edits are written as:
 
-old_str = {repr(old_str)}
-new_str = {repr(new_str)}
+        ----FILE----
+        path/to/file.py
+        ----OLD----
+        exact text to replace (copied from show_file, without line numbers)
+        ----NEW----
+        replacement text
 
-if old_str not in content:
-    print("ERROR: Could not find the specified text in file")
-    exit(1)
+        Args:
+            edits (str): One or more edits in the format above
 
-new_content = content.replace(old_str, new_str, 1)
+        Returns:
+            A unified diff of the changes, or an error description
+        """
+        try:
+            parsed = parse_edits(edits)
+            paths = list(dict.fromkeys(path for path, _, _ in parsed))
+            contents = read_files(self._run, paths)
+            missing = [path for path in paths if contents[path] is None]
+            if missing:
+                return f"Error: File not found: {', '.join(missing)}. No files were changed."
 
-with open("{file_path}", "w") as f:
-    f.write(new_content)
+            before = {path: decode(contents[path]) for path in paths}
+            after = dict(before)
+            for i, (path, old_str, new_str) in enumerate(parsed, 1):
+                new_text = replace_once(after[path], old_str, new_str)
+                if new_text is None:
+                    return f"Error: edit {i} ({path}): could not find the specified text in file. No files were changed."
+                after[path] = new_text
 
-print("Successfully replaced text in {file_path}")
-EOFMARKER
-'''
-            result = self.run_bash_cmd(python_cmd)
-            return result
+            changed = {path: text for path, text in after.items() if text != before[path]}
+            if not changed:
+                return "No changes: every edit replaces text with identical text."
+            self._write_texts(changed)
+            diff = "".join(unified_diff(path, before[path], changed[path]) for path in changed)
+            # Undecodable bytes must not reach the LLM request
+            return encode(diff).decode("utf-8", errors="replace")
         except Exception as e:
             return f"Error: {str(e)}"
 
+    def _write_texts(self, texts: dict) -> None:
+        """
+        Write new file contents (path -> text) in one round trip and update the caches.
+        """
+        stamps = write_files(docker_exec_argv(self.env), {path: encode(text) for path, text in texts.items()}, self.env.config.timeout)
+        for path, text in texts.items():
+            if self.index is not None:
+                self.index.mark_dirty(path)
+            if self.file_cache is not None:
+                if path in stamps:
+                    self.file_cache.put(path, stamps[path], encode(text).decode("utf-8", errors="replace"))
+                else:
+                    self.file_cache.invalidate(path)
+
     def show_file(self, file_path: str, start_line: int = 1, end_line: int = None) -> str:
         """
         Show the content of a file with line numbers.
@@ -115,8 +294,13 @@ EOFMARKER
             The file content with line numbers
         """
         try:
+            if self.file_cache is not None:
+                cached = self._show_cached(file_path, start_line, end_line)
+                if cached is not None:
+                    return cached
+
             # First check if file exists
-            self.run_bash_cmd(f"test -f {file_path}")
+            self._run(f"test -f {file_path}", sample_latency=True)
             
             if end_line is not None:
                 # Show specific line range with line numbers
@@ -125,9 +309,32 @@ EOFMARKER
                 # Show from start_line to end with line numbers
                 cmd = f"tail -n +{start_line} {file_path} | nl -v {start_line}"
             
-            return self.run_bash_cmd(cmd)
+            return self._run(cmd)
         except Exception as e:
             return f"Error reading file {file_path}: {str(e)}"
+
+    def _show_cached(self, file_path: str, start_line, end_line) -> str | None:
+        """
+        `show_file` output rendered from the file cache, identical to the
+        `sed`/`tail` + `nl` pipeline, or None when the cache cannot serve it.
+        """
+        try:
+            start = int(start_line)
+            end = int(end_line) if end_line is not None else None
+        except (TypeError, ValueError):
+            return None
+        # sed rejects line 0 (tail treats +0 as +1)
+        if end is not None and start < 1:
+            return None
+        lines = self.file_cache.lines(file_path)
+        if lines is None:
+            return None
+        if end is None:
+            selected = lines[max(start, 1) - 1:]
+        else:
+            # `sed -n 'a,bp'` with b < a prints line a alone
+            selected = lines[start - 1:max(end, start)]
+        return number_lines(selected, start)
     
     def find_file(self, filename: str) -> str:
         """
@@ -140,8 +347,12 @@ EOFMARKER
             Paths to matching files
         """
         try:
+            if self.index is not None:
+                matches = self.index.find_files(filename)
+                if matches:
+                    return "".join(f"./{path}\n" for path in matches)
             cmd = f"find . -name '{filename}' -type f 2>/dev/null | head -20"
-            return self.run_bash_cmd(cmd)
+            return self._run(cmd)
         except Exception as e:
             return f"Error finding file: {str(e)}"
     
@@ -157,8 +368,10 @@ EOFMARKER
             Lines containing the pattern with file names and line numbers
         """
         try:
+            if self.index is not None:
+                return "".join(f"{line}\n" for line in self.index.search(pattern, file_pattern))
             cmd = f"grep -rn '{pattern}' --include='{file_pattern}' . 2>/dev/null | head -50"
-            return self.run_bash_cmd(cmd)
+            return self._run(cmd)
         except Exception as e:
             return f"Error searching: {str(e)}"
     
@@ -174,7 +387,7 @@ EOFMARKER
         """
         try:
             cmd = f"ls -la {path}"
-            return self.run_bash_cmd(cmd)
+            return self._run(cmd, sample_latency=True)
         except Exception as e:
             return f"Error listing directory: {str(e)}"
 
@@ -0,0 +1,217 @@
+"""
+Pipelined SWE-bench evaluation.
+
+Instead of running the harness over `preds.json` after the whole run, each
+prediction is handed to `EvaluationPool` as soon as its instance finishes. A worker
+applies the patch in a fresh container of the instance image (already pulled for the
+agent, so nothing is built or pulled again), runs the harness's eval script there and
+grades the log with the harness's own grading code. Every result is appended to
+`eval.jsonl` (per shard, like the prediction logs) and `final_results.json` is
+rewritten in the harness report format after each one. A prediction without a diff
+(the agent changed nothing) is recorded as unresolved without starting a container.
+"""
+
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable
+
+from predictions import PredictionStore, append_records, read_records, shard_logs, write_json_atomic
+from utils import get_swebench_docker_image_name
+
+EVAL_LOG = "eval"
+RESULTS_FILE = "final_results.json"
+PATCH_FILE = "/tmp/patch.diff"
+EVAL_SCRIPT = "/eval.sh"
+# Tried in order (on a clean tree), like the harness
+APPLY_COMMANDS = [
+    "git apply --verbose",
+    "git apply --verbose --3way",
+    "patch --batch --forward --fuzz=5 -p1 -i",
+]
+
+
+def is_empty_patch(patch: str) -> bool:
+    """
+    True if `patch` holds no diff, e.g. the "No changes detected" text of `generate_patch`.
+    """
+    return not patch or "diff --git" not in patch
+
+
+def make_test_spec(instance: dict):
+    # Its module moved between swebench releases
+    try:
+        from swebench.harness.utils import make_test_spec
+    except ImportError:
+        try:
+            from swebench.harness.test_spec.test_spec import make_test_spec
+        except ImportError:
+            from swebench.harness.test_spec import make_test_spec
+    return make_test_spec(instance)
+
+
+def apply_script() -> str:
+    """
+    Shell script applying PATCH_FILE in /testbed and printing the harness's apply markers.
+    """
+    from swebench.harness.constants import APPLY_PATCH_FAIL, APPLY_PATCH_PASS
+
+    attempts = [f"{APPLY_COMMANDS[0]} {PATCH_FILE}"]
+    attempts += [f"(git checkout -- . && git clean -fdq && {command} {PATCH_FILE})" for command in APPLY_COMMANDS[1:]]
+    return f"cd /testbed && ({' || '.join(attempts)}) && echo '{APPLY_PATCH_PASS}' || echo '{APPLY_PATCH_FAIL}'"
+
+
+def _docker(args: list, timeout: float | None = None, input: bytes | None = None) -> subprocess.CompletedProcess:
+    return subprocess.run(["docker", *args], input=input, capture_output=True, timeout=timeout)
+
+
+def run_evaluation(instance: dict, patch: str, log_path: Path, timeout: float) -> None:
+    """
+    Apply `patch` and run the eval script in a new container of the instance image,
+    writing the combined output to `log_path`.
+    """
+    from swebench.harness.constants import TESTS_TIMEOUT
+
+    test_spec = make_test_spec(instance)
+    name = f"eval-{instance['instance_id'].replace('__', '_')}-{uuid.uuid4().hex[:8]}".lower()
+    started = _docker(["run", "-d", "--name", name, get_swebench_docker_image_name(instance), "tail", "-f", "/dev/null"], timeout=300)
+    if started.returncode != 0:
+        raise RuntimeError(f"Could not start evaluation container: {started.stderr.decode(errors='replace').strip()}")
+    try:
+        for path, content in ((PATCH_FILE, patch), (EVAL_SCRIPT, test_spec.eval_script)):
+            copied = _docker(["exec", "-i", name, "sh", "-c", f"cat > {path}"], timeout=60, input=content.encode("utf-8", "surrogateescape"))
+            if copied.returncode != 0:
+                raise RuntimeError(f"Could not copy {path}: {copied.stderr.decode(errors='replace').strip()}")
+        applied = _docker(["exec", name, "/bin/bash", "-c", apply_script()], timeout=300)
+        log = applied.stdout + applied.stderr
+        try:
+            tests = _docker(["exec", name, "/bin/bash", EVAL_SCRIPT], timeout=timeout)
+            log += tests.stdout + tests.stderr
+        except subprocess.TimeoutExpired as e:
+            log += (e.stdout or b"") + (e.stderr or b"") + f"\n{TESTS_TIMEOUT} after {timeout}s\n".encode()
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        log_path.write_bytes(log)
+    finally:
+        _docker(["rm", "-f", name], timeout=120)
+
+
+def evaluate_instance(instance: dict, patch: str, model_name: str, log_dir: Path, timeout: float) -> dict:
+    """
+    Evaluate one prediction; returns its record for the evaluation log.
+    """
+    instance_id = instance["instance_id"]
+    start = time.monotonic()
+    record = {"instance_id": instance_id}
+    if is_empty_patch(patch):
+        return record | {"status": "unresolved", "empty_patch": True}
+    log_path = log_dir / instance_id / "test_output.txt"
+    try:
+        from swebench.harness.grading import get_eval_report
+
+        run_evaluation(instance, patch, log_path, timeout)
+        prediction = {"instance_id": instance_id, "model_name_or_path": model_name, "model_patch": patch}
+        report = get_eval_report(make_test_spec(instance), prediction, str(log_path), True)[instance_id]
+        status = "resolved" if report["resolved"] else "unresolved"
+        record |= {"status": status, "report": report}
+    except Exception as e:
+        record |= {"status": "error", "error": str(e)}
+    record["seconds"] = round(time.monotonic() - start, 1)
+    return record
+
+
+def results_report(instance_ids: Iterable[str], predictions: Dict[str, dict], evaluations: Dict[str, dict]) -> dict:
+    """
+    Summary in the format of the harness's run report (`final_results.json`).
+    """
+    instance_ids = set(instance_ids) | set(predictions)
+    evaluations = {i: record for i, record in evaluations.items() if i in predictions}
+    ids = {status: sorted(i for i, record in evaluations.items() if record["status"] == status)
+           for status in ("resolved", "unresolved", "error")}
+    # Older logs gave empty patches a status of their own
+    ids["empty_patch"] = sorted(i for i, record in evaluations.items()
+                                if record.get("empty_patch") or record["status"] == "empty_patch")
+    ids["unresolved"] = sorted(set(ids["unresolved"]) | set(ids["empty_patch"]))
+    completed = sorted(set(ids["resolved"] + ids["unresolved"]) - set(ids["empty_patch"]))
+    incomplete = sorted(instance_ids - set(completed) - set(ids["empty_patch"]))
+    return {
+        "total_instances": len(instance_ids),
+        "submitted_instances": len(predictions),
+        "completed_instances": len(completed),
+        "resolved_instances": len(ids["resolved"]),
+        "unresolved_instances": len(ids["unresolved"]),
+        "empty_patch_instances": len(ids["empty_patch"]),
+        "error_instances": len(ids["error"]),
+        "completed_ids": completed,
+        "incomplete_ids": incomplete,
+        "empty_patch_ids": ids["empty_patch"],
+        "submitted_ids": sorted(predictions),
+        "resolved_ids": ids["resolved"],
+        "unresolved_ids": ids["unresolved"],
+        "error_ids": ids["error"],
+        "schema_version": 2,
+    }
+
+
+class EvaluationPool:
+    """
+    Evaluates submitted predictions on `max_workers` threads and keeps
+    `output_dir/final_results.json` up to date. `instance_ids` are all instances
+    selected for the run (the report's total).
+    """
+
+    def __init__(
+        self,
+        output_dir: Path,
+        instance_ids: Iterable[str],
+        predictions: PredictionStore,
+        model_name: str,
+        max_workers: int = 8,
+        timeout: float = 1800.0,
+        shard: str | None = None,
+    ):
+        self.output_dir = Path(output_dir)
+        self.instance_ids = list(instance_ids)
+        self.predictions = predictions
+        self.model_name = model_name
+        self.timeout = timeout
+        self.log = self.output_dir / (f"{EVAL_LOG}.{shard}.jsonl" if shard else f"{EVAL_LOG}.jsonl")
+        self.log_dir = self.output_dir / "eval_logs"
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="eval")
+
+    def evaluations(self) -> Dict[str, dict]:
+        """
+        Evaluation records of all shards.
+        """
+        return read_records(*shard_logs(self.output_dir, EVAL_LOG))
+
+    def submit(self, instance: dict, patch: str) -> Future | None:
+        """
+        Queue `patch` for evaluation; an empty patch is recorded right away instead.
+        """
+        if is_empty_patch(patch):
+            self._evaluate(instance, patch)
+            return None
+        return self.executor.submit(self._evaluate, instance, patch)
+
+    def _evaluate(self, instance: dict, patch: str) -> None:
+        record = evaluate_instance(instance, patch, self.model_name, self.log_dir, self.timeout)
+        append_records(self.log, [record])
+        print(f"Evaluated instance {instance['instance_id']}: {record['status']}")
+        self.write_report()
+
+    def write_report(self) -> dict:
+        with self.lock:
+            report = results_report(self.instance_ids, self.predictions.predictions(), self.evaluations())
+            write_json_atomic(self.output_dir / RESULTS_FILE, report)
+        return report
+
+    def close(self) -> dict:
+        """
+        Wait for the submitted evaluations and write the final report.
+        """
+        self.executor.shutdown(wait=True)
+        return self.write_report()
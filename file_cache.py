@@ -0,0 +1,134 @@
+"""
+Per-environment cache of file contents served to `show_file`.
+
+A file is read from the container once (content plus its `stat` stamp) and later
+views of any line range are rendered locally. Entries are dropped precisely when a
+tool edits the file, and after arbitrary shell commands every cached file is
+re-stamped with a single `stat` call, keeping only the ones that did not change.
+"""
+
+import shlex
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from code_index import normalize_path
+
+_HEADER = "__FILE_CACHE_STAMP__ "
+# Modification time with nanoseconds, size and inode: changes with any rewrite of the file
+STAT_FORMAT = "%y|%s|%i"
+
+
+def number_lines(lines: List[str], start: int) -> str:
+    """
+    Render `lines` exactly like `nl -v start`: non-empty lines are numbered in a
+    six-wide column followed by a tab, empty lines are padded and not counted.
+    """
+    out = []
+    number = start
+    for line in lines:
+        if line:
+            out.append(f"{number:>6}\t{line}\n")
+            number += 1
+        else:
+            out.append("       \n")
+    return "".join(out)
+
+
+class FileCache:
+    """
+    Contents of files viewed in the container, keyed by normalized path and
+    validated by their `stat` stamp. `execute` runs a shell command and returns its output.
+    """
+
+    def __init__(self, execute: Callable[[str], str]):
+        self.execute = execute
+        self.entries: Dict[str, Tuple[str, List[str]]] = {}
+        # Set after arbitrary commands: every entry must be re-stamped before use
+        self.stale = False
+        # Read-only tools may run concurrently; only the sweep needs to be exclusive
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.sweeps = 0
+
+    def lines(self, path: str) -> Optional[List[str]]:
+        """
+        Lines of the regular file `path` (without line endings), or None if it is not
+        a readable regular file.
+        """
+        path = normalize_path(path)
+        if self.stale:
+            with self.lock:
+                if self.stale:
+                    self.sweep()
+        entry = self.entries.get(path)
+        if entry is not None:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        quoted = shlex.quote(path)
+        output = self.execute(
+            f"test -f {quoted} && test -r {quoted} && printf '{_HEADER}' && stat -c '{STAT_FORMAT}' -- {quoted} && cat -- {quoted}"
+        )
+        if not output.startswith(_HEADER):
+            return None
+        header, _, content = output.partition("\n")
+        lines = content.split("\n")
+        # A trailing newline does not start another line
+        if lines and lines[-1] == "":
+            lines.pop()
+        self.entries[path] = (header[len(_HEADER):], lines)
+        return lines
+
+    def put(self, path: str, stamp: str, content: str) -> None:
+        """
+        Store content a tool has just written, with the stamp `stat` reported after the write.
+        """
+        lines = content.split("\n")
+        if lines and lines[-1] == "":
+            lines.pop()
+        self.entries[normalize_path(path)] = (stamp, lines)
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        """
+        Forget `path` after a tool edited it, or (None) mark every entry for re-validation.
+        """
+        if path is None:
+            if self.entries:
+                self.stale = True
+        elif self.entries.pop(normalize_path(path), None) is not None:
+            self.invalidations += 1
+
+    def sweep(self) -> None:
+        """
+        Re-stamp every cached file with one `stat` call and drop the ones that changed.
+        """
+        self.stale = False
+        if not self.entries:
+            return
+        self.sweeps += 1
+        quoted = " ".join(shlex.quote(path) for path in sorted(self.entries))
+        output = self.execute(f"stat -c '{STAT_FORMAT}|%n' -- {quoted} 2>/dev/null; true")
+        current = {}
+        for line in output.splitlines():
+            mtime, _, rest = line.partition("|")
+            size, _, rest = rest.partition("|")
+            inode, _, path = rest.partition("|")
+            current[path] = f"{mtime}|{size}|{inode}"
+        for path in list(self.entries):
+            if current.get(path) != self.entries[path][0]:
+                del self.entries[path]
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "sweeps": self.sweeps,
+            "cached_files": len(self.entries),
+        }
+
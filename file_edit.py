@@ -0,0 +1,154 @@
+"""
+File edits applied by moving file bytes instead of running an interpreter in the container.
+
+Files are read with one command (base64-encoded, so any content survives the text
+output of `execute`), replacements are applied locally, and the new contents are
+streamed back as a tar archive to a single `docker exec -i`, which writes every
+file in place only after the whole archive was received. Paths are passed as
+arguments, never interpolated into shell code.
+"""
+
+import base64
+import difflib
+import io
+import shlex
+import subprocess
+import tarfile
+from typing import Callable, Dict, List, Optional, Tuple
+
+from file_cache import STAT_FORMAT
+
+_MARKER = "__FILE_EDIT_BYTES__"
+
+_READ_SCRIPT = (
+    'for f in "$@"; do '
+    f'if [ -f "$f" ] && [ -r "$f" ]; then printf "\\n{_MARKER} OK\\n"; base64 < "$f"; '
+    f'else printf "\\n{_MARKER} MISSING\\n"; fi; done'
+)
+# Extract the archive (members named 0, 1, ...) to a temporary directory, then copy
+# each member over its target (keeping the target's inode, owner and mode)
+_WRITE_SCRIPT = (
+    'set -e; d=$(mktemp -d); trap \'rm -rf "$d"\' EXIT; tar -x -C "$d" -f -; '
+    'i=0; for f in "$@"; do cat "$d/$i" > "$f"; i=$((i + 1)); done; '
+    f'stat -c "{STAT_FORMAT}" -- "$@"'
+)
+
+EDIT_FILE = "----FILE----"
+EDIT_OLD = "----OLD----"
+EDIT_NEW = "----NEW----"
+
+
+def read_files(execute: Callable[[str], str], paths: List[str]) -> Dict[str, Optional[bytes]]:
+    """
+    Contents of `paths` (None for a path that is not a readable regular file),
+    fetched with one command.
+    """
+    quoted = " ".join(shlex.quote(path) for path in paths)
+    output = execute(f"sh -c {shlex.quote(_READ_SCRIPT)} sh {quoted}")
+    sections = output.split(f"\n{_MARKER} ")[1:]
+    if len(sections) != len(paths):
+        raise ValueError(f"Could not read files: {output.strip()}")
+    contents = {}
+    for path, section in zip(paths, sections):
+        status, _, encoded = section.partition("\n")
+        contents[path] = base64.b64decode(encoded) if status == "OK" else None
+    return contents
+
+
+def write_files(argv: List[str], contents: Dict[str, bytes], timeout: float = 60) -> Dict[str, str]:
+    """
+    Write `contents` (path -> bytes) through one `docker exec -i` (`argv` up to the
+    container id, see `shell.docker_exec_argv`). Returns the `stat` stamp of each
+    written file (see `FileCache`).
+    """
+    paths = list(contents)
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        for i, path in enumerate(paths):
+            info = tarfile.TarInfo(str(i))
+            info.size = len(contents[path])
+            tar.addfile(info, io.BytesIO(contents[path]))
+    result = subprocess.run(
+        argv + ["sh", "-c", _WRITE_SCRIPT, "sh", *paths],
+        input=archive.getvalue(),
+        capture_output=True,
+        timeout=timeout,
+    )
+    if result.returncode != 0:
+        raise ValueError(f"Could not write files: {result.stderr.decode('utf-8', errors='replace').strip()}")
+    stamps = result.stdout.decode("utf-8", errors="replace").splitlines()
+    return dict(zip(paths, stamps))
+
+
+def decode(content: bytes) -> str:
+    """
+    File bytes as text that encodes back to the very same bytes.
+    """
+    return content.decode("utf-8", errors="surrogateescape")
+
+
+def encode(text: str) -> bytes:
+    return text.encode("utf-8", errors="surrogateescape")
+
+
+def replace_once(text: str, old_str: str, new_str: str) -> Optional[str]:
+    """
+    `text` with the first occurrence of `old_str` replaced by `new_str`, or None if
+    it does not occur. In files with CRLF line endings, `old_str` / `new_str`
+    written with plain newlines are matched and inserted with CRLF.
+    """
+    if old_str in text:
+        return text.replace(old_str, new_str, 1)
+    if "\r\n" in text and "\n" in old_str and "\r\n" not in old_str:
+        crlf_old = old_str.replace("\n", "\r\n")
+        if crlf_old in text:
+            return text.replace(crlf_old, new_str.replace("\n", "\r\n"), 1)
+    return None
+
+
+def parse_edits(text: str) -> List[Tuple[str, str, str]]:
+    """
+    Parse a batch of edits, each written as
+
+        ----FILE----
+        path
+        ----OLD----
+        exact text to replace
+        ----NEW----
+        replacement text
+
+    into (path, old_str, new_str) tuples. One newline around each text is not part of it.
+    """
+    edits = []
+    for block in text.split(EDIT_FILE)[1:]:
+        path, sep, rest = block.partition(EDIT_OLD)
+        old_str, sep_new, new_str = rest.partition(EDIT_NEW)
+        path = path.strip()
+        if not sep or not sep_new or not path:
+            raise ValueError(f"Invalid edit for {path or 'unknown file'}: expected {EDIT_FILE}, {EDIT_OLD} and {EDIT_NEW} sections")
+        edits.append((path, _strip_newline(old_str), _strip_newline(new_str)))
+    if not edits:
+        raise ValueError(f"No edits found: each edit must start with {EDIT_FILE}")
+    return edits
+
+
+def _strip_newline(text: str) -> str:
+    if text.startswith("\n"):
+        text = text[1:]
+    if text.endswith("\n"):
+        text = text[:-1]
+    return text
+
+
+def unified_diff(path: str, before: str, after: str, context: int = 2) -> str:
+    """
+    Compact unified diff of one file's change.
+    """
+    lines = difflib.unified_diff(
+        before.splitlines(keepends=True),
+        after.splitlines(keepends=True),
+        fromfile=f"a/{path}",
+        tofile=f"b/{path}",
+        n=context,
+    )
+    return "".join(line if line.endswith("\n") else line + "\n\\ No newline at end of file\n" for line in lines)
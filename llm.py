@@ -1,10 +1,182 @@
 from abc import ABC, abstractmethod
-from openai import OpenAI
+from typing import Optional
+import asyncio
 import os
-import json
+import random
+import threading
+import time
+import uuid
 from pathlib import Path
 from datetime import datetime
 
+from call_log import ConversationLog
+from scheduler import LOAD_SIGNALS
+
+
+# USD per 1M tokens: (input, cached input, output). Reasoning tokens are billed as output.
+MODEL_PRICING = {
+    "gpt-5": (1.25, 0.125, 10.00),
+    "gpt-5-mini": (0.25, 0.025, 2.00),
+    "gpt-5-nano": (0.05, 0.005, 0.40),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "cached_prompt_tokens", "reasoning_tokens")
+
+
+def usage_to_dict(usage) -> Optional[dict]:
+    """
+    Flatten an OpenAI `CompletionUsage` into the fields we account for.
+    """
+    if usage is None:
+        return None
+    prompt_details = getattr(usage, "prompt_tokens_details", None)
+    completion_details = getattr(usage, "completion_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+        "cached_prompt_tokens": (getattr(prompt_details, "cached_tokens", None) or 0) if prompt_details else 0,
+        "reasoning_tokens": (getattr(completion_details, "reasoning_tokens", None) or 0) if completion_details else 0,
+    }
+
+
+def usage_cost(usage: dict, model_name: str) -> Optional[float]:
+    """
+    Cost in USD of the given token counts, or None if the model's pricing is unknown.
+    """
+    pricing = MODEL_PRICING.get(model_name)
+    if pricing is None:
+        return None
+    input_price, cached_price, output_price = pricing
+    uncached = usage["prompt_tokens"] - usage["cached_prompt_tokens"]
+    return (
+        uncached * input_price
+        + usage["cached_prompt_tokens"] * cached_price
+        + usage["completion_tokens"] * output_price
+    ) / 1e6
+
+
+def summarize_usage(usages: list, model_name: str) -> dict:
+    """
+    Aggregate per-call usage dicts into totals, cached-prompt ratio and cost.
+
+    Estimated usage (streamed calls closed before the usage chunk) carries no cache
+    information, so the cached-prompt ratio is taken over reported usage only and
+    estimated calls are priced as fully uncached.
+    """
+    summary = {
+        "calls": len(usages),
+        "estimated_calls": sum(1 for usage in usages if usage.get("estimated")),
+    }
+    for field in USAGE_FIELDS:
+        summary[field] = sum(usage.get(field, 0) for usage in usages)
+    summary["reported_prompt_tokens"] = sum(
+        usage.get("prompt_tokens", 0) for usage in usages if not usage.get("estimated")
+    )
+    summary["cached_prompt_ratio"] = (
+        summary["cached_prompt_tokens"] / summary["reported_prompt_tokens"]
+        if summary["reported_prompt_tokens"] else 0.0
+    )
+    summary["model"] = model_name
+    summary["cost_usd"] = usage_cost(summary, model_name)
+    return summary
+
+
+def merge_usage_summaries(summaries: list) -> dict:
+    """
+    Roll up per-instance usage summaries (possibly for different models) into run totals.
+    """
+    counted = ("calls", "estimated_calls", *USAGE_FIELDS, "reported_prompt_tokens")
+    total = {**{field: 0 for field in counted}, "cost_usd": 0.0}
+    for summary in summaries:
+        for field in counted:
+            total[field] += summary.get(field, 0)
+        if summary.get("cost_usd") is None:
+            total["cost_usd"] = None
+        elif total["cost_usd"] is not None:
+            total["cost_usd"] += summary["cost_usd"]
+    total["cached_prompt_ratio"] = (
+        total["cached_prompt_tokens"] / total["reported_prompt_tokens"] if total["reported_prompt_tokens"] else 0.0
+    )
+    return total
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` units per minute.
+
+    `reserve` takes the units immediately (the balance may go negative) and returns
+    how long the caller must wait before using them, so concurrent callers are
+    queued fairly without holding the lock while sleeping.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+            self.updated = now
+            self.available -= min(amount, self.capacity)
+            return max(0.0, -self.available / self.rate)
+
+
+class RateLimiter:
+    """
+    Process-wide requests/min and tokens/min limiter shared by all `OpenAIModel`s.
+    A limit of 0 disables that bucket.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+
+    def reserve(self, requests: int, tokens: int) -> float:
+        """
+        Reserve capacity and return the number of seconds to wait before sending.
+        """
+        delay = 0.0
+        if self.requests is not None and requests:
+            delay = max(delay, self.requests.reserve(requests))
+        if self.tokens is not None and tokens:
+            delay = max(delay, self.tokens.reserve(tokens))
+        return delay
+
+    def acquire(self, tokens: int) -> None:
+        delay = self.reserve(1, tokens)
+        if delay:
+            time.sleep(delay)
+
+    async def aacquire(self, tokens: int) -> None:
+        delay = self.reserve(1, tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+
+_RATE_LIMITER: Optional[RateLimiter] = None
+
+
+def configure_rate_limiter(requests_per_minute: float = 0, tokens_per_minute: float = 0) -> None:
+    """
+    Install the rate limiter shared by every `OpenAIModel` in this process.
+    Pass zeros to disable rate limiting.
+    """
+    global _RATE_LIMITER
+    if requests_per_minute > 0 or tokens_per_minute > 0:
+        _RATE_LIMITER = RateLimiter(requests_per_minute, tokens_per_minute)
+    else:
+        _RATE_LIMITER = None
+
+
+class FatalLLMError(RuntimeError):
+    """Raised by an LLM when retrying the step cannot succeed; the agent stops instead."""
+
 
 class LLM(ABC):
     """Abstract base class for Large Language Models."""
@@ -17,6 +189,75 @@ class LLM(ABC):
         """
         raise NotImplementedError
 
+    async def agenerate(self, messages: list) -> str:
+        """
+        Async variant of `generate`. The default runs `generate` in a worker thread;
+        implementations with a native async client should override it.
+        """
+        return await asyncio.to_thread(self.generate, messages)
+
+
+class StreamCollector:
+    """
+    Accumulates streamed completion chunks and detects the stop token as it arrives.
+
+    Only the new delta plus the last `len(stop_token) - 1` characters are searched,
+    so detection is linear in the length of the completion. With `streaming` (a
+    `StreamingResponseParser` whose END_CALL is the stop token), the deltas are fed
+    to it instead, so the call's markers are located while it streams.
+    """
+
+    def __init__(self, stop_token: str, start: float, streaming=None):
+        self.stop_token = stop_token
+        self.start = start
+        self.streaming = streaming
+        self.parts: list = []
+        self.tail = ""
+        self.time_to_first_token: Optional[float] = None
+        self.time_to_call: Optional[float] = None
+        self.usage: Optional[dict] = None
+
+    def add(self, chunk) -> bool:
+        """
+        Add a chunk; return True once the stop token has been seen.
+        """
+        if getattr(chunk, "usage", None) is not None:
+            self.usage = usage_to_dict(chunk.usage)
+        if not chunk.choices:
+            return False
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            return False
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.monotonic() - self.start
+        if self.streaming is not None:
+            if self.streaming.feed(delta):
+                self.time_to_call = time.monotonic() - self.start
+                return True
+            return False
+        self.parts.append(delta)
+        window = self.tail + delta
+        if self.stop_token in window:
+            self.time_to_call = time.monotonic() - self.start
+            return True
+        self.tail = window[-(len(self.stop_token) - 1):] if len(self.stop_token) > 1 else ""
+        return False
+
+    def text(self) -> str:
+        if self.streaming is not None:
+            return self.streaming.text()
+        return "".join(self.parts)
+
+    def metrics(self) -> dict:
+        return {
+            "stream": True,
+            "latency": time.monotonic() - self.start,
+            "time_to_first_token": self.time_to_first_token,
+            "time_to_call": self.time_to_call,
+            "stopped_early": self.time_to_call is not None,
+            "usage": self.usage,
+        }
+
 
 class OpenAIModel(LLM):
     """
@@ -27,17 +268,55 @@ class OpenAIModel(LLM):
     format required by ResponseParser and include the stop token in the output string.
     """
 
-    def __init__(self, stop_token: str, model_name: str = "gpt-5-mini", log_dir: Path = None):
+    # Retry transient failures (429, 5xx, connection errors) with exponential backoff
+    RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        stop_token: str,
+        model_name: str = "gpt-5-mini",
+        log_dir: Path = None,
+        max_retries: int = 6,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        stream: bool = False,
+        conversation_id: Optional[str] = None,
+        compress_log: bool = False,
+        parser=None,
+    ):
         # Initialize OpenAI client
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY environment variable not set")
         
-        self.client = OpenAI(api_key=api_key)
+        self.api_key = api_key
+        # openai is slow to import, so it is imported when a client is created
+        from openai import OpenAI
+
+        # Retries are handled here (with the shared rate limiter), not by the client
+        self.client = OpenAI(api_key=api_key, max_retries=0)
+        # Created on first use by `agenerate`
+        self.async_client = None
         self.stop_token = stop_token
         self.model_name = model_name
         self.log_dir = log_dir
         self.call_count = 0
+        # Calls are logged as deltas against the previous call of this conversation
+        self.conversation_log = None
+        if log_dir:
+            log_file = Path(log_dir) / ("llm_calls.jsonl.gz" if compress_log else "llm_calls.jsonl")
+            self.conversation_log = ConversationLog(log_file, conversation_id or uuid.uuid4().hex)
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.retry_count = 0
+        # Stream completions and stop reading as soon as the stop token appears
+        self.stream = stream
+        # Single-call ResponseParser fed while streaming; it parses the call as the stream closes
+        self.parser = parser if parser is not None and not parser.multi_call else None
+        self._streaming = None
+        # One record per successful call: latency, streaming timings, retries
+        self.call_metrics: list = []
 
     def generate(self, messages: list) -> str:
         """
@@ -49,36 +328,210 @@ class OpenAIModel(LLM):
         Returns:
             The text response from the model including the stop token
         """
+        request = self._request_kwargs(messages)
+        attempt = 0
+        while True:
+            if _RATE_LIMITER is not None:
+                _RATE_LIMITER.acquire(self._estimate_tokens(request))
+            try:
+                text, metrics = self._complete(request)
+                self._record_metrics(metrics, attempt, request, text)
+                return self._finish_call(messages, text)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise self._failed_call(messages, e) from e
+            attempt += 1
+            self.retry_count += 1
+            time.sleep(delay)
+
+    async def agenerate(self, messages: list) -> str:
+        """
+        Async variant of `generate` on `AsyncOpenAI`, so a single event loop can
+        drive many concurrent instances.
+        """
+        if self.async_client is None:
+            from openai import AsyncOpenAI
+
+            self.async_client = AsyncOpenAI(api_key=self.api_key, max_retries=0)
+        request = self._request_kwargs(messages)
+        attempt = 0
+        while True:
+            if _RATE_LIMITER is not None:
+                await _RATE_LIMITER.aacquire(self._estimate_tokens(request))
+            try:
+                text, metrics = await self._acomplete(request)
+                self._record_metrics(metrics, attempt, request, text)
+                return self._finish_call(messages, text)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise self._failed_call(messages, e) from e
+            attempt += 1
+            self.retry_count += 1
+            await asyncio.sleep(delay)
+
+    def _complete(self, request: dict) -> tuple:
+        """
+        Run one completion request and return (text, metrics).
+        """
+        start = time.monotonic()
+        if not self.stream:
+            response = self.client.chat.completions.create(**request)
+            return response.choices[0].message.content, {
+                "stream": False,
+                "latency": time.monotonic() - start,
+                "usage": usage_to_dict(response.usage),
+            }
+
+        stream = self.client.chat.completions.create(**request, stream=True, stream_options={"include_usage": True})
+        self._streaming = self.parser.stream() if self.parser is not None else None
+        collector = StreamCollector(self.stop_token, start, self._streaming)
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                temperature=1,
-                max_completion_tokens=4096,
-            )
-            
-            text = response.choices[0].message.content
+            for chunk in stream:
+                if collector.add(chunk):
+                    break
+        finally:
+            # Closing the stream early stops generation of everything after the call
+            stream.close()
+        return collector.text(), collector.metrics()
 
-            # split from the first stop token (including the stop token)
-            text = text.split(self.stop_token)[0].strip() + "\n" + self.stop_token
-            
-            # Log the LLM call if log_dir is set
-            if self.log_dir:
-                self._log_call(messages, text, success=True)
-            
-            return text
-            
-        except Exception as e:
-            # Log the failed call if log_dir is set
-            if self.log_dir:
-                self._log_call(messages, None, success=False, error=str(e))
-            
-            # Re-raise the exception with more context
-            raise RuntimeError(f"OpenAI API call failed: {type(e).__name__}: {str(e)}") from e
+    async def _acomplete(self, request: dict) -> tuple:
+        """
+        Async variant of `_complete`.
+        """
+        start = time.monotonic()
+        if not self.stream:
+            response = await self.async_client.chat.completions.create(**request)
+            return response.choices[0].message.content, {
+                "stream": False,
+                "latency": time.monotonic() - start,
+                "usage": usage_to_dict(response.usage),
+            }
+
+        stream = await self.async_client.chat.completions.create(
+            **request, stream=True, stream_options={"include_usage": True}
+        )
+        self._streaming = self.parser.stream() if self.parser is not None else None
+        collector = StreamCollector(self.stop_token, start, self._streaming)
+        try:
+            async for chunk in stream:
+                if collector.add(chunk):
+                    break
+        finally:
+            await stream.close()
+        return collector.text(), collector.metrics()
+
+    def _record_metrics(self, metrics: dict, retries: int, request: dict, text: str) -> None:
+        LOAD_SIGNALS.record_llm_call()
+        metrics["call_number"] = len(self.call_metrics) + 1
+        metrics["retries"] = retries
+        if metrics.get("usage") is None:
+            # A stream closed at the stop token never receives the final usage chunk; the
+            # estimate has no cached-token count, so summaries leave it out of the cache ratio
+            metrics["usage"] = {
+                "prompt_tokens": self._estimate_tokens(request) - request.get("max_completion_tokens", 0),
+                "completion_tokens": len(text or "") // 4,
+                "cached_prompt_tokens": 0,
+                "reasoning_tokens": 0,
+                "estimated": True,
+            }
+        self.call_metrics.append(metrics)
+
+    def usage_summary(self) -> dict:
+        """
+        Token usage and cost of all calls made by this model so far.
+        """
+        return summarize_usage([metrics["usage"] for metrics in self.call_metrics], self.model_name)
+
+    def _estimate_tokens(self, request: dict) -> int:
+        """
+        Tokens charged against the tokens/min limit: estimated prompt plus completion cap.
+        """
+        prompt_chars = sum(len(message["content"]) for message in request["messages"])
+        return prompt_chars // 4 + request.get("max_completion_tokens", 0)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        Seconds to wait before retrying after `error`, or None if it should not be retried.
+
+        Honors the server's Retry-After header; otherwise uses exponential backoff
+        with full jitter.
+        """
+        from openai import APIConnectionError, APIStatusError
+
+        if isinstance(error, APIStatusError) and error.status_code == 429:
+            LOAD_SIGNALS.record_llm_call(throttled=True)
+        if attempt >= self.max_retries:
+            return None
+        if isinstance(error, APIStatusError):
+            if error.status_code not in self.RETRYABLE_STATUS_CODES:
+                return None
+            retry_after = _retry_after_seconds(error)
+            if retry_after is not None:
+                return min(retry_after, self.max_backoff)
+        elif not isinstance(error, APIConnectionError):
+            return None
+        return random.uniform(0, min(self.max_backoff, self.initial_backoff * 2 ** attempt))
+
+    def request_params(self) -> dict:
+        """
+        Generation parameters that, together with the messages, determine a completion.
+        """
+        return self.default_request_params(self.model_name, self.stop_token)
+
+    @staticmethod
+    def default_request_params(model_name: str, stop_token: str) -> dict:
+        """
+        `request_params` without an instance (e.g. for cache replay without an API key).
+        """
+        return {
+            "model": model_name,
+            "temperature": 1,
+            "max_completion_tokens": 4096,
+            "stop_token": stop_token,
+        }
+
+    def _request_kwargs(self, messages: list) -> dict:
+        """
+        Keyword arguments for `chat.completions.create`.
+        """
+        params = self.request_params()
+        del params["stop_token"]
+        return {**params, "messages": messages}
+
+    def _finish_call(self, messages: list, text: str) -> str:
+        """
+        Cut the completion at the stop token (re-appending it) and log the call.
+        """
+        # split from the first stop token (including the stop token)
+        text = text.split(self.stop_token)[0].strip() + "\n" + self.stop_token
+        streaming, self._streaming = self._streaming, None
+        if streaming is not None and streaming.complete:
+            streaming.finish(text)
+        
+        # Log the LLM call if log_dir is set
+        if self.log_dir:
+            self._log_call(messages, text, success=True)
+        
+        return text
+
+    def _failed_call(self, messages: list, e: Exception) -> RuntimeError:
+        """
+        Log a failed call and wrap the exception with more context.
+        """
+        # Log the failed call if log_dir is set
+        if self.log_dir:
+            self._log_call(messages, None, success=False, error=str(e))
+        
+        return RuntimeError(f"OpenAI API call failed: {type(e).__name__}: {str(e)}")
     
     def _log_call(self, messages: list, response: str = None, success: bool = True, error: str = None) -> None:
         """
         Log an LLM generation call to a file in the log directory.
+
+        Only the messages appended (or changed) since the previous call are written,
+        by a background thread; see `call_log.read_call_log` to rebuild full prompts.
         
         Args:
             messages: The input messages
@@ -86,12 +539,9 @@ class OpenAIModel(LLM):
             success: Whether the API call was successful
             error: Error message if the call failed
         """
-        if not self.log_dir:
+        if not self.conversation_log:
             return
         
-        # Create log directory if it doesn't exist
-        self.log_dir.mkdir(parents=True, exist_ok=True)
-        
         # Increment call count
         self.call_count += 1
         
@@ -101,7 +551,6 @@ class OpenAIModel(LLM):
             "timestamp": datetime.now().isoformat(),
             "model": self.model_name,
             "success": success,
-            "messages": messages,
             "response": response
         }
         
@@ -109,7 +558,23 @@ class OpenAIModel(LLM):
         if not success and error:
             log_entry["error"] = error
         
-        # Write to log file (append mode)
-        log_file = self.log_dir / "llm_calls.jsonl"
-        with open(log_file, "a") as f:
-            f.write(json.dumps(log_entry) + "\n")
\ No newline at end of file
+        self.conversation_log.record(messages, log_entry)
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    Parse the Retry-After (or retry-after-ms) header of an API error response.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after") is not None:
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        # HTTP-date form is not used by the OpenAI API
+        return None
+    return None
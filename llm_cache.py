@@ -0,0 +1,181 @@
+"""
+Record/replay cache for LLM calls, for deterministic and offline reruns.
+
+`CachingLLM` wraps another LLM (usually `OpenAIModel`). Calls are keyed by a stable
+hash of the message list and the wrapped model's generation parameters and stored
+in a sqlite database, which is safe to share between threads and processes.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from call_log import read_call_log
+from llm import LLM, FatalLLMError
+
+CACHE_MODES = ("record", "replay", "record-on-miss")
+
+
+class CacheMissError(FatalLLMError):
+    """Raised in replay mode when a call is not in the cache."""
+
+
+class LLMCacheStore:
+    """
+    sqlite-backed store of completions with least-recently-used eviction once the
+    stored responses exceed `max_bytes` (0 = unbounded).
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS calls ("
+            " key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER,"
+            " created REAL, last_access REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS calls_last_access ON calls (last_access)")
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM calls WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE calls SET last_access = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, model: str, response: str) -> None:
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO calls (key, model, response, size, created, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now),
+            )
+            if self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM calls").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.conn.execute("SELECT key, size FROM calls ORDER BY last_access").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM calls WHERE key = ?", evicted)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM calls").fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+def cache_key(messages: list, params: dict) -> str:
+    """
+    Stable hash of a call: the messages (role and content only) and generation parameters.
+    """
+    payload = {
+        "params": params,
+        "messages": [{"role": message["role"], "content": message["content"]} for message in messages],
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class CachingLLM(LLM):
+    """
+    LLM wrapper that records completions to, and replays them from, an `LLMCacheStore`.
+
+    Modes:
+    - "record": always call the wrapped LLM and store the result
+    - "replay": serve only from the cache, raising CacheMissError on a miss
+    - "record-on-miss": serve from the cache, calling and storing on a miss
+
+    Other attributes (model_name, call_metrics, ...) are those of the wrapped LLM.
+    """
+
+    def __init__(self, llm: Optional[LLM], store: LLMCacheStore, mode: str = "record-on-miss", params: dict = None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {CACHE_MODES}")
+        if llm is None and mode != "replay":
+            raise ValueError("A wrapped LLM is required unless mode is 'replay'")
+        self.llm = llm
+        self.store = store
+        self.mode = mode
+        if params is None:
+            params = llm.request_params() if hasattr(llm, "request_params") else {"model": getattr(llm, "model_name", None)}
+        self.params = params
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def model_name(self) -> str:
+        return self.params.get("model") or getattr(self.llm, "model_name", None)
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the wrapper itself
+        llm = self.__dict__.get("llm")
+        if llm is None:
+            raise AttributeError(name)
+        return getattr(llm, name)
+
+    def _lookup(self, messages: list) -> tuple:
+        key = cache_key(messages, self.params)
+        if self.mode != "record":
+            cached = self.store.get(key)
+            if cached is not None:
+                self.hits += 1
+                return key, cached
+        self.misses += 1
+        if self.mode == "replay":
+            raise CacheMissError(f"LLM cache miss in replay mode (key {key[:12]})")
+        return key, None
+
+    def generate(self, messages: list) -> str:
+        key, cached = self._lookup(messages)
+        if cached is not None:
+            return cached
+        response = self.llm.generate(messages)
+        self.store.put(key, self.model_name, response)
+        return response
+
+    async def agenerate(self, messages: list) -> str:
+        key, cached = self._lookup(messages)
+        if cached is not None:
+            return cached
+        response = await self.llm.agenerate(messages)
+        self.store.put(key, self.model_name, response)
+        return response
+
+    def cache_stats(self) -> dict:
+        return {"mode": self.mode, "hits": self.hits, "misses": self.misses}
+
+
+def seed_from_call_log(store: LLMCacheStore, log_path: Path, params: dict) -> int:
+    """
+    Load successful calls from an `llm_calls.jsonl` log written by `OpenAIModel`
+    into the cache, so the logged run can be replayed. Returns the number of calls added.
+    """
+    added = 0
+    for entry in read_call_log(log_path):
+        if not entry.get("success") or entry.get("response") is None:
+            continue
+        store.put(cache_key(entry["messages"], params), entry.get("model", params.get("model")), entry["response"])
+        added += 1
+    return added
@@ -0,0 +1,155 @@
+"""
+Out-of-line storage of oversized tool outputs.
+
+A tool output longer than `max_chars` is written to disk under a content-addressed
+handle (identical outputs share one file) and only its head and tail, with the
+handle, go into the message history. The agent pages through the full output with
+the `read_output` and `grep_output` tools.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Any, Dict
+
+from code_index import bre_to_regex
+
+HANDLE_CHARS = 16
+HANDLE_RE = re.compile(rf"[0-9a-f]{{{HANDLE_CHARS}}}")
+MAX_GREP_MATCHES = 100
+MAX_GREP_LINE_CHARS = 300
+
+
+class OutputStore:
+    """
+    Stores tool outputs above `max_chars` characters in `directory` and replaces
+    them with an excerpt of `head_chars` + `tail_chars` characters.
+    """
+
+    def __init__(self, directory: Path, max_chars: int = 20000, head_chars: int = None, tail_chars: int = None):
+        self.directory = Path(directory)
+        self.max_chars = max_chars
+        self.head_chars = head_chars if head_chars is not None else max_chars * 2 // 5
+        self.tail_chars = tail_chars if tail_chars is not None else max_chars * 2 // 5
+        # Handles created by this store (one agent). Other well-formed handles are
+        # read from disk, e.g. those of a run resumed from a checkpoint
+        self.handles: Dict[str, int] = {}
+        self.chars_omitted = 0
+
+    def _path(self, handle: str) -> Path:
+        return self.directory / f"{handle}.txt"
+
+    def put(self, text: str) -> str:
+        """
+        Store `text` and return its handle.
+        """
+        data = text.encode("utf-8", errors="replace")
+        handle = hashlib.sha256(data).hexdigest()[:HANDLE_CHARS]
+        path = self._path(handle)
+        if not path.exists():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first so readers never see a partial output
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        self.handles[handle] = len(text)
+        return handle
+
+    def get(self, handle: str) -> str:
+        handle = handle.strip().strip('"\'')
+        path = self._path(handle)
+        if handle not in self.handles and not (HANDLE_RE.fullmatch(handle) and path.is_file()):
+            raise ValueError(f"Unknown output handle {handle!r}")
+        return path.read_text(encoding="utf-8", errors="replace")
+
+    def excerpt(self, text: str) -> str:
+        """
+        `text` itself if it is short enough, else its stored excerpt with the handle.
+        """
+        if self.max_chars <= 0 or len(text) <= self.max_chars:
+            return text
+        handle = self.put(text)
+        head_end = _line_boundary(text, self.head_chars, forward=False)
+        tail_start = _line_boundary(text, len(text) - self.tail_chars, forward=True)
+        self.chars_omitted += tail_start - head_end
+        return (
+            f"{text[:head_end]}"
+            f"\n... [output truncated: {len(text)} characters ({text.count(chr(10)) + 1} lines) in total, "
+            f"characters {head_end}-{tail_start} omitted. The full output is stored as handle \"{handle}\": "
+            f"page through it with read_output(handle, offset, length) or search it with grep_output(handle, pattern).] ...\n"
+            f"{text[tail_start:]}"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "outputs_stored": len(self.handles),
+            "chars_stored": sum(self.handles.values()),
+            "chars_omitted": self.chars_omitted,
+        }
+
+    # -------------------- TOOLS --------------------
+    def read_output(self, handle: str, offset: int = 0, length: int = 8000) -> str:
+        """
+        Read part of a truncated tool output.
+
+        Args:
+            handle (str): The handle given in the truncated output
+            offset (int): Character offset to start reading at (default 0)
+            length (int): Number of characters to read (default 8000)
+
+        Returns:
+            The requested characters of the stored output
+        """
+        try:
+            text = self.get(handle)
+            offset = max(0, int(offset))
+            # Keep pages below the truncation limit so they are not stored again
+            length = max(0, min(int(length), self.head_chars + self.tail_chars))
+            page = text[offset:offset + length]
+            return f"[characters {offset}-{offset + len(page)} of {len(text)}]\n{page}"
+        except Exception as e:
+            return f"Error reading output: {str(e)}"
+
+    def grep_output(self, handle: str, pattern: str) -> str:
+        """
+        Search a truncated tool output for lines matching a grep-style pattern.
+
+        Args:
+            handle (str): The handle given in the truncated output
+            pattern (str): Pattern to search for
+
+        Returns:
+            Matching lines as "line_number (offset N): text", offsets usable with read_output
+        """
+        try:
+            text = self.get(handle)
+            regex = bre_to_regex(pattern)
+            matches = []
+            offset = 0
+            for lineno, line in enumerate(text.split("\n"), 1):
+                if regex.search(line):
+                    if len(matches) == MAX_GREP_MATCHES:
+                        matches.append(f"... [more than {MAX_GREP_MATCHES} matches]")
+                        break
+                    shown = line if len(line) <= MAX_GREP_LINE_CHARS else line[:MAX_GREP_LINE_CHARS] + " ..."
+                    matches.append(f"{lineno} (offset {offset}): {shown}")
+                offset += len(line) + 1
+            if not matches:
+                return "No matches"
+            return "\n".join(matches) + "\n"
+        except Exception as e:
+            return f"Error searching output: {str(e)}"
+
+
+def _line_boundary(text: str, position: int, forward: bool) -> int:
+    """
+    `position` moved to the nearest line start, if one is within 200 characters.
+    """
+    if forward:
+        newline = text.find("\n", position, position + 200)
+        return newline + 1 if newline != -1 else position
+    newline = text.rfind("\n", max(0, position - 200), position)
+    return newline + 1 if newline != -1 else position
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Append-only store of a run's predictions and per-instance token usage.
+
+Workers append one JSON line per update to `preds.jsonl` / `usage.jsonl` (a single
+`O_APPEND` write, so concurrent writers never interleave and no lock is held);
+every line is stamped with the time it was written ("time") and for each instance
+id the latest line wins; a `"removed"` line deletes it.
+`export` compacts the logs and writes `preds.json` in the format expected by the
+SWE-bench harness and `usage.json` with run totals.
+
+Processes of a sharded or queue-driven run each write their own logs
+(`preds.<shard>.jsonl`); reads and `export` merge the logs of all shards by the
+time of each line, so a re-run of an instance (e.g. after its lease expired) wins
+over an older result in any log.
+
+Usage:
+    python predictions.py OUTPUT_DIR
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict
+
+PREDS_LOG = "preds"
+PREDS_FILE = "preds.json"
+USAGE_LOG = "usage"
+USAGE_FILE = "usage.json"
+
+
+def append_records(path: Path, records: list) -> None:
+    """
+    Append `records` as JSON lines, stamped with the current time (records that
+    already have a "time" keep it). The lines go out in a single write unless the
+    kernel writes only part of them; the rest is then written until every byte is
+    out. If writing fails midway, the partial line is ended (and skipped when read).
+    """
+    if not records:
+        return
+    now = time.time()
+    data = "".join(json.dumps({**record, "time": record.get("time", now)}) + "\n" for record in records).encode("utf-8")
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        view = memoryview(data)
+        try:
+            while view:
+                view = view[os.write(fd, view):]
+        except OSError:
+            if len(view) < len(data):
+                # End the partial line, so the next append starts a line of its own
+                try:
+                    os.write(fd, b"\n")
+                except OSError:
+                    pass
+            raise
+    finally:
+        os.close(fd)
+
+
+def read_records(*paths: Path, keep_removed: bool = False) -> Dict[str, dict]:
+    """
+    The live record of every instance id in the logs: the one with the latest "time"
+    (the later line on ties, and for lines written before records were stamped).
+    With `keep_removed`, latest "removed" records are returned too.
+    A line cut short by a crash is ignored.
+    """
+    latest: Dict[str, dict] = {}
+    for path in paths:
+        if not Path(path).exists():
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                previous = latest.get(record["instance_id"])
+                if previous is None or record.get("time", 0) >= previous.get("time", 0):
+                    latest[record["instance_id"]] = record
+    if keep_removed:
+        return latest
+    return {instance_id: record for instance_id, record in latest.items() if not record.get("removed")}
+
+
+def shard_logs(output_dir: Path, name: str) -> list:
+    """
+    The `<name>.jsonl` and `<name>.<shard>.jsonl` logs in `output_dir`.
+    """
+    return [*Path(output_dir).glob(f"{name}.jsonl"), *sorted(Path(output_dir).glob(f"{name}.*.jsonl"))]
+
+
+def write_json_atomic(path: Path, data) -> None:
+    """
+    Write `data` as JSON to `path` through a temporary file, so readers never see a partial file.
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+class PredictionStore:
+    """
+    Predictions and usage of the run in `output_dir`, written to the logs of `shard`
+    (None = unsharded). An existing `preds.json` / `usage.json` without any log
+    (from an older run) seeds the log on first use.
+    """
+
+    def __init__(self, output_dir: Path, shard: str | None = None):
+        self.output_dir = Path(output_dir)
+        suffix = f".{shard}" if shard else ""
+        self.preds_log = self.output_dir / f"{PREDS_LOG}{suffix}.jsonl"
+        self.usage_log = self.output_dir / f"{USAGE_LOG}{suffix}.jsonl"
+        self._migrate()
+
+    def _migrate(self) -> None:
+        preds_file = self.output_dir / PREDS_FILE
+        if not shard_logs(self.output_dir, PREDS_LOG) and preds_file.exists():
+            append_records(self.preds_log, list(json.loads(preds_file.read_text()).values()))
+        usage_file = self.output_dir / USAGE_FILE
+        if not shard_logs(self.output_dir, USAGE_LOG) and usage_file.exists():
+            instances = json.loads(usage_file.read_text()).get("instances", {})
+            append_records(self.usage_log, [{"instance_id": instance_id, "usage": usage} for instance_id, usage in instances.items()])
+
+    def add(self, instance_id: str, model_name: str, result: str) -> None:
+        append_records(self.preds_log, [{
+            "model_name_or_path": model_name,
+            "instance_id": instance_id,
+            "model_patch": result,
+        }])
+
+    def add_usage(self, instance_id: str, usage: dict | None) -> None:
+        if usage is None:
+            append_records(self.usage_log, [{"instance_id": instance_id, "removed": True}])
+        else:
+            append_records(self.usage_log, [{"instance_id": instance_id, "usage": usage}])
+
+    def remove(self, instance_id: str) -> None:
+        """
+        Drop the prediction and usage of an instance (e.g. before it is re-run).
+        """
+        append_records(self.preds_log, [{"instance_id": instance_id, "removed": True}])
+        append_records(self.usage_log, [{"instance_id": instance_id, "removed": True}])
+
+    def predictions(self) -> Dict[str, dict]:
+        """
+        Predictions of all shards.
+        """
+        return read_records(*shard_logs(self.output_dir, PREDS_LOG))
+
+    def export(self) -> Dict[str, dict]:
+        """
+        Compact this shard's logs and write `preds.json` and `usage.json` merged
+        from all shards. Must not run concurrently with writers of this shard
+        (appends during compaction would be lost).
+        """
+        from llm import merge_usage_summaries
+
+        # Removals are kept: they may supersede an older record in another shard's log
+        self._compact(self.preds_log, list(read_records(self.preds_log, keep_removed=True).values()))
+        self._compact(self.usage_log, list(read_records(self.usage_log, keep_removed=True).values()))
+        predictions = {
+            instance_id: {key: value for key, value in record.items() if key != "time"}
+            for instance_id, record in self.predictions().items()
+        }
+        usage_records = read_records(*shard_logs(self.output_dir, USAGE_LOG))
+        usage = {instance_id: record["usage"] for instance_id, record in usage_records.items()}
+
+        write_json_atomic(self.output_dir / PREDS_FILE, predictions)
+        write_json_atomic(self.output_dir / USAGE_FILE, {
+            "instances": usage,
+            "total": merge_usage_summaries(list(usage.values())),
+        })
+        return predictions
+
+    @staticmethod
+    def _compact(path: Path, records: list) -> None:
+        if not path.exists():
+            return
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+        os.replace(tmp, path)
+
+
+def main(argv: list) -> None:
+    if len(argv) != 1:
+        print(__doc__)
+        sys.exit(1)
+    predictions = PredictionStore(Path(argv[0])).export()
+    print(f"Exported {len(predictions)} predictions to {Path(argv[0]) / PREDS_FILE}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
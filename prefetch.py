@@ -0,0 +1,121 @@
+"""
+Environment prefetching: pull images and start containers ahead of the agent workers.
+
+Image pulls and container starts run on their own bounded pools, so environment setup
+for upcoming instances overlaps with LLM time of the running ones. Ready environments
+are handed to workers through a queue in the order they become ready.
+"""
+
+import queue
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+from utils import get_swebench_docker_image_name
+
+
+def pull_image(image: str) -> None:
+    """
+    Pull `image` unless it is already present locally.
+    """
+    inspect = subprocess.run(["docker", "image", "inspect", image], capture_output=True)
+    if inspect.returncode == 0:
+        return
+    subprocess.run(["docker", "pull", "--quiet", image], check=True, capture_output=True, text=True)
+
+
+class EnvironmentPrefetcher:
+    """
+    Prepares environments for `instances` in order with at most `max_pulls` concurrent
+    image pulls, `max_starts` concurrent container starts and `max_live` containers
+    alive (prepared or in use) at any time.
+
+    Workers call `next()` to get `(instance, env_or_exception)` and `release()` once
+    they are done with the environment, which lets the next container start.
+    `next()` returns None when every instance has been handed out.
+    """
+
+    def __init__(
+        self,
+        instances: list,
+        create_env: Callable[[dict], Any],
+        max_pulls: int = 4,
+        max_starts: int = 4,
+        max_live: int = 24,
+        pull: Callable[[str], None] = pull_image,
+    ):
+        self.instances = list(instances)
+        self.create_env = create_env
+        self.pull = pull
+        self.ready: queue.Queue = queue.Queue()
+        self.live = threading.Semaphore(max_live)
+        self.pull_pool = ThreadPoolExecutor(max_workers=max_pulls, thread_name_prefix="pull")
+        self.start_pool = ThreadPoolExecutor(max_workers=max_starts, thread_name_prefix="start")
+        self.remaining = len(self.instances)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.dispatcher = threading.Thread(target=self._dispatch, name="prefetch", daemon=True)
+
+    def start(self) -> "EnvironmentPrefetcher":
+        self.dispatcher.start()
+        return self
+
+    def _dispatch(self) -> None:
+        # Pulls run ahead of container starts, bounded only by the pull pool
+        pulls = [self.pull_pool.submit(self.pull, get_swebench_docker_image_name(instance)) for instance in self.instances]
+        for instance, pulled in zip(self.instances, pulls):
+            self.live.acquire()
+            if self.stopped.is_set():
+                self.live.release()
+                return
+            try:
+                self.start_pool.submit(self._start, instance, pulled)
+            except RuntimeError:
+                # The start pool was shut down concurrently
+                self.live.release()
+                return
+
+    def _start(self, instance: dict, pulled: Future) -> None:
+        try:
+            pulled.result()
+            env = self.create_env(instance)
+        except Exception as e:
+            self.ready.put((instance, e))
+            return
+        self.ready.put((instance, env))
+
+    def next(self) -> Optional[Tuple[dict, Any]]:
+        with self.lock:
+            if self.remaining == 0 or self.stopped.is_set():
+                return None
+            self.remaining -= 1
+        while not self.stopped.is_set():
+            try:
+                return self.ready.get(timeout=1)
+            except queue.Empty:
+                continue
+        return None
+
+    def release(self) -> None:
+        """
+        Free the live-container slot of an environment that is no longer in use.
+        """
+        self.live.release()
+
+    def shutdown(self, close_env: Callable[[Any], None] = None) -> None:
+        """
+        Stop preparing environments and make `next()` return None. Environments that
+        were prepared but not handed out are passed to `close_env`.
+        """
+        self.stopped.set()
+        self.pull_pool.shutdown(wait=False, cancel_futures=True)
+        self.start_pool.shutdown(wait=True, cancel_futures=True)
+        while True:
+            try:
+                _, env = self.ready.get_nowait()
+            except queue.Empty:
+                break
+            if close_env is not None and not isinstance(env, Exception):
+                close_env(env)
+            self.live.release()
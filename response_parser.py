@@ -10,6 +10,8 @@ class ResponseParser:
     END_CALL = "----END_FUNCTION_CALL----"
     ARG_SEP = "----ARG----"
     VALUE_SEP = "----VALUE----"
+    # Multi-call format only: written after the last call of a response
+    END_CALLS = "----END_FUNCTION_CALLS----"
 
     # Students should include this exact template in the system prompt so the LLM follows it.
     response_format = f"""
@@ -31,6 +33,53 @@ arg2_value (can be multiline)
 DO NOT CHANGE ANY TEST! AS THEY WILL BE USED FOR EVALUATION.
 """
 
+    # Opt-in format with several calls per response (see `parse_all`)
+    multi_call_response_format = f"""
+your_thoughts_here
+...
+{BEGIN_CALL}
+function_name
+{ARG_SEP}
+arg1_name
+{VALUE_SEP}
+arg1_value (can be multiline)
+...
+{END_CALL}
+{BEGIN_CALL}
+another_function_name
+{ARG_SEP}
+arg1_name
+{VALUE_SEP}
+arg1_value (can be multiline)
+...
+{END_CALL}
+{END_CALLS}
+
+You may make several function calls in one response, e.g. to read several files or run
+several searches at once. They are executed in order (read-only tools such as show_file,
+search_in_files, find_file and list_directory run in parallel) and their results are
+returned in the same order, one message per call. If a call that is not read-only fails,
+the calls after it are not executed, and `finish` is only executed if all calls before it
+succeeded. Only batch calls that do not depend on each other's results, and write
+{END_CALLS} after the last call.
+
+DO NOT CHANGE ANY TEST! AS THEY WILL BE USED FOR EVALUATION.
+"""
+
+    def __init__(self, multi_call: bool = False):
+        self.multi_call = multi_call
+        # (response, parsed call) left by `StreamingResponseParser.finish` for `parse`
+        self._streamed = None
+        if multi_call:
+            self.response_format = self.multi_call_response_format
+
+    @property
+    def stop_token(self) -> str:
+        """
+        The marker at which the LLM output is cut.
+        """
+        return self.END_CALLS if self.multi_call else self.END_CALL
+
     def parse(self, text: str) -> dict:
         """
         Parse the function call from `text` using string.rfind to avoid confusion with
@@ -38,6 +87,11 @@ DO NOT CHANGE ANY TEST! AS THEY WILL BE USED FOR EVALUATION.
 
         Returns a dictionary: {"thought": str, "name": str, "arguments": dict}
         """
+        # A streamed response was already parsed when its stream closed
+        streamed, self._streamed = self._streamed, None
+        if streamed is not None and streamed[0] is text:
+            return streamed[1]
+
         # Use rfind to locate the last occurrence of markers
         begin_idx = text.rfind(self.BEGIN_CALL)
         end_idx = text.rfind(self.END_CALL)
@@ -48,71 +102,209 @@ DO NOT CHANGE ANY TEST! AS THEY WILL BE USED FOR EVALUATION.
         if end_idx == -1:
             raise ValueError("Could not find END_FUNCTION_CALL marker in response")
         
+        return self._parse_call(text, begin_idx, end_idx)
+
+    def parse_all(self, text: str) -> list:
+        """
+        Parse every complete function call in `text`, in order (multi-call format).
+        A call block is the last BEGIN_CALL before an END_CALL; anything after
+        END_CALLS and an unterminated trailing block are ignored. The thought of
+        each call is the text since the end of the previous call.
+
+        Returns a list of {"thought": str, "name": str, "arguments": dict}.
+        """
+        terminator = text.find(self.END_CALLS)
+        if terminator != -1:
+            text = text[:terminator]
+        if text.find(self.BEGIN_CALL) == -1:
+            raise ValueError("Could not find BEGIN_FUNCTION_CALL marker in response")
+
+        calls = []
+        previous_end = 0
+        search_from = 0
+        while True:
+            end_idx = text.find(self.END_CALL, search_from)
+            if end_idx == -1:
+                break
+            begin_idx = text.rfind(self.BEGIN_CALL, search_from, end_idx)
+            search_from = end_idx + len(self.END_CALL)
+            if begin_idx == -1:
+                continue
+            call = self._parse_call(text, begin_idx, end_idx)
+            call["thought"] = text[previous_end:begin_idx].strip()
+            calls.append(call)
+            previous_end = search_from
+        if not calls:
+            raise ValueError("Could not find END_FUNCTION_CALL marker in response")
+        return calls
+
+    def _parse_call(self, text: str, begin_idx: int, end_idx: int) -> dict:
+        """
+        Parse the call between `begin_idx` (BEGIN_CALL) and `end_idx` (END_CALL) in a
+        single pass over marker positions. Each argument value is sliced out of `text`
+        exactly once.
+        """
         # Extract thought (everything before BEGIN_CALL)
         thought = text[:begin_idx].strip()
         
-        # Extract function call block (between BEGIN_CALL and END_CALL)
-        call_block = text[begin_idx + len(self.BEGIN_CALL):end_idx]
-        
-        # Split the call block into lines
-        lines = call_block.split('\n')
+        block_start = begin_idx + len(self.BEGIN_CALL)
+        block_end = max(end_idx, block_start)
         
         # Extract function name (first non-empty line after BEGIN_CALL)
-        function_name = None
-        for line in lines:
-            stripped = line.strip()
-            if stripped:
-                function_name = stripped
-                break
-        
+        function_name = _first_nonempty_line(text, block_start, block_end)
         if not function_name:
             raise ValueError("Function name cannot be empty")
         
-        # Parse arguments
-        arguments = {}
-        
-        # Split on ARG_SEP to find argument sections
-        arg_sections = call_block.split(self.ARG_SEP)
+        arg_positions = _find_all(text, self.ARG_SEP, block_start, block_end)
         
-        # Skip the first section (contains function name)
-        for section in arg_sections[1:]:
-            # Each section should have format:
-            # arg_name
-            # ----VALUE----
-            # arg_value
-            
-            if self.VALUE_SEP not in section:
-                raise ValueError("Invalid argument format: expected ARG_SEP followed by VALUE_SEP")
-            
-            # Split on VALUE_SEP
-            parts = section.split(self.VALUE_SEP, 1)
+        # Parse arguments; each section has the format:
+        # ----ARG----
+        # arg_name
+        # ----VALUE----
+        # arg_value
+        arguments = {}
+        for i, arg_idx in enumerate(arg_positions):
+            section_start = arg_idx + len(self.ARG_SEP)
+            section_end = arg_positions[i + 1] if i + 1 < len(arg_positions) else block_end
             
-            if len(parts) != 2:
+            value_idx = text.find(self.VALUE_SEP, section_start, section_end)
+            if value_idx == -1:
                 raise ValueError("Invalid argument format: expected ARG_SEP followed by VALUE_SEP")
             
             # Extract argument name (first non-empty line before VALUE_SEP)
-            arg_name = None
-            for line in parts[0].split('\n'):
-                stripped = line.strip()
-                if stripped:
-                    arg_name = stripped
-                    break
-            
+            arg_name = _first_nonempty_line(text, section_start, value_idx)
             if not arg_name:
                 raise ValueError("Invalid argument format: expected ARG_SEP followed by VALUE_SEP")
             
-            # Extract argument value (everything after VALUE_SEP, preserving newlines)
-            # Remove leading newline if present, but preserve internal newlines
-            arg_value = parts[1]
-            if arg_value.startswith('\n'):
-                arg_value = arg_value[1:]
-            # Remove trailing whitespace/newlines
-            arg_value = arg_value.rstrip()
+            # Extract argument value (everything after VALUE_SEP, preserving newlines):
+            # drop one leading newline and all trailing whitespace before slicing
+            value_start = value_idx + len(self.VALUE_SEP)
+            if text.startswith('\n', value_start, section_end):
+                value_start += 1
+            value_end = section_end
+            while value_end > value_start and text[value_end - 1].isspace():
+                value_end -= 1
             
-            arguments[arg_name] = arg_value
+            arguments[arg_name] = text[value_start:value_end]
         
         return {
             "thought": thought,
             "name": function_name,
             "arguments": arguments
         }
+
+    def stream(self) -> "StreamingResponseParser":
+        """
+        Create an incremental parser that can be fed streamed response chunks.
+        """
+        return StreamingResponseParser(self)
+
+
+class StreamingResponseParser:
+    """
+    Feed-based parser for responses that arrive in chunks.
+
+    `feed` searches only the new chunk plus the last `len(END_CALL) - 1` characters
+    of the previous one, the same linear scan as the LLM's stop token detection,
+    and returns True at the first END_CALL (where the LLM cuts its output).
+    `finish` then parses the call while the stream is closed and hands the result
+    to the parser, so `ResponseParser.parse` of the returned response does not
+    search and parse it again.
+    """
+
+    def __init__(self, parser: ResponseParser):
+        self.parser = parser
+        self.parts: list = []
+        self.length = 0
+        self.tail = ""
+        self.begin_idx = -1
+        self.end_idx = -1
+        self._end_call = parser.END_CALL
+        self._overlap = len(parser.END_CALL) - 1
+
+    @property
+    def complete(self) -> bool:
+        return self.end_idx != -1
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Add a chunk of the response. Returns True once END_CALL has arrived;
+        further chunks are ignored.
+        """
+        if self.end_idx != -1:
+            return True
+        window = self.tail + chunk
+        self.parts.append(chunk)
+        self.length += len(chunk)
+        idx = window.find(self._end_call)
+        if idx == -1:
+            self.tail = window[-self._overlap:]
+            return False
+        self.end_idx = self.length - len(window) + idx
+        self.begin_idx = self.text().rfind(self.parser.BEGIN_CALL, 0, self.end_idx)
+        return True
+
+    def text(self) -> str:
+        """
+        The response received so far.
+        """
+        if len(self.parts) > 1:
+            self.parts = ["".join(self.parts)]
+        return self.parts[0] if self.parts else ""
+
+    def result(self) -> dict:
+        """
+        Parse the completed call. Raises ValueError if no complete call was seen.
+        """
+        if self.end_idx == -1:
+            raise ValueError("Could not find END_FUNCTION_CALL marker in response")
+        if self.begin_idx == -1:
+            raise ValueError("Could not find BEGIN_FUNCTION_CALL marker in response")
+        return self.parser._parse_call(self.text(), self.begin_idx, self.end_idx)
+
+    def finish(self, response: str) -> None:
+        """
+        Parse the completed call of `response`, the streamed text as the LLM returns
+        it (cut after END_CALL and stripped), and keep the result for the parser's
+        next `parse(response)`. A response that does not parse is left to `parse`.
+        """
+        if self.begin_idx == -1:
+            return
+        text = self.text()
+        # Positions in `response` are shifted by the whitespace stripped from the start
+        begin_idx = self.begin_idx - (len(text) - len(text.lstrip()))
+        end_idx = len(response) - len(self.parser.END_CALL)
+        if not (response.startswith(self.parser.BEGIN_CALL, begin_idx) and response.endswith(self.parser.END_CALL)):
+            return
+        try:
+            parsed = self.parser._parse_call(response, begin_idx, end_idx)
+        except ValueError:
+            return
+        self.parser._streamed = (response, parsed)
+
+
+def _find_all(text: str, marker: str, start: int, end: int) -> list:
+    """
+    Positions of all non-overlapping occurrences of `marker` in text[start:end].
+    """
+    positions = []
+    idx = text.find(marker, start, end)
+    while idx != -1:
+        positions.append(idx)
+        idx = text.find(marker, idx + len(marker), end)
+    return positions
+
+
+def _first_nonempty_line(text: str, start: int, end: int) -> str:
+    """
+    The first non-blank line of text[start:end], stripped ("" if there is none).
+    """
+    while start < end:
+        line_end = text.find('\n', start, end)
+        if line_end == -1:
+            line_end = end
+        stripped = text[start:line_end].strip()
+        if stripped:
+            return stripped
+        start = line_end + 1
+    return ""
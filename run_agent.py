@@ -1,105 +1,518 @@
 #!/usr/bin/env python3
+import asyncio
 import concurrent.futures
+import dataclasses
 import subprocess
 from pathlib import Path
 import os
+import re
+import shutil
 
 import typer
-from datasets import load_dataset
 
-from utils import save_traj, update_preds_file, remove_from_preds_file, get_sb_environment
+from utils import save_traj, get_sb_environment
 
 app = typer.Typer(rich_markup_mode="rich", add_completion=False)
 
 DATASET_MAPPING = {
     "cs264": "lynnliu030/swebench-eval-subset",
 }
+# Written in <output>/<instance_id>/ while an instance runs, removed once it completes
+CHECKPOINT_FILE = "checkpoint.jsonl"
 
 from agent import ReactAgent
-from llm import OpenAIModel
+from context import DeduplicationPolicy, TokenBudgetPolicy
+from llm import OpenAIModel, configure_rate_limiter
+from llm_cache import CACHE_MODES, CachingLLM, LLMCacheStore, seed_from_call_log
+from call_log import flush_log_writer
+from output_store import OutputStore
+from predictions import PREDS_LOG, PredictionStore, read_records, shard_logs
+from checkpoint import Checkpoint
+from trajectory import TrajectoryWriter, trajectory_info
 from response_parser import ResponseParser
-from envs import SWEEnvironment, DumbEnvironment
+from envs import SWEEnvironment, DumbEnvironment, configure_tool_executor
+from prefetch import EnvironmentPrefetcher
+from scheduler import AdaptiveScheduler, instance_repo, order_instances
+from work_queue import WorkQueue, in_shard, parse_shard
+from evaluation import EvaluationPool
+from dataset_cache import DEFAULT_CACHE_DIR, load_instances, parse_slice
 
-def process_instance(
-    instance: dict,
-    output_dir: Path,
-    model_name: str,
-    max_steps: int,
-) -> None:
-    """Process a single SWEBench instance."""
-    instance_id = instance["instance_id"]
-    instance_dir = output_dir / instance_id
-    
-    # Avoid inconsistent state if something here fails and there's leftover previous files
-    remove_from_preds_file(output_dir / "preds.json", instance_id)
-    (instance_dir / f"{instance_id}.traj.json").unlink(missing_ok=True)
-    
+@dataclasses.dataclass
+class RunConfig:
+    """Per-instance settings shared by all workers of a run."""
+
+    output_dir: Path
+    model_name: str
+    max_steps: int
+    context_budget: int = 0
+    keep_recent_turns: int = 5
+    dedup_outputs: bool = False
+    stream: bool = False
+    # Shared LLM record/replay cache (None = disabled)
+    llm_cache: LLMCacheStore | None = None
+    cache_mode: str = "record-on-miss"
+    # Write delta-encoded LLM call logs to the output directory
+    log_llm_calls: bool = False
+    compress_log: bool = False
+    # Tool command backend: "exec" (docker exec per command) or "persistent" (one bash session)
+    shell: str = "exec"
+    # Serve find_file / search_in_files from an index built at environment start
+    code_index: bool = False
+    # Serve show_file from file contents cached in the agent process
+    file_cache: bool = False
+    # Let the model make several function calls per response
+    multi_call: bool = False
+    # Tool outputs longer than this are stored out of line (0 = never)
+    max_output_chars: int = 0
+    # Checkpoint every step, with a working tree snapshot after steps that changed files
+    checkpoint: bool = False
+    # Continue interrupted instances from their checkpoints (implies checkpoint)
+    resume: bool = False
+    # Append messages to <instance>.traj.jsonl as they are created instead of writing .traj.json at the end
+    stream_traj: bool = False
+    # Append-only predictions/usage logs (created for output_dir if not given)
+    predictions: PredictionStore | None = None
+    # Evaluate each prediction as soon as its instance finishes (None = after the run, if at all)
+    evaluator: EvaluationPool | None = None
+
+    def __post_init__(self):
+        if self.predictions is None:
+            self.predictions = PredictionStore(self.output_dir)
+
+
+def create_env(instance: dict, config: RunConfig) -> SWEEnvironment:
+    """Start the environment for one instance."""
+    return SWEEnvironment(instance, shell=config.shell, code_index=config.code_index, file_cache=config.file_cache)
+
+
+def build_llm(config: RunConfig, instance_id: str, parser: ResponseParser):
+    """Create the LLM for one instance, wrapped in the record/replay cache if enabled."""
+    if config.llm_cache is None:
+        return new_model(config, instance_id, parser)
+    if config.cache_mode == "replay":
+        # Replay never calls the API, so it must not require an API key
+        params = OpenAIModel.default_request_params(config.model_name, parser.stop_token)
+        return CachingLLM(None, config.llm_cache, mode="replay", params=params)
+    return CachingLLM(new_model(config, instance_id, parser), config.llm_cache, mode=config.cache_mode)
+
+
+def new_model(config: RunConfig, instance_id: str, parser: ResponseParser) -> OpenAIModel:
+    return OpenAIModel(
+        parser.stop_token,
+        config.model_name,
+        log_dir=config.output_dir if config.log_llm_calls else None,
+        stream=config.stream,
+        conversation_id=instance_id,
+        compress_log=config.compress_log,
+        parser=parser,
+    )
+
+
+def build_agent(env: SWEEnvironment, config: RunConfig) -> ReactAgent:
+    """Create the model, parser and agent for one instance and register the environment tools."""
     # Initialize the model and parser
-    llm = OpenAIModel(ResponseParser.END_CALL, model_name)
-    parser = ResponseParser()
-    task = instance["problem_statement"]
+    parser = ResponseParser(multi_call=config.multi_call)
+    llm = build_llm(config, env.instance["instance_id"], parser)
+
+    context_policies = []
+    if config.dedup_outputs:
+        context_policies.append(DeduplicationPolicy())
+    if config.context_budget > 0:
+        context_policies.append(TokenBudgetPolicy(config.context_budget, keep_recent_turns=config.keep_recent_turns))
+    output_store = None
+    if config.max_output_chars > 0:
+        output_store = OutputStore(config.output_dir / "tool_outputs", max_chars=config.max_output_chars)
+    agent = ReactAgent("swe-agent", parser, llm, context_policies=context_policies, output_store=output_store)
     
+    # Add environment functions to the agent
+    agent.add_functions([
+        env.run_bash_cmd, 
+        env.show_file, 
+        env.replace_in_file,
+        env.apply_edits,
+        env.find_file,
+        env.search_in_files,
+        env.list_directory
+    ])
+    if config.checkpoint or config.resume:
+        # Snapshots cost a full-repo diff in the container, so only runs that may be resumed pay for them
+        agent.checkpoint = Checkpoint(checkpoint_path(config, env.instance["instance_id"]), snapshot=env.snapshot_patch)
+    if config.stream_traj:
+        agent.set_trajectory_writer(TrajectoryWriter(traj_path(config, env.instance["instance_id"], stream=True)))
+    return agent
+
+
+def checkpoint_path(config: RunConfig, instance_id: str) -> Path:
+    return config.output_dir / instance_id / CHECKPOINT_FILE
+
+
+def completed_instances(output_dir: Path, predictions: dict) -> set:
+    """Instances with a prediction and no (incomplete-run) checkpoint."""
+    return {instance_id for instance_id in predictions if not (output_dir / instance_id / CHECKPOINT_FILE).exists()}
+
+
+def traj_path(config: RunConfig, instance_id: str, stream: bool = False) -> Path:
+    suffix = ".traj.jsonl" if stream else ".traj.json"
+    return config.output_dir / instance_id / f"{instance_id}{suffix}"
+
+
+def resume_agent(agent: ReactAgent, env: SWEEnvironment) -> None:
+    """Restore the agent's messages and the container's changes from its checkpoint, if any."""
+    instance_id = env.instance["instance_id"]
+    state = agent.checkpoint.load()
+    if state is None:
+        return
+    try:
+        env.apply_patch(state["patch"] or "")
+    except Exception as e:
+        print(f"Could not restore the changes of {instance_id}, starting over: {e}")
+        agent.checkpoint.clear()
+        return
+    agent.restore(state)
+    print(f"Resuming instance {instance_id} from step {state['step']}")
+
+
+def start_instance(instance: dict, config: RunConfig) -> None:
+    """Clear leftover outputs of a previous attempt at this instance."""
+    instance_id = instance["instance_id"]
+    # Avoid inconsistent state if something here fails and there's leftover previous files
+    config.predictions.remove(instance_id)
+    traj_path(config, instance_id).unlink(missing_ok=True)
+    if not config.resume:
+        # A resumed instance keeps streaming into its existing trajectory
+        traj_path(config, instance_id, stream=True).unlink(missing_ok=True)
+        checkpoint_path(config, instance_id).unlink(missing_ok=True)
     print(f"Processing instance {instance_id}")
+
+
+def finish_instance(
+    instance: dict,
+    config: RunConfig,
+    agent: ReactAgent | None,
+    result: str,
+    env: SWEEnvironment | Exception | None = None,
+    completed: bool = True,
+) -> None:
+    """
+    Save the trajectory and update the predictions file. The checkpoint of an instance
+    that did not complete is kept (created empty if needed) so `--resume` retries it.
+    """
+    instance_id = instance["instance_id"]
+    env = env if isinstance(env, SWEEnvironment) else None
+    if config.stream_traj:
+        writer = agent.trajectory if agent is not None else None
+        if writer is None:
+            writer = TrajectoryWriter(traj_path(config, instance_id, stream=True))
+        writer.finish(trajectory_info(agent, result, env), instance_id=instance_id)
+        writer.close()
+    else:
+        save_traj(agent, traj_path(config, instance_id), result=result, env=env, instance_id=instance_id)
+    config.predictions.add(instance_id, config.model_name, result)
+    if config.evaluator is not None:
+        config.evaluator.submit(instance, result)
+    usage = agent.llm.usage_summary() if agent is not None and hasattr(agent.llm, "usage_summary") else None
+    config.predictions.add_usage(instance_id, usage)
+    checkpoint = checkpoint_path(config, instance_id)
+    if completed:
+        checkpoint.unlink(missing_ok=True)
+    else:
+        checkpoint.parent.mkdir(parents=True, exist_ok=True)
+        checkpoint.touch()
+    print(f"Completed instance {instance_id}, result: {result}")
+
+
+def process_instance(instance: dict, config: RunConfig, env: SWEEnvironment | Exception | None = None) -> None:
+    """
+    Process a single SWEBench instance.
+
+    `env` is a prefetched environment, or the exception raised while preparing it;
+    if None the environment is created here.
+    """
+    start_instance(instance, config)
     agent = None    
     result = ""
+    completed = False
     
     try:
+        if isinstance(env, Exception):
+            raise env
         # Initialize the environment
-        env = SWEEnvironment(instance)
+        if env is None:
+            env = create_env(instance, config)
         # Initialize the agent
-        agent = ReactAgent("swe-agent", parser, llm)
-        
-        # Add environment functions to the agent
-        agent.add_functions([
-            env.run_bash_cmd, 
-            env.show_file, 
-            env.replace_in_file,
-            env.find_file,
-            env.search_in_files,
-            env.list_directory
-        ])
+        agent = build_agent(env, config)
+        if config.resume:
+            resume_agent(agent, env)
         
         # Run the agent
-        output = agent.run(task, max_steps) 
+        output = agent.run(instance["problem_statement"], config.max_steps) 
         
         # Generate patch for SWE-Bench
         result = env.generate_patch(output)
+        completed = True
         
     except Exception as e:
-        print(f"Error processing instance {instance_id}: {e}")
+        print(f"Error processing instance {instance['instance_id']}: {e}")
         
     finally:
-        # Save the trajectory and update the predictions file
-        save_traj(
-            agent,
-            instance_dir / f"{instance_id}.traj.json",
-            result=result,
-            instance_id=instance_id,
-        )
-        update_preds_file(output_dir / "preds.json", instance_id, model_name, result)
-        print(f"Completed instance {instance_id}, result: {result}")
+        if isinstance(env, SWEEnvironment):
+            env.close()
+        finish_instance(instance, config, agent, result, env, completed)
+
+
+def run_prefetched(prefetcher: EnvironmentPrefetcher, config: RunConfig) -> None:
+    """Worker loop: process prefetched environments until none are left."""
+    while (item := prefetcher.next()) is not None:
+        process_prefetched(prefetcher, config, item)
+
+
+def run_queued(work_queue: WorkQueue, config: RunConfig) -> None:
+    """Worker loop: process instances leased from the work queue until none are left."""
+    while (instance := work_queue.next()) is not None:
+        process_queued(work_queue, config, instance)
+
+
+def process_queued(work_queue: WorkQueue, config: RunConfig, instance: dict) -> None:
+    """Process one leased instance and mark it done in the work queue."""
+    process_instance(instance, config)
+    if not work_queue.complete(instance["instance_id"]):
+        print(f"Lease of instance {instance['instance_id']} expired while it was processed")
+
+
+def process_prefetched(prefetcher: EnvironmentPrefetcher, config: RunConfig, item: tuple) -> None:
+    """Process one `(instance, env)` item of the prefetcher and free its container slot."""
+    instance, env = item
+    try:
+        process_instance(instance, config, env=env)
+    finally:
+        prefetcher.release()
+
+
+async def aprocess_instance(instance: dict, config: RunConfig) -> None:
+    """Process a single SWEBench instance on the event loop (see `ReactAgent.arun`)."""
+    start_instance(instance, config)
+    agent = None
+    env = None
+    result = ""
+    completed = False
+
+    try:
+        env = await asyncio.to_thread(create_env, instance, config)
+        agent = build_agent(env, config)
+        if config.resume:
+            await asyncio.to_thread(resume_agent, agent, env)
+        output = await agent.arun(instance["problem_statement"], config.max_steps, call_tool=env.acall)
+        result = await env.acall(env.generate_patch, result=output)
+        completed = True
+    except Exception as e:
+        print(f"Error processing instance {instance['instance_id']}: {e}")
+    finally:
+        if env is not None:
+            env.close()
+        await asyncio.to_thread(finish_instance, instance, config, agent, result, env, completed)
+
+
+async def run_queue_async(work_queue: WorkQueue, config: RunConfig, concurrency: int) -> None:
+    """Run instances leased from the work queue on one event loop, `concurrency` at a time."""
+
+    async def worker() -> None:
+        while (instance := await asyncio.to_thread(work_queue.next)) is not None:
+            await aprocess_instance(instance, config)
+            if not work_queue.complete(instance["instance_id"]):
+                print(f"Lease of instance {instance['instance_id']} expired while it was processed")
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_instances_async(instances: list, config: RunConfig, concurrency: int) -> None:
+    """Run all instances on one event loop with at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(instance: dict) -> None:
+        async with semaphore:
+            await aprocess_instance(instance, config)
+
+    results = await asyncio.gather(*(run_one(instance) for instance in instances), return_exceptions=True)
+    for instance, outcome in zip(instances, results):
+        if isinstance(outcome, BaseException):
+            print(f"Error in task for instance {instance['instance_id']}: {outcome}")
+
+
+def check_options(cache_mode: str, llm_cache: str, shell: str, llm_cache_seed: str = "") -> list[str]:
+    """Problems with the run options that would only surface once instances start."""
+    problems = []
+    if cache_mode not in CACHE_MODES:
+        problems.append(f"--cache-mode must be one of {', '.join(CACHE_MODES)}, got {cache_mode!r}")
+    if cache_mode == "replay" and not llm_cache:
+        problems.append("--cache-mode replay requires --llm-cache")
+    if llm_cache_seed and not llm_cache:
+        problems.append("--llm-cache-seed requires --llm-cache")
+    if llm_cache_seed and not Path(llm_cache_seed).exists():
+        problems.append(f"--llm-cache-seed: {llm_cache_seed} does not exist")
+    if cache_mode != "replay" and not os.getenv("OPENAI_API_KEY"):
+        problems.append("OPENAI_API_KEY environment variable not set")
+    if shell not in ("exec", "persistent"):
+        problems.append(f"--shell must be exec or persistent, got {shell!r}")
+    if shutil.which("docker") is None:
+        problems.append("docker executable not found")
+    return problems
+
 
 @app.command(help="Run CS 264 HW on subset of SWEBench instances.")
 def main(
     subset: str = typer.Option("cs264", "--subset", help="SWEBench subset used or path to a dataset", rich_help_panel="Data selection"),
     split: str = typer.Option("test", "--split", help="Dataset split", rich_help_panel="Data selection"),
+    instance_ids: str = typer.Option("", "--instance-ids", help="Comma-separated instance ids to run (default: all)", rich_help_panel="Data selection"),
+    id_filter: str = typer.Option("", "--filter", help="Run only instances whose id matches this regex", rich_help_panel="Data selection"),
+    id_slice: str = typer.Option("", "--slice", help="Python slice start:stop[:step] of the selected instances, e.g. 0:5", rich_help_panel="Data selection"),
+    dataset_cache: str = typer.Option(str(DEFAULT_CACHE_DIR), "--dataset-cache", help="Directory caching dataset instances locally (empty = always load the dataset)", rich_help_panel="Data selection"),
+    refresh_dataset: bool = typer.Option(False, "--refresh-dataset", help="Reload the dataset into the local cache", rich_help_panel="Data selection"),
+    shard: str = typer.Option("", "--shard", help="Run only shard i of N (i/N, 0 <= i < N) of the instances; predictions are merged from all shards at export", rich_help_panel="Data selection"),
     output: str = typer.Option("outputs", "-o", "--output", help="Output directory", rich_help_panel="Basic"),
     model_name: str = typer.Option("gpt-5-mini", "--model", help="Model used", rich_help_panel="Basic"),
     max_steps: int = typer.Option(100, "--max-steps", help="Maximum number of steps", rich_help_panel="Basic"),
+    context_budget: int = typer.Option(0, "--context-budget", help="Approximate prompt token budget; old tool outputs are elided beyond it (0 = unlimited)", rich_help_panel="Context"),
+    keep_recent_turns: int = typer.Option(5, "--keep-recent-turns", help="Number of most recent turns always sent verbatim", rich_help_panel="Context"),
+    dedup_outputs: bool = typer.Option(False, "--dedup-outputs", help="Replace repeated or superseded tool outputs with back-references", rich_help_panel="Context"),
+    max_output_chars: int = typer.Option(0, "--max-output-chars", help="Store tool outputs longer than this on disk and keep only an excerpt with a handle the agent can page through (0 = disabled)", rich_help_panel="Context"),
+    shell: str = typer.Option("exec", "--shell", help="Tool command backend: exec (docker exec per command) or persistent (one bash session per container)", rich_help_panel="Execution"),
+    code_index: bool = typer.Option(False, "--code-index", help="Index the repository (file list and text file contents) at environment start to serve find_file/search_in_files from memory", rich_help_panel="Execution"),
+    file_cache: bool = typer.Option(False, "--file-cache", help="Cache viewed file contents in the agent process to serve show_file", rich_help_panel="Execution"),
+    workers: int = typer.Option(20, "--workers", help="Number of worker threads (thread mode)", rich_help_panel="Execution"),
+    min_workers: int = typer.Option(1, "--min-workers", help="Lower bound of the adaptive worker count", rich_help_panel="Execution"),
+    adaptive_max_workers: int = typer.Option(0, "--max-workers", help="Adapt the number of concurrent instances between --min-workers and this from memory, LLM 429 and tool latency signals (0 = fixed --workers)", rich_help_panel="Execution"),
+    queue: str = typer.Option("", "--queue", help="Path of a sqlite work queue shared by worker processes (on one or more hosts with a shared filesystem); instances are leased from it", rich_help_panel="Execution"),
+    lease_seconds: float = typer.Option(600, "--lease-seconds", help="Work queue lease time; leases of a live process are renewed, those of a dead one expire", rich_help_panel="Execution"),
+    prefetch: bool = typer.Option(False, "--prefetch", help="Pull images and start containers ahead of the workers (thread mode)", rich_help_panel="Execution"),
+    max_pulls: int = typer.Option(4, "--max-pulls", help="Concurrent image pulls when prefetching", rich_help_panel="Execution"),
+    max_live_containers: int = typer.Option(0, "--max-live-containers", help="Containers alive at once when prefetching (0 = workers + max pulls)", rich_help_panel="Execution"),
+    use_async: bool = typer.Option(False, "--async", help="Drive all instances from one asyncio event loop instead of a thread pool", rich_help_panel="Execution"),
+    concurrency: int = typer.Option(100, "--concurrency", help="Max instances in flight (async mode)", rich_help_panel="Execution"),
+    tool_workers: int = typer.Option(64, "--tool-workers", help="Threads for blocking tool calls (async mode)", rich_help_panel="Execution"),
+    stream: bool = typer.Option(False, "--stream", help="Stream completions and stop at the end of the function call", rich_help_panel="Basic"),
+    multi_call: bool = typer.Option(False, "--multi-call", help="Allow several function calls per response; read-only tools run concurrently", rich_help_panel="Basic"),
+    llm_cache: str = typer.Option("", "--llm-cache", help="Path of the sqlite LLM record/replay cache (empty = disabled)", rich_help_panel="LLM cache"),
+    cache_mode: str = typer.Option("record-on-miss", "--cache-mode", help="record | replay | record-on-miss", rich_help_panel="LLM cache"),
+    llm_cache_seed: str = typer.Option("", "--llm-cache-seed", help="Load the successful calls of an llm_calls.jsonl log into --llm-cache before the run, so the logged run can be replayed", rich_help_panel="LLM cache"),
+    cache_max_mb: int = typer.Option(0, "--cache-max-mb", help="Evict least recently used cache entries beyond this size (0 = unbounded)", rich_help_panel="LLM cache"),
+    log_llm_calls: bool = typer.Option(False, "--log-llm-calls", help="Log LLM calls (delta-encoded) to llm_calls.jsonl in the output directory", rich_help_panel="Logging"),
+    compress_log: bool = typer.Option(False, "--compress-log", help="gzip the LLM call log", rich_help_panel="Logging"),
+    requests_per_minute: float = typer.Option(0, "--rpm", help="Shared LLM requests/min limit across all workers (0 = unlimited)", rich_help_panel="Rate limits"),
+    tokens_per_minute: float = typer.Option(0, "--tpm", help="Shared LLM tokens/min limit across all workers (0 = unlimited)", rich_help_panel="Rate limits"),
+    stream_traj: bool = typer.Option(False, "--stream-traj", help="Write trajectories incrementally as <id>.traj.jsonl (convert with trajectory.py) instead of <id>.traj.json at the end", rich_help_panel="Logging"),
+    checkpoint: bool = typer.Option(False, "--checkpoint", help="Checkpoint every step (messages and a snapshot of the changed files) so --resume can continue an interrupted instance where it stopped", rich_help_panel="Basic"),
+    resume: bool = typer.Option(False, "--resume", help="Skip instances that already have a prediction and continue interrupted ones from their last checkpointed step (implies --checkpoint)", rich_help_panel="Basic"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Check the options and list the instances that would run, without starting containers or calling the API", rich_help_panel="Basic"),
     run_evaluation: bool = typer.Option(False, "--run-evaluation", help="Run SWEBench evaluation after generating predictions", rich_help_panel="Evaluation"),
+    eval_pipeline: bool = typer.Option(False, "--eval-pipeline", help="Evaluate each prediction as soon as its instance finishes (in a new container of the instance image) and keep final_results.json up to date", rich_help_panel="Evaluation"),
+    eval_timeout: float = typer.Option(1800, "--eval-timeout", help="Seconds the tests of one instance may run (pipelined evaluation)", rich_help_panel="Evaluation"),
     max_workers: int = typer.Option(8, "--eval-max-workers", help="Max workers for evaluation harness", rich_help_panel="Evaluation"),
 ) -> None:
     output_path = Path(output)
-    output_path.mkdir(parents=True, exist_ok=True)
+    if not dry_run:
+        output_path.mkdir(parents=True, exist_ok=True)
     print(f"Results will be saved to {output_path}")
 
     dataset_path = DATASET_MAPPING.get(subset, subset)
     print(f"Loading dataset {dataset_path}, split {split}...")
-    instances = list(load_dataset(dataset_path, split=split))
-    # Limit to first x instances for faster iteration
-    instances = instances#[:18]
+    try:
+        instances = load_instances(
+            dataset_path,
+            split,
+            cache_dir=Path(dataset_cache) if dataset_cache else None,
+            refresh=refresh_dataset,
+            instance_ids=[i.strip() for i in instance_ids.split(",") if i.strip()] if instance_ids else None,
+            pattern=id_filter,
+            selection=parse_slice(id_slice) if id_slice else None,
+        )
+    except (ValueError, re.error) as e:
+        raise typer.BadParameter(str(e))
+    dataset_instances = instances
+    if queue and prefetch:
+        raise typer.BadParameter("--prefetch cannot be used with --queue", param_hint="--prefetch")
+
+    shard_name = None
+    if shard:
+        try:
+            shard_index, shard_count = parse_shard(shard)
+        except ValueError as e:
+            raise typer.BadParameter(str(e), param_hint="--shard")
+        instances = [instance for instance in instances if in_shard(instance["instance_id"], shard_index, shard_count)]
+        shard_name = f"shard-{shard_index}-of-{shard_count}"
+    work_queue = None
+    if queue and not dry_run:
+        work_queue = WorkQueue(Path(queue), lease_seconds=lease_seconds)
+        # Every worker process writes its own prediction logs
+        shard_name = f"{shard_name}-{work_queue.owner}" if shard_name else work_queue.owner
     print(f"Running on {len(instances)} instances...")
 
+    # A dry run must not write to output_path, and creating a PredictionStore may
+    predictions = PredictionStore(output_path, shard=shard_name) if not dry_run else None
+    if resume:
+        logged = predictions.predictions() if predictions is not None else read_records(*shard_logs(output_path, PREDS_LOG))
+        completed = completed_instances(output_path, logged)
+        instances = [instance for instance in instances if instance["instance_id"] not in completed]
+        print(f"Resuming: {len(completed)} instances already completed, {len(instances)} to run")
+
+    if dry_run:
+        for index, instance in enumerate(order_instances(instances)):
+            print(f"{index:>5}  {instance['instance_id']:<50}  {instance_repo(instance)}")
+        print(f"Dry run: {len(instances)} instances with {model_name}, up to {max_steps} steps each, outputs in {output_path}")
+        problems = check_options(cache_mode, llm_cache, shell, llm_cache_seed)
+        for problem in problems:
+            print(f"[ERROR] {problem}")
+        raise typer.Exit(1 if problems else 0)
+
+    configure_rate_limiter(requests_per_minute, tokens_per_minute)
+
+    config = RunConfig(
+        output_dir=output_path,
+        model_name=model_name,
+        max_steps=max_steps,
+        context_budget=context_budget,
+        keep_recent_turns=keep_recent_turns,
+        dedup_outputs=dedup_outputs,
+        stream=stream,
+        llm_cache=LLMCacheStore(Path(llm_cache), max_bytes=cache_max_mb * 2**20) if llm_cache else None,
+        cache_mode=cache_mode,
+        log_llm_calls=log_llm_calls,
+        compress_log=compress_log,
+        shell=shell,
+        code_index=code_index,
+        file_cache=file_cache,
+        multi_call=multi_call,
+        max_output_chars=max_output_chars,
+        checkpoint=checkpoint,
+        resume=resume,
+        stream_traj=stream_traj,
+        predictions=predictions,
+    )
+    if llm_cache_seed:
+        if config.llm_cache is None:
+            raise typer.BadParameter("--llm-cache-seed requires --llm-cache", param_hint="--llm-cache-seed")
+        # Keyed like build_llm's models, so the seeded calls hit on replay
+        params = OpenAIModel.default_request_params(model_name, ResponseParser(multi_call=multi_call).stop_token)
+        added = seed_from_call_log(config.llm_cache, Path(llm_cache_seed), params)
+        print(f"Seeded the LLM cache with {added} calls from {llm_cache_seed}")
+    if eval_pipeline:
+        config.evaluator = EvaluationPool(
+            output_path,
+            [instance["instance_id"] for instance in dataset_instances],
+            config.predictions,
+            model_name,
+            max_workers=max_workers,
+            timeout=eval_timeout,
+            shard=shard_name,
+        )
+
+    if resume and config.evaluator is not None:
+        # Evaluate completed predictions that were not evaluated before the interruption
+        evaluated = config.evaluator.evaluations()
+        for instance in dataset_instances:
+            instance_id = instance["instance_id"]
+            if instance_id in completed and instance_id not in evaluated:
+                config.evaluator.submit(instance, logged[instance_id]["model_patch"])
+
     def process_futures(futures: dict[concurrent.futures.Future, str]):
         for future in concurrent.futures.as_completed(futures):
             try:
@@ -110,24 +523,98 @@ def main(
                 instance_id = futures[future]
                 print(f"Error in future for instance {instance_id}: {e}")
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-        futures = {
-            executor.submit(process_instance, instance, output_path, model_name, max_steps): instance[
-                "instance_id"
-            ]
-            for instance in instances
-        }
+    # Long-running repositories first, so they do not form the tail of the run
+    instances = order_instances(instances)
+    if work_queue is not None:
+        added = work_queue.add(instances)
+        print(f"Queued {added} new instances in {queue}: {work_queue.counts()}")
+        work_queue.start()
+
+    if use_async:
+        configure_tool_executor(tool_workers)
         try:
-            process_futures(futures)
+            if work_queue is not None:
+                asyncio.run(run_queue_async(work_queue, config, concurrency))
+            else:
+                asyncio.run(run_instances_async(instances, config, concurrency))
         except KeyboardInterrupt:
-            print("Cancelling all pending jobs. Press ^C again to exit immediately.")
-            for future in futures:
-                if not future.running() and not future.done():
-                    future.cancel()
-            process_futures(futures)
+            print("Cancelled all pending jobs.")
+    elif adaptive_max_workers > 0:
+        scheduler = AdaptiveScheduler(min_workers, adaptive_max_workers)
+        if work_queue is not None:
+            scheduler.run(iter(work_queue.next, None), lambda instance: process_queued(work_queue, config, instance), on_interrupt=work_queue.stop)
+        elif prefetch:
+            prefetcher = EnvironmentPrefetcher(
+                instances,
+                lambda instance: create_env(instance, config),
+                max_pulls=max_pulls,
+                max_live=max_live_containers or adaptive_max_workers + max_pulls,
+            ).start()
+            try:
+                scheduler.run(
+                    iter(prefetcher.next, None),
+                    lambda item: process_prefetched(prefetcher, config, item),
+                    on_interrupt=lambda: prefetcher.shutdown(close_env=SWEEnvironment.close),
+                )
+            finally:
+                prefetcher.shutdown(close_env=SWEEnvironment.close)
+        else:
+            scheduler.run(instances, lambda instance: process_instance(instance, config))
+    else:
+        prefetcher = None
+        if prefetch:
+            prefetcher = EnvironmentPrefetcher(
+                instances,
+                lambda instance: create_env(instance, config),
+                max_pulls=max_pulls,
+                max_live=max_live_containers or workers + max_pulls,
+            ).start()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            if work_queue is not None:
+                futures = {
+                    executor.submit(run_queued, work_queue, config): f"worker-{i}"
+                    for i in range(workers)
+                }
+            elif prefetcher is not None:
+                futures = {
+                    executor.submit(run_prefetched, prefetcher, config): f"worker-{i}"
+                    for i in range(workers)
+                }
+            else:
+                futures = {
+                    executor.submit(process_instance, instance, config): instance["instance_id"]
+                    for instance in instances
+                }
+            try:
+                process_futures(futures)
+            except KeyboardInterrupt:
+                print("Cancelling all pending jobs. Press ^C again to exit immediately.")
+                if work_queue is not None:
+                    work_queue.stop()
+                if prefetcher is not None:
+                    prefetcher.shutdown(close_env=SWEEnvironment.close)
+                for future in futures:
+                    if not future.running() and not future.done():
+                        future.cancel()
+                process_futures(futures)
     
+    if work_queue is not None:
+        work_queue.close()
+
+    # Make sure every queued LLM call log record is on disk
+    flush_log_writer()
+
+    # Compact the append-only logs into preds.json / usage.json for the harness
+    predictions = config.predictions.export()
+    print(f"Wrote {len(predictions)} predictions (all shards) to {output_path / 'preds.json'}")
+
+    if config.evaluator is not None:
+        print("Waiting for the remaining evaluations...")
+        report = config.evaluator.close()
+        print(f"Resolved {report['resolved_instances']}/{report['total_instances']} instances, results in {output_path / 'final_results.json'}")
+
     # Run evaluation if requested
-    if run_evaluation:
+    elif run_evaluation:
         print("\n" + "="*80)
         print("Running SWEBench evaluation harness...")
         print("="*80 + "\n")
@@ -0,0 +1,248 @@
+"""
+Adaptive instance scheduling.
+
+Instances are ordered so that repositories with long-running instances (large test
+suites, slow container starts) start first and do not form a long tail at the end.
+`AdaptiveScheduler` runs them on up to `max_workers` threads but only lets `limit`
+of them work at a time. A controller adjusts `limit` between `min_workers` and
+`max_workers` from load signals observed over the last interval: it backs off
+multiplicatively on host memory pressure, LLM rate limiting (429 responses) or
+rising latency of cheap tool commands (`show_file`'s existence check and
+`list_directory`) against their lowest median over the last few minutes, and
+otherwise adds workers while all of them are busy.
+"""
+
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Relative cost of an instance by repository (default 1)
+REPO_WEIGHTS = {
+    "django/django": 3.0,
+    "sympy/sympy": 3.0,
+    "matplotlib/matplotlib": 2.5,
+    "scikit-learn/scikit-learn": 2.5,
+    "sphinx-doc/sphinx": 2.0,
+    "astropy/astropy": 2.0,
+    "pydata/xarray": 2.0,
+    "pylint-dev/pylint": 1.5,
+    "pytest-dev/pytest": 1.5,
+}
+
+
+def instance_repo(instance: dict) -> str:
+    """
+    `owner/name` of the instance's repository (from "repo", else the instance id).
+    """
+    if instance.get("repo"):
+        return instance["repo"]
+    owner, _, rest = instance["instance_id"].partition("__")
+    return f"{owner}/{rest.rsplit('-', 1)[0]}"
+
+
+def order_instances(instances: Iterable[dict]) -> List[dict]:
+    """
+    Heaviest repositories first; dataset order is kept within a repository.
+    """
+    return sorted(instances, key=lambda instance: -REPO_WEIGHTS.get(instance_repo(instance), 1.0))
+
+
+class LoadSignals:
+    """
+    Process-wide counters fed by the LLM and tool layers and drained by the scheduler.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.llm_calls = 0
+        self.llm_throttled = 0
+        self.tool_latencies: List[float] = []
+
+    def record_llm_call(self, throttled: bool = False) -> None:
+        with self.lock:
+            self.llm_calls += 1
+            if throttled:
+                self.llm_throttled += 1
+
+    def record_tool_latency(self, seconds: float) -> None:
+        with self.lock:
+            self.tool_latencies.append(seconds)
+
+    def drain(self) -> Dict[str, float]:
+        """
+        Signals since the previous drain: LLM throttle rate and median latency of the
+        sampled tool commands.
+        """
+        with self.lock:
+            calls, throttled, latencies = self.llm_calls, self.llm_throttled, self.tool_latencies
+            self.llm_calls, self.llm_throttled, self.tool_latencies = 0, 0, []
+        return {
+            "llm_calls": calls,
+            "throttle_rate": throttled / calls if calls else 0.0,
+            "tool_latency": statistics.median(latencies) if latencies else None,
+        }
+
+
+LOAD_SIGNALS = LoadSignals()
+
+
+def memory_available_fraction() -> Optional[float]:
+    """
+    MemAvailable / MemTotal of the host (containers share its memory), or None if unknown.
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            fields = dict(line.split(":", 1) for line in f)
+        return int(fields["MemAvailable"].split()[0]) / int(fields["MemTotal"].split()[0])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class AdaptiveScheduler:
+    """
+    Runs `process(instance)` for every instance with a concurrency limit adjusted
+    every `interval` seconds between `min_workers` and `max_workers`.
+    """
+
+    def __init__(
+        self,
+        min_workers: int,
+        max_workers: int,
+        interval: float = 15.0,
+        min_memory_fraction: float = 0.1,
+        max_throttle_rate: float = 0.05,
+        max_latency_ratio: float = 3.0,
+        baseline_intervals: int = 20,
+        signals: LoadSignals = LOAD_SIGNALS,
+        memory: Callable[[], Optional[float]] = memory_available_fraction,
+    ):
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.interval = interval
+        self.min_memory_fraction = min_memory_fraction
+        self.max_throttle_rate = max_throttle_rate
+        self.max_latency_ratio = max_latency_ratio
+        self.signals = signals
+        self.memory = memory
+        self.limit = min(self.max_workers, max(self.min_workers, os.cpu_count() or 1))
+        self.active = 0
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        # Median tool latency of the last `baseline_intervals` intervals; their lowest is
+        # the reference for "rising latency", so one unusually fast interval ages out
+        self.recent_latencies: deque = deque(maxlen=max(1, baseline_intervals))
+        self.baseline_latency: Optional[float] = None
+        self.history: List[dict] = []
+
+    # -------------------- CONCURRENCY GATE --------------------
+    def acquire(self) -> bool:
+        """
+        Wait for a free slot; False once the scheduler is stopped.
+        """
+        with self.condition:
+            while self.active >= self.limit and not self.stopped.is_set():
+                self.condition.wait(timeout=1)
+            if self.stopped.is_set():
+                return False
+            self.active += 1
+            return True
+
+    def release(self) -> None:
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def stop(self) -> None:
+        """
+        Let workers finish their current instance but start no new ones.
+        """
+        self.stopped.set()
+        with self.condition:
+            self.condition.notify_all()
+
+    # -------------------- CONTROLLER --------------------
+    def adjust(self) -> int:
+        """
+        Update `limit` from the signals observed since the last adjustment.
+        """
+        signals = self.signals.drain()
+        memory = self.memory()
+        latency = signals["tool_latency"]
+        if latency is not None:
+            self.recent_latencies.append(latency)
+            self.baseline_latency = min(self.recent_latencies)
+
+        reason = None
+        if memory is not None and memory < self.min_memory_fraction:
+            reason = f"memory available {memory:.0%}"
+        elif signals["throttle_rate"] > self.max_throttle_rate:
+            reason = f"LLM throttle rate {signals['throttle_rate']:.0%}"
+        elif latency is not None and self.baseline_latency and latency > self.max_latency_ratio * self.baseline_latency:
+            reason = f"tool latency {latency:.2f}s (baseline {self.baseline_latency:.2f}s)"
+
+        with self.condition:
+            previous = self.limit
+            if reason is not None:
+                self.limit = max(self.min_workers, int(self.limit * 0.75))
+            elif self.active >= self.limit:
+                self.limit = min(self.max_workers, self.limit + max(1, self.limit // 10))
+            self.condition.notify_all()
+            limit = self.limit
+        if limit != previous:
+            print(f"Scheduler: {previous} -> {limit} workers" + (f" ({reason})" if reason else ""))
+        self.history.append({"time": time.time(), "limit": limit, "memory": memory, **signals})
+        return limit
+
+    def _control(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.adjust()
+
+    # -------------------- RUNNING --------------------
+    def run(self, items: Iterable, process: Callable[[object], None], on_interrupt: Optional[Callable[[], None]] = None) -> None:
+        """
+        Call `process` on every item (in order) on `max_workers` threads, at most
+        `limit` at a time. On ^C no new items are started and running ones finish;
+        `on_interrupt` should make a blocking `items` iterator return.
+        """
+        items = iter(items)
+        items_lock = threading.Lock()
+
+        def worker() -> None:
+            while self.acquire():
+                try:
+                    with items_lock:
+                        item = next(items, None)
+                    if item is None:
+                        return
+                    try:
+                        process(item)
+                    except Exception as e:
+                        print(f"Error in worker: {e}")
+                finally:
+                    self.release()
+
+        controller = threading.Thread(target=self._control, name="scheduler", daemon=True)
+        workers = [threading.Thread(target=worker, name=f"worker-{i}", daemon=True) for i in range(self.max_workers)]
+        controller.start()
+        for thread in workers:
+            thread.start()
+        try:
+            self._join(workers)
+        except KeyboardInterrupt:
+            print("Cancelling pending instances, waiting for running ones. Press ^C again to exit immediately.")
+            self.stop()
+            if on_interrupt is not None:
+                on_interrupt()
+            self._join(workers)
+        finally:
+            self.stop()
+
+    @staticmethod
+    def _join(threads: List[threading.Thread]) -> None:
+        # Join with a timeout so KeyboardInterrupt is delivered
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
@@ -0,0 +1,155 @@
+"""
+Persistent bash session used to run tool commands without a process launch per call.
+
+A single long-lived `bash` (for SWE-bench: one `docker exec -i <container> bash`)
+reads framed commands from stdin. Each command runs as `bash -c` in a fresh child
+shell (so commands cannot change the session's state or break its input with a
+syntax error), its output is followed by a sentinel line carrying the exit code,
+and the reader returns everything up to the sentinel.
+"""
+
+import math
+import os
+import selectors
+import subprocess
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+
+# bash ANSI-C quoting ($'...') of every byte: printable ASCII verbatim, the rest as \xHH
+_ANSI_C_ESCAPES = [
+    chr(byte) if 32 <= byte < 127 and chr(byte) not in "\\'" else f"\\x{byte:02x}"
+    for byte in range(256)
+]
+
+
+def ansi_c_quote(command: str) -> str:
+    """
+    Quote `command` as a single bash word using only printable ASCII, so it can be
+    written to the session on one line without spawning a decoder process.
+    """
+    return "$'" + "".join([_ANSI_C_ESCAPES[byte] for byte in command.encode("utf-8")]) + "'"
+
+
+def docker_exec_argv(env) -> List[str]:
+    """
+    `docker exec -i` prefix (up to and including the container id) running in the
+    working directory and with the environment of a minisweagent `DockerEnvironment`.
+    """
+    config = env.config
+    argv = [getattr(config, "executable", "docker"), "exec", "-i", "-w", config.cwd]
+    for key in getattr(config, "forward_env", []):
+        if (value := os.getenv(key)) is not None:
+            argv.extend(["-e", f"{key}={value}"])
+    for key, value in config.env.items():
+        argv.extend(["-e", f"{key}={value}"])
+    argv.append(env.container_id)
+    return argv
+
+
+class PersistentShell:
+    """
+    Runs commands through one long-lived shell process.
+
+    `execute` returns {"output": str, "returncode": int} like the minisweagent
+    environments. On timeout the session is killed (and restarted on the next call)
+    and `subprocess.TimeoutExpired` is raised with the partial output.
+    """
+
+    def __init__(self, argv: List[str], cwd: str = "", timeout: float = 60, login: bool = True):
+        self.argv = argv
+        self.cwd = cwd
+        self.timeout = timeout
+        self.login = login
+        self.proc: Optional[subprocess.Popen] = None
+        self.lock = threading.Lock()
+        self.sentinel = f"__TOOL_CMD_DONE_{uuid.uuid4().hex}__".encode()
+
+    @classmethod
+    def for_docker(cls, env) -> "PersistentShell":
+        """
+        Open a session in the container of a minisweagent `DockerEnvironment`.
+        """
+        argv = docker_exec_argv(env) + ["bash", "--noprofile", "--norc"]
+        return cls(argv, cwd=env.config.cwd, timeout=env.config.timeout)
+
+    def _start(self) -> None:
+        self.proc = subprocess.Popen(
+            self.argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=0,
+        )
+
+    def execute(self, command: str, timeout: Optional[float] = None) -> dict:
+        timeout = timeout or self.timeout
+        with self.lock:
+            if self.proc is None or self.proc.poll() is not None:
+                self._start()
+            cd = f"cd {self.cwd} && " if self.cwd else ""
+            # Run the command in a child login shell, like `docker exec ... bash -lc`,
+            # and kill it inside the container if it outlives the timeout
+            flags = "-lc" if self.login else "-c"
+            frame = (
+                f"{{ {cd}timeout -s KILL {math.ceil(timeout)} bash {flags} {ansi_c_quote(command)} "
+                f"</dev/null 2>&1; }} 2>/dev/null; printf '\\n%s %d\\n' {self.sentinel.decode()} $?\n"
+            )
+            try:
+                self.proc.stdin.write(frame.encode("ascii"))
+                self.proc.stdin.flush()
+            except (BrokenPipeError, OSError):
+                self.close()
+                raise RuntimeError("Persistent shell exited unexpectedly")
+            start = time.monotonic()
+            result = self._read_until_sentinel(start + timeout + 5)
+            # 137 = killed by `timeout -s KILL`
+            if result["returncode"] == 137 and time.monotonic() - start >= timeout:
+                raise subprocess.TimeoutExpired(self.argv, timeout, output=result["output"].encode("utf-8"))
+            return result
+
+    def _read_until_sentinel(self, deadline: float) -> dict:
+        buffer = bytearray()
+        marker = b"\n" + self.sentinel + b" "
+        search_from = 0
+        fd = self.proc.stdout.fileno()
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while True:
+                idx = buffer.find(marker, search_from)
+                if idx != -1:
+                    line_end = buffer.find(b"\n", idx + len(marker))
+                    if line_end != -1:
+                        returncode = int(buffer[idx + len(marker):line_end])
+                        return {"output": buffer[:idx].decode("utf-8", errors="replace"), "returncode": returncode}
+                    search_from = idx
+                else:
+                    search_from = max(0, len(buffer) - len(marker))
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.close()
+                    raise subprocess.TimeoutExpired(self.argv, deadline, output=bytes(buffer))
+                if not selector.select(remaining):
+                    continue
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    self.close()
+                    raise RuntimeError(f"Persistent shell exited: {buffer.decode('utf-8', errors='replace')}")
+                buffer += chunk
+
+    def close(self) -> None:
+        if self.proc is None:
+            return
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=5)
+        except Exception:
+            pass
+        for stream in (self.proc.stdin, self.proc.stdout):
+            try:
+                stream.close()
+            except Exception:
+                pass
+        self.proc = None
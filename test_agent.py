@@ -0,0 +1,112 @@
+"""
+Tests of multi-call responses in ReactAgent.
+
+Run with `python -m pytest test_agent.py`.
+"""
+
+from agent import ReactAgent
+from bench import ScriptedLLM
+from context import DeduplicationPolicy
+from response_parser import ResponseParser
+
+P = ResponseParser
+
+
+def call_block(name: str, **arguments) -> str:
+    args = "".join(f"{P.ARG_SEP}\n{key}\n{P.VALUE_SEP}\n{value}\n" for key, value in arguments.items())
+    return f"{P.BEGIN_CALL}\n{name}\n{args}{P.END_CALL}\n"
+
+
+def response(*blocks: str) -> str:
+    return "thinking\n" + "".join(blocks) + P.END_CALLS
+
+
+class Tools:
+    def __init__(self):
+        self.edits = []
+
+    def show_file(self, file_path: str) -> str:
+        """Show a file."""
+        return "".join(f"{file_path} line {i}\n" for i in range(100))
+
+    def replace_in_file(self, file_path: str, old_str: str, new_str: str) -> str:
+        """Edit a file."""
+        if old_str == "missing":
+            raise ValueError("old_str not found")
+        self.edits.append(file_path)
+        return "edited"
+
+
+def make_agent(*policies):
+    tools = Tools()
+    agent = ReactAgent("test-agent", ResponseParser(multi_call=True), ScriptedLLM(""), context_policies=list(policies))
+    agent.add_functions([tools.show_file, tools.replace_in_file])
+    agent.set_message_content(agent.user_message_id, "task")
+    return agent, tools
+
+
+def step(agent: ReactAgent, text: str):
+    # One multi-call step of `run` without querying the LLM
+    return agent._run_calls(agent._parse_calls(text))
+
+
+def test_each_call_gets_a_tool_message_with_its_metadata():
+    agent, _ = make_agent()
+    first = len(agent.id_to_message) + 1
+
+    step(agent, response(call_block("show_file", file_path="a.py"), call_block("show_file", file_path="b.py")))
+
+    messages = agent.id_to_message[first:]
+    assert [message["role"] for message in messages] == ["tool", "tool"]
+    assert [message["tool_call"]["arguments"]["file_path"] for message in messages] == ["a.py", "b.py"]
+
+
+def test_deduplication_supersedes_views_from_multi_call_steps():
+    agent, _ = make_agent(DeduplicationPolicy())
+    step(agent, response(call_block("show_file", file_path="a.py"), call_block("show_file", file_path="b.py")))
+    old_view = 3
+    step(agent, response(call_block("show_file", file_path="a.py")))
+
+    messages = agent.build_prompt(2)
+
+    assert "[output omitted: superseded by the output of message id=" in messages[old_view]["content"]
+    assert "b.py line 0" in messages[old_view + 1]["content"]
+
+
+def test_failed_edit_stops_the_calls_after_it():
+    agent, tools = make_agent()
+    finished, _ = step(agent, response(
+        call_block("replace_in_file", file_path="a.py", old_str="missing", new_str="x"),
+        call_block("replace_in_file", file_path="b.py", old_str="y", new_str="z"),
+        call_block("show_file", file_path="b.py"),
+    ))
+
+    assert not finished
+    assert tools.edits == []
+    results = [message["content"] for message in agent.id_to_message[-3:]]
+    assert results[0].startswith("Function execution error")
+    assert results[1] == results[2] == "Not executed: call 1 (replace_in_file) failed"
+
+
+def test_finish_is_refused_after_a_failed_call():
+    agent, _ = make_agent()
+    finished, _ = step(agent, response(
+        call_block("unknown_tool"),
+        call_block("finish", result="done"),
+    ))
+
+    assert not finished
+    assert [message["content"] for message in agent.id_to_message[-2:]] == [
+        "Unknown function: unknown_tool",
+        "Not executed: call 1 (unknown_tool) failed",
+    ]
+
+
+def test_finish_after_successful_calls():
+    agent, tools = make_agent()
+
+    assert step(agent, response(
+        call_block("replace_in_file", file_path="a.py", old_str="y", new_str="z"),
+        call_block("finish", result="done"),
+    )) == (True, "done")
+    assert tools.edits == ["a.py"]
@@ -0,0 +1,52 @@
+"""
+Tests of ConversationLog delta encoding and prompt reconstruction.
+
+Run with `python -m pytest test_call_log.py`.
+"""
+
+import json
+
+import pytest
+
+from call_log import ConversationLog, flush_log_writer, read_call_log, reconstruct_prompt
+
+
+def message(role: str, content: str) -> dict:
+    return {"role": role, "content": content}
+
+
+@pytest.mark.parametrize("name", ["llm_calls.jsonl", "llm_calls.jsonl.gz"])
+def test_prompts_are_rebuilt_from_deltas(tmp_path, name):
+    path = tmp_path / name
+    system, task = message("system", "sys"), message("user", "task")
+    prompts = [
+        [system, task],
+        [system, task, message("assistant", "a1"), message("user", "r1")],
+        # A policy rewrote an earlier message
+        [system, message("user", "task (shortened)"), message("assistant", "a1")],
+    ]
+    log = ConversationLog(path, "conv-1")
+    other = ConversationLog(path, "conv-2")
+    for number, messages in enumerate(prompts, 1):
+        log.record(messages, {"call_number": number})
+        other.record([message("user", f"other {number}")], {"call_number": number})
+    flush_log_writer()
+
+    records = [record for record in read_call_log(path) if record["conversation_id"] == "conv-1"]
+
+    assert [record["messages"] for record in records] == prompts
+    assert reconstruct_prompt(path, "conv-2", 3) == [message("user", "other 3")]
+
+
+def test_records_store_only_changed_messages(tmp_path):
+    path = tmp_path / "llm_calls.jsonl"
+    system, task = message("system", "sys"), message("user", "task")
+    log = ConversationLog(path, "conv")
+    log.record([system, task], {"call_number": 1})
+    log.record([system, task, message("assistant", "a1")], {"call_number": 2})
+    flush_log_writer()
+
+    second = json.loads(path.read_text().splitlines()[1])
+
+    assert second["offset"] == 2
+    assert second["new_messages"] == [message("assistant", "a1")]
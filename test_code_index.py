@@ -0,0 +1,91 @@
+"""
+Tests of CodeIndex searches served from the indexed file contents.
+
+Run with `python -m pytest test_code_index.py`.
+"""
+
+import shutil
+import subprocess
+
+import pytest
+
+from code_index import CodeIndex, bre_to_regex, required_literal
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+FILES = {
+    "pkg/core.py": "import json\n\nclass Parser:\n    def parse(self, text):\n        return json.loads(text)\n",
+    "pkg/util.py": "def helper():\n    return 'parse me'\n\n\nasync def fetch():\n    pass",
+    "docs/notes.txt": "parse the docs\nnothing else\n",
+    "build/generated.py": "def parse(): pass\n",
+    "data.bin": "parse\0binary\n",
+}
+
+
+@pytest.fixture
+def repo(tmp_path):
+    for path, content in FILES.items():
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(content)
+    subprocess.run(["git", "init", "-q"], cwd=tmp_path, check=True)
+    return tmp_path
+
+
+def make_index(repo):
+    commands = []
+
+    def execute(command: str) -> str:
+        commands.append(command)
+        return subprocess.run(["bash", "-c", command], cwd=repo, capture_output=True, text=True).stdout
+
+    return CodeIndex(execute), commands
+
+
+def test_search_is_served_from_memory(repo):
+    index, commands = make_index(repo)
+    built = len(commands)
+
+    results = index.search("parse")
+
+    assert len(commands) == built
+    # Definitions first; excluded directories and binary files are not searched
+    assert results == [
+        "./pkg/core.py:4:    def parse(self, text):",
+        "./docs/notes.txt:1:parse the docs",
+        "./pkg/util.py:2:    return 'parse me'",
+    ]
+
+
+def test_search_matches_git_grep(repo):
+    index, _ = make_index(repo)
+
+    for pattern, file_pattern in (("^import json$", "*"), ("def [a-z]*(", "*.py"), ("return", "*.py"), ("x\\{2\\}", "*")):
+        grep = subprocess.run(
+            ["git", "grep", "--untracked", "-n", "-I", "-e", pattern, "--", f":(glob)**/{file_pattern}", ":(exclude)build"],
+            cwd=repo, capture_output=True, text=True,
+        ).stdout
+        assert sorted(index.search(pattern, file_pattern)) == sorted(f"./{line}" for line in grep.splitlines())
+
+
+def test_refresh_rereads_edited_files(repo):
+    index, _ = make_index(repo)
+    (repo / "pkg/util.py").write_text("def renamed():\n    pass\n")
+    (repo / "pkg/new.py").write_text("def parse_new():\n    pass\n")
+    index.mark_dirty()
+
+    assert index.search("renamed") == ["./pkg/util.py:1:def renamed():"]
+    assert "./pkg/new.py:1:def parse_new():" in index.search("parse")
+    assert index.search("helper") == []
+
+
+@pytest.mark.parametrize("pattern", [
+    "^import json$", "class .*Error", "ab*c", "x\\?yz", "[abc]def", "a\\|b", "x\\{10\\}", "foo\\.bar\\+", "test_[a-z]*_thing",
+])
+def test_required_literal_is_in_every_match(pattern):
+    literal = required_literal(pattern)
+    regex = bre_to_regex(pattern)
+    samples = ["import json", "class ValueError", "ac", "abbc", "yz", "xyz", "adef", "a", "b", "xxxxxxxxxx", "foo.barr", "test_ab_thing"]
+
+    for sample in samples:
+        if regex.search(sample):
+            assert literal in sample
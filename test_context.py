@@ -0,0 +1,61 @@
+"""
+Tests of the context policies as run_agent combines them (deduplication, then token budget).
+
+Run with `python -m pytest test_context.py`.
+"""
+
+from agent import ReactAgent
+from bench import ScriptedLLM
+from context import DeduplicationPolicy, TokenBudgetPolicy, estimate_prompt_tokens
+from response_parser import ResponseParser
+
+
+def make_agent(*policies) -> ReactAgent:
+    # The prompt is built without querying the LLM
+    agent = ReactAgent("test-agent", ResponseParser(), ScriptedLLM(""), context_policies=list(policies))
+    agent.set_message_content(agent.user_message_id, "task")
+    return agent
+
+
+def add_turn(agent: ReactAgent, output: str) -> int:
+    agent.add_message("assistant", "calling a tool")
+    return agent.add_message("tool", output)
+
+
+def test_budget_does_not_expand_deduplicated_output():
+    agent = make_agent(DeduplicationPolicy(), TokenBudgetPolicy(100, keep_recent_turns=1))
+    output = "".join(f"line {i}\n" for i in range(500))
+    first = add_turn(agent, output)
+    add_turn(agent, output)
+    add_turn(agent, "done")
+
+    messages = agent.build_prompt(1)
+
+    assert "[output omitted: superseded by the output of message id=" in messages[first]["content"]
+    assert "elided to save context" not in messages[first]["content"]
+
+
+def test_sticky_elision_keeps_later_back_reference():
+    budget = TokenBudgetPolicy(100, keep_recent_turns=1)
+    agent = make_agent(DeduplicationPolicy(), budget)
+    output = "".join(f"line {i}\n" for i in range(500))
+    first = add_turn(agent, output)
+    add_turn(agent, "other")
+    elided = agent.build_prompt(1)[first]["content"]
+    assert first in budget.elided
+
+    # A later identical output makes the first one a short back-reference
+    add_turn(agent, output)
+    add_turn(agent, "done")
+    messages = agent.build_prompt(2)
+
+    assert "[output omitted: superseded by the output of message id=" in messages[first]["content"]
+    assert len(messages[first]["content"]) < len(elided)
+
+
+def test_budget_never_grows_the_prompt():
+    agent = make_agent(TokenBudgetPolicy(10, keep_recent_turns=1, excerpt_chars=400))
+    for i in range(4):
+        add_turn(agent, "y" * 410 + str(i))
+
+    assert estimate_prompt_tokens(agent.build_prompt(1)) <= estimate_prompt_tokens(agent.get_messages())
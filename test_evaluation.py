@@ -0,0 +1,55 @@
+"""
+Tests of the pipelined evaluation's handling of empty patches and its report.
+
+Run with `python -m pytest test_evaluation.py`.
+"""
+
+import pytest
+
+import evaluation
+from evaluation import EvaluationPool, is_empty_patch, results_report
+from predictions import PredictionStore, read_records
+
+DIFF = "diff --git a/x.py b/x.py\n--- a/x.py\n+++ b/x.py\n@@ -1 +1 @@\n-a\n+b\n"
+
+
+@pytest.mark.parametrize("patch, empty", [
+    ("", True),
+    ("   \n", True),
+    ("done\n\nNo changes detected to generate a patch.", True),
+    (DIFF, False),
+])
+def test_is_empty_patch(patch, empty):
+    assert is_empty_patch(patch) == empty
+
+
+def test_empty_patch_is_unresolved_without_a_container(tmp_path, monkeypatch):
+    def no_container(*args, **kwargs):
+        raise AssertionError("an empty patch must not be evaluated")
+
+    monkeypatch.setattr(evaluation, "run_evaluation", no_container)
+    predictions = PredictionStore(tmp_path)
+    predictions.add("a", "model", "No changes detected to generate a patch.")
+    pool = EvaluationPool(tmp_path, ["a", "b"], predictions, "model")
+    assert pool.submit({"instance_id": "a"}, "No changes detected to generate a patch.") is None
+    report = pool.close()
+
+    assert read_records(pool.log)["a"]["status"] == "unresolved"
+    assert report["unresolved_ids"] == ["a"]
+    assert report["empty_patch_ids"] == ["a"]
+    assert report["completed_ids"] == []
+    assert report["incomplete_ids"] == ["b"]
+
+
+def test_report_reads_old_empty_patch_status():
+    predictions = {"a": {}, "b": {}, "c": {}}
+    evaluations = {
+        "a": {"status": "empty_patch"},
+        "b": {"status": "resolved"},
+        "c": {"status": "unresolved"},
+    }
+    report = results_report(["a", "b", "c"], predictions, evaluations)
+    assert report["resolved_ids"] == ["b"]
+    assert report["unresolved_ids"] == ["a", "c"]
+    assert report["empty_patch_ids"] == ["a"]
+    assert report["completed_ids"] == ["b", "c"]
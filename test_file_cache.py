@@ -0,0 +1,30 @@
+"""
+Tests of file_cache.number_lines against `nl -v`.
+
+Run with `python -m pytest test_file_cache.py`.
+"""
+
+import shutil
+import subprocess
+
+import pytest
+
+from file_cache import number_lines
+
+
+@pytest.mark.skipif(shutil.which("nl") is None, reason="nl is not installed")
+@pytest.mark.parametrize("start", [1, 7, 123456, 1234567])
+@pytest.mark.parametrize("text", [
+    "one\ntwo\nthree\n",
+    "first\n\n\nafter blank lines\n",
+    "\nleading blank\n   indented\n\ttabbed\n",
+    "no trailing newline",
+])
+def test_number_lines_matches_nl(text, start):
+    expected = subprocess.run(["nl", "-v", str(start)], input=text, capture_output=True, text=True, check=True).stdout
+
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+
+    assert number_lines(lines, start) == expected
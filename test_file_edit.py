@@ -0,0 +1,43 @@
+"""
+Tests of file_edit.parse_edits and file_edit.replace_once.
+
+Run with `python -m pytest test_file_edit.py`.
+"""
+
+import pytest
+
+from file_edit import EDIT_FILE, EDIT_NEW, EDIT_OLD, parse_edits, replace_once
+
+
+def test_parse_edits_strips_one_newline_around_each_text():
+    text = (
+        f"{EDIT_FILE}\nsrc/a.py\n{EDIT_OLD}\n    x = 1\n\n{EDIT_NEW}\n    x = 2\n"
+        f"{EDIT_FILE}\n src/b.py \n{EDIT_OLD}\nold{EDIT_NEW}\n"
+    )
+
+    assert parse_edits(text) == [("src/a.py", "    x = 1\n", "    x = 2"), ("src/b.py", "old", "")]
+
+
+@pytest.mark.parametrize("text", [
+    "no edits here",
+    f"{EDIT_FILE}\na.py\n{EDIT_NEW}\nnew\n",
+    f"{EDIT_FILE}\na.py\n{EDIT_OLD}\nold\n",
+    f"{EDIT_FILE}\n\n{EDIT_OLD}\nold\n{EDIT_NEW}\nnew\n",
+])
+def test_parse_edits_rejects_incomplete_edits(text):
+    with pytest.raises(ValueError):
+        parse_edits(text)
+
+
+def test_replace_once_replaces_first_occurrence_only():
+    assert replace_once("a b a", "a", "c") == "c b a"
+
+
+def test_replace_once_missing_text():
+    assert replace_once("abc", "x", "y") is None
+
+
+def test_replace_once_keeps_crlf_line_endings():
+    text = "def f():\r\n    return 1\r\n"
+
+    assert replace_once(text, "def f():\n    return 1", "def f():\n    return 2") == "def f():\r\n    return 2\r\n"
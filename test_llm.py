@@ -0,0 +1,37 @@
+"""
+Tests of token usage accounting.
+
+Run with `python -m pytest test_llm.py`.
+"""
+
+import pytest
+
+from llm import merge_usage_summaries, summarize_usage
+
+
+def usage(prompt: int, cached: int, estimated: bool = False) -> dict:
+    record = {"prompt_tokens": prompt, "completion_tokens": 10, "cached_prompt_tokens": cached, "reasoning_tokens": 0}
+    if estimated:
+        record["estimated"] = True
+    return record
+
+
+def test_estimated_usage_is_left_out_of_cache_ratio():
+    summary = summarize_usage([usage(1000, 800), usage(1000, 0, estimated=True)], "unknown-model")
+    assert summary["estimated_calls"] == 1
+    assert summary["prompt_tokens"] == 2000
+    assert summary["cached_prompt_ratio"] == pytest.approx(0.8)
+
+
+def test_only_estimated_usage_has_no_cache_ratio():
+    summary = summarize_usage([usage(1000, 0, estimated=True)], "unknown-model")
+    assert summary["cached_prompt_ratio"] == 0.0
+
+
+def test_merged_ratio_uses_reported_prompt_tokens():
+    first = summarize_usage([usage(1000, 500)], "unknown-model")
+    second = summarize_usage([usage(3000, 0, estimated=True)], "unknown-model")
+    total = merge_usage_summaries([first, second])
+    assert total["calls"] == 2
+    assert total["prompt_tokens"] == 4000
+    assert total["cached_prompt_ratio"] == pytest.approx(0.5)
@@ -0,0 +1,82 @@
+"""
+Tests of the CachingLLM record/replay modes.
+
+Run with `python -m pytest test_llm_cache.py`.
+"""
+
+import pytest
+
+from call_log import ConversationLog, flush_log_writer
+from llm_cache import CacheMissError, CachingLLM, LLMCacheStore, seed_from_call_log
+
+PARAMS = {"model": "counting"}
+
+
+class CountingLLM:
+    model_name = "counting"
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate(self, messages: list) -> str:
+        self.calls += 1
+        return f"response {self.calls}"
+
+
+def prompt(text: str) -> list:
+    return [{"role": "user", "content": text}]
+
+
+def test_record_on_miss_calls_once(tmp_path):
+    llm = CountingLLM()
+    cached = CachingLLM(llm, LLMCacheStore(tmp_path / "cache.db"), mode="record-on-miss", params=PARAMS)
+
+    assert cached.generate(prompt("a")) == "response 1"
+    assert cached.generate(prompt("a")) == "response 1"
+    assert cached.generate(prompt("b")) == "response 2"
+    assert llm.calls == 2
+    assert cached.cache_stats() == {"mode": "record-on-miss", "hits": 1, "misses": 2}
+
+
+def test_record_always_calls_and_overwrites(tmp_path):
+    store = LLMCacheStore(tmp_path / "cache.db")
+    llm = CountingLLM()
+    recording = CachingLLM(llm, store, mode="record", params=PARAMS)
+    recording.generate(prompt("a"))
+    recording.generate(prompt("a"))
+    assert llm.calls == 2
+
+    replay = CachingLLM(None, store, mode="replay", params=PARAMS)
+    assert replay.generate(prompt("a")) == "response 2"
+
+
+def test_replay_miss_raises(tmp_path):
+    store = LLMCacheStore(tmp_path / "cache.db")
+    CachingLLM(CountingLLM(), store, mode="record", params=PARAMS).generate(prompt("a"))
+    replay = CachingLLM(None, store, mode="replay", params=PARAMS)
+
+    with pytest.raises(CacheMissError):
+        replay.generate(prompt("b"))
+    # Different generation parameters are a different call
+    with pytest.raises(CacheMissError):
+        CachingLLM(None, store, mode="replay", params={"model": "other"}).generate(prompt("a"))
+
+
+def test_replay_does_not_need_a_model(tmp_path):
+    with pytest.raises(ValueError):
+        CachingLLM(None, LLMCacheStore(tmp_path / "cache.db"), mode="record")
+
+
+def test_seed_from_call_log_replays_successful_calls(tmp_path):
+    path = tmp_path / "llm_calls.jsonl"
+    log = ConversationLog(path, "conv-1")
+    log.record(prompt("a"), {"model": "counting", "success": True, "response": "logged a"})
+    log.record(prompt("b"), {"model": "counting", "success": False, "response": None})
+    flush_log_writer()
+
+    store = LLMCacheStore(tmp_path / "cache.db")
+    assert seed_from_call_log(store, path, PARAMS) == 1
+    replay = CachingLLM(None, store, mode="replay", params=PARAMS)
+    assert replay.generate(prompt("a")) == "logged a"
+    with pytest.raises(CacheMissError):
+        replay.generate(prompt("b"))
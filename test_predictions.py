@@ -0,0 +1,79 @@
+"""
+Tests of the append-only prediction logs (last write wins).
+
+Run with `python -m pytest test_predictions.py`.
+"""
+
+import json
+import time
+
+from predictions import PREDS_FILE, PredictionStore
+
+
+def test_last_write_wins(tmp_path):
+    store = PredictionStore(tmp_path)
+    store.add("a", "model", "first patch")
+    store.add("b", "model", "patch b")
+    store.add("a", "model", "second patch")
+
+    predictions = store.predictions()
+
+    assert predictions["a"]["model_patch"] == "second patch"
+    assert predictions["b"]["model_patch"] == "patch b"
+
+
+def test_removed_instance_is_dropped_until_added_again(tmp_path):
+    store = PredictionStore(tmp_path)
+    store.add("a", "model", "patch")
+    store.remove("a")
+    assert "a" not in store.predictions()
+
+    store.add("a", "model", "retry")
+    assert store.predictions()["a"]["model_patch"] == "retry"
+
+
+def test_partial_last_line_is_ignored(tmp_path):
+    store = PredictionStore(tmp_path)
+    store.add("a", "model", "patch")
+    with open(store.preds_log, "a") as f:
+        f.write('{"instance_id": "b", "model_pa')
+
+    assert list(store.predictions()) == ["a"]
+
+
+def test_export_merges_shards(tmp_path):
+    first = PredictionStore(tmp_path, shard="shard-0-of-2")
+    second = PredictionStore(tmp_path, shard="shard-1-of-2")
+    first.add("a", "model", "patch a")
+    second.add("b", "model", "patch b")
+    first.add("a", "model", "patch a2")
+
+    first.export()
+
+    exported = json.loads((tmp_path / PREDS_FILE).read_text())
+    assert {instance_id: record["model_patch"] for instance_id, record in exported.items()} == {"a": "patch a2", "b": "patch b"}
+
+
+def test_latest_record_wins_across_shards(tmp_path):
+    expired = PredictionStore(tmp_path, shard="worker-a")
+    rerun = PredictionStore(tmp_path, shard="worker-b")
+    expired.add("a", "model", "stale patch")
+    time.sleep(0.05)
+    rerun.add("a", "model", "new patch")
+    time.sleep(0.05)
+    # The worker whose lease expired writes its log last
+    expired.add("b", "model", "patch b")
+
+    assert rerun.predictions()["a"]["model_patch"] == "new patch"
+
+
+def test_compaction_keeps_removals_that_supersede_other_shards(tmp_path):
+    first = PredictionStore(tmp_path, shard="shard-0-of-2")
+    second = PredictionStore(tmp_path, shard="shard-1-of-2")
+    second.add("a", "model", "old patch")
+    first.remove("a")
+
+    first.export()
+
+    assert "a" not in json.loads((tmp_path / PREDS_FILE).read_text())
+    assert "a" not in second.predictions()
@@ -0,0 +1,92 @@
+"""
+Tests of ResponseParser.parse_all and StreamingResponseParser.
+
+Run with `python -m pytest test_response_parser.py`.
+"""
+
+import pytest
+
+from response_parser import ResponseParser
+
+P = ResponseParser
+
+
+def call_block(name: str, **arguments) -> str:
+    args = "".join(f"{P.ARG_SEP}\n{key}\n{P.VALUE_SEP}\n{value}\n" for key, value in arguments.items())
+    return f"{P.BEGIN_CALL}\n{name}\n{args}{P.END_CALL}"
+
+
+def test_parse_all_returns_calls_in_order():
+    parser = ResponseParser(multi_call=True)
+    response = (
+        f"Reading both files.\n{call_block('show_file', file_path='a.py')}\n"
+        f"and\n{call_block('show_file', file_path='b.py')}\n{P.END_CALLS}\n"
+        f"{call_block('finish', result='ignored after END_CALLS')}"
+    )
+
+    calls = parser.parse_all(response)
+
+    assert [call["arguments"]["file_path"] for call in calls] == ["a.py", "b.py"]
+    assert [call["thought"] for call in calls] == ["Reading both files.", "and"]
+
+
+def test_parse_all_skips_unterminated_trailing_block():
+    parser = ResponseParser(multi_call=True)
+    response = f"{call_block('list_directory', path='.')}\n{P.BEGIN_CALL}\nshow_file\n"
+
+    assert [call["name"] for call in parser.parse_all(response)] == ["list_directory"]
+
+
+def test_parse_all_requires_a_complete_call():
+    with pytest.raises(ValueError):
+        ResponseParser(multi_call=True).parse_all(f"thinking\n{P.BEGIN_CALL}\nshow_file\n")
+    with pytest.raises(ValueError):
+        ResponseParser(multi_call=True).parse_all("no call at all")
+
+
+def test_stream_matches_parse_for_every_chunk_size():
+    parser = ResponseParser()
+    response = f"Edit it.\n{call_block('replace_in_file', file_path='x.py', old_str='a ----ARG- b', new_str='c')}"
+    expected = parser.parse(response)
+
+    # Small chunk sizes split END_CALL (and the other markers) at every position
+    for size in range(1, len(P.END_CALL) + 2):
+        streaming = parser.stream()
+        done = [streaming.feed(response[i:i + size]) for i in range(0, len(response), size)]
+        assert done[-1] and not any(done[:-1])
+        assert streaming.result() == expected
+
+
+def test_stream_stops_at_first_end_call():
+    parser = ResponseParser()
+    streaming = parser.stream()
+    response = f"{call_block('finish', result='done')}\ntrailing text {P.END_CALL}"
+
+    assert streaming.feed(response)
+    assert streaming.end_idx == response.find(P.END_CALL)
+    assert streaming.result()["arguments"] == {"result": "done"}
+    # Later chunks are ignored
+    assert streaming.feed("more") and "more" not in streaming.text()
+
+
+def test_stream_end_call_without_begin_call():
+    streaming = ResponseParser().stream()
+
+    assert streaming.feed(f"stray {P.END_CALL} marker")
+    with pytest.raises(ValueError):
+        streaming.result()
+
+
+def test_finish_hands_result_to_parse():
+    parser = ResponseParser()
+    raw = f"\n  thinking\n{call_block('show_file', file_path='a.py')}\n"
+    streaming = parser.stream()
+    streaming.feed(raw)
+    # The response as the LLM returns it: cut after END_CALL and stripped
+    response = raw.split(P.END_CALL)[0].strip() + "\n" + P.END_CALL
+
+    streaming.finish(response)
+
+    assert parser._streamed is not None and parser._streamed[0] is response
+    assert parser.parse(response) == ResponseParser().parse(response)
+    assert parser._streamed is None
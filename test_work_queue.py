@@ -0,0 +1,80 @@
+"""
+Tests of sharding (parse_shard, in_shard) and WorkQueue leasing.
+
+Run with `python -m pytest test_work_queue.py`.
+"""
+
+import time
+
+import pytest
+
+from work_queue import WorkQueue, in_shard, parse_shard
+
+
+def instances(*ids):
+    return [{"instance_id": instance_id} for instance_id in ids]
+
+
+def test_parse_shard():
+    assert parse_shard("0/1") == (0, 1)
+    assert parse_shard("3/4") == (3, 4)
+    for spec in ("4/4", "-1/2", "1", "a/b", "0/0"):
+        with pytest.raises(ValueError):
+            parse_shard(spec)
+
+
+def test_shards_partition_instances():
+    ids = [f"repo__repo-{i}" for i in range(200)]
+    shards = [[i for i in ids if in_shard(i, index, 3)] for index in range(3)]
+
+    assert sorted(sum(shards, [])) == sorted(ids)
+    assert all(shards)
+
+
+def test_lease_hands_out_each_instance_once_in_order(tmp_path):
+    first = WorkQueue(tmp_path / "queue.db", owner="first")
+    second = WorkQueue(tmp_path / "queue.db", owner="second")
+    assert first.add(instances("a", "b")) == 2
+    assert second.add(instances("b", "c")) == 1
+
+    assert [first.lease()["instance_id"], second.lease()["instance_id"], first.lease()["instance_id"]] == ["a", "b", "c"]
+    assert second.lease() is None
+    assert first.complete("a")
+    # A lease held by another worker cannot be completed
+    assert not first.complete("b")
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    dead = WorkQueue(tmp_path / "queue.db", owner="dead", lease_seconds=0.05)
+    alive = WorkQueue(tmp_path / "queue.db", owner="alive", lease_seconds=60)
+    dead.add(instances("a"))
+    dead.lease()
+
+    assert alive.lease() is None
+    time.sleep(0.1)
+    assert alive.lease()["instance_id"] == "a"
+    assert not dead.complete("a")
+    assert alive.complete("a")
+    assert alive.counts() == {"done": 1}
+
+
+def test_instance_is_given_up_after_max_attempts(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.db", owner="worker", lease_seconds=0.01, max_attempts=2, poll_interval=0.01)
+    queue.add(instances("a"))
+
+    assert queue.lease() is not None
+    time.sleep(0.05)
+    assert queue.lease() is not None
+    time.sleep(0.05)
+    assert queue.lease() is None
+    assert queue.next() is None
+
+
+def test_close_returns_leases_to_the_queue(tmp_path):
+    first = WorkQueue(tmp_path / "queue.db", owner="first")
+    first.add(instances("a"))
+    first.lease()
+    first.close()
+
+    second = WorkQueue(tmp_path / "queue.db", owner="second", max_attempts=1)
+    assert second.lease()["instance_id"] == "a"
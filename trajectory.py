@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Streaming trajectory writer.
+
+While an agent runs, every message (when it is created or changed) and every tool
+call timing is appended as one JSON line to `<instance_id>.traj.jsonl`, so the
+trajectory survives crashes and can be followed live (`tail -f`). The final record
+holds the run info. `to_mini_swe_agent` converts such a file to the
+`mini-swe-agent-1` trajectory written by `utils.save_traj`.
+
+Usage:
+    python trajectory.py TRAJ_JSONL [OUTPUT_JSON]
+"""
+
+import json
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+TRAJECTORY_FORMAT = "mini-swe-agent-1"
+
+
+def _mini_message(message: dict) -> dict:
+    # Tool results are sent to the LLM as user messages
+    return {"role": "user" if message["role"] == "tool" else message["role"], "content": message["content"]}
+
+
+def agent_messages(agent) -> list:
+    """
+    The agent's messages as {"role", "content"}.
+    """
+    return [_mini_message(message) for message in agent.id_to_message]
+
+
+def trajectory_info(agent: Any | None, result: str | None, env: Any | None = None) -> Dict[str, Any]:
+    """
+    The "info" section of a trajectory: submission, LLM usage and agent/environment statistics.
+    """
+    info: Dict[str, Any] = {"submission": result}
+    if agent is not None:
+        if hasattr(agent.llm, 'call_metrics'):
+            info["llm_calls"] = agent.llm.call_metrics
+
+        if hasattr(agent.llm, 'usage_summary'):
+            info["usage"] = agent.llm.usage_summary()
+
+        if hasattr(agent.llm, 'cache_stats'):
+            info["llm_cache"] = agent.llm.cache_stats()
+
+        if hasattr(agent, 'get_context_stats'):
+            info["context_stats"] = agent.get_context_stats()
+
+        if getattr(agent, 'output_store', None) is not None:
+            info["output_store"] = agent.output_store.stats()
+
+        info["config"] = {
+            "agent": agent.name,
+            "model": agent.llm.model_name,
+        }
+
+    if hasattr(env, 'stats'):
+        info["env_stats"] = env.stats()
+    return info
+
+
+class TrajectoryWriter:
+    """
+    Appends trajectory records to a JSONL file, one flushed line per record.
+    Safe to use from the threads that run concurrent tool calls.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def _write(self, record: dict) -> None:
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(line)
+            self.file.flush()
+
+    def message(self, message: dict) -> None:
+        """
+        Record a new or changed message (the last record of a unique_id wins).
+        """
+        self._write({"type": "message", "message": message})
+
+    def tool_call(self, step: int, name: str, seconds: float, success: bool) -> None:
+        self._write({"type": "tool_call", "step": step, "name": name, "seconds": round(seconds, 4), "success": success})
+
+    def finish(self, info: dict, **kwargs) -> None:
+        """
+        Record the run info; `kwargs` go to the top level of the converted trajectory.
+        """
+        self._write({"type": "info", "info": info, **kwargs})
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+
+
+def read_trajectory(path: Path) -> Dict[str, Any]:
+    """
+    Rebuild {"messages", "tool_calls", "info", "extra"} from a trajectory JSONL file.
+    A line cut short by a crash is ignored.
+    """
+    messages: Dict[int, dict] = {}
+    tool_calls = []
+    info: Optional[dict] = None
+    extra: Dict[str, Any] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            kind = record.pop("type")
+            if kind == "message":
+                messages[record["message"]["unique_id"]] = record["message"]
+            elif kind == "tool_call":
+                tool_calls.append(record)
+            elif kind == "info":
+                info = record.pop("info")
+                extra = record
+    return {
+        "messages": [messages[unique_id] for unique_id in sorted(messages)],
+        "tool_calls": tool_calls,
+        "info": info,
+        "extra": extra,
+    }
+
+
+def to_mini_swe_agent(path: Path) -> Dict[str, Any]:
+    """
+    Convert a trajectory JSONL file to the `mini-swe-agent-1` format.
+    A trajectory of an unfinished run gets an info section without submission.
+    """
+    trajectory = read_trajectory(path)
+    info = trajectory["info"] if trajectory["info"] is not None else {"submission": None}
+    info["tool_calls"] = trajectory["tool_calls"]
+    return {
+        "info": info,
+        "messages": [_mini_message(message) for message in trajectory["messages"]],
+        "trajectory_format": TRAJECTORY_FORMAT,
+    } | trajectory["extra"]
+
+
+def main(argv: list) -> None:
+    if not argv or len(argv) > 2:
+        print(__doc__)
+        sys.exit(1)
+    source = Path(argv[0])
+    target = Path(argv[1]) if len(argv) == 2 else source.with_name(source.name.removesuffix(".jsonl") + ".json")
+    target.write_text(json.dumps(to_mini_swe_agent(source), indent=2))
+    print(f"Saved trajectory to '{target}'")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,16 +1,11 @@
-import dataclasses
 import json
-from collections.abc import Callable
 from pathlib import Path
-from typing import Any
-from minisweagent import Environment
-from minisweagent.environments import get_environment
-import json
-import threading
-import subprocess
+from typing import TYPE_CHECKING, Any
+from trajectory import TRAJECTORY_FORMAT, agent_messages, trajectory_info
+
+if TYPE_CHECKING:
+    from minisweagent import Environment
 
-_OUTPUT_FILE_LOCK = threading.Lock()
-    
 def get_swebench_docker_image_name(instance: dict) -> str:
     """Get the image name for a SWEBench instance."""
     image_name = instance.get("image_name", None)
@@ -21,7 +16,10 @@ def get_swebench_docker_image_name(instance: dict) -> str:
         image_name = f"docker.io/swebench/sweb.eval.x86_64.{id_docker_compatible}:latest".lower()
     return image_name
 
-def get_sb_environment(instance: dict) -> Environment:
+def get_sb_environment(instance: dict) -> "Environment":
+    # minisweagent is slow to import, so it is imported when a container is started
+    from minisweagent.environments import get_environment
+
     env_config = {
         "image": get_swebench_docker_image_name(instance),
         "cwd": "/testbed",
@@ -38,35 +36,13 @@ def get_sb_environment(instance: dict) -> Environment:
     env = get_environment(env_config)
     return env
 
-def update_preds_file(output_path: Path, instance_id: str, model_name: str, result: str):
-    """Update the output JSON file with results from a single instance."""
-    with _OUTPUT_FILE_LOCK:
-        output_data = {}
-        if output_path.exists():
-            output_data = json.loads(output_path.read_text())
-        output_data[instance_id] = {
-            "model_name_or_path": model_name,
-            "instance_id": instance_id,
-            "model_patch": result,
-        }
-        output_path.write_text(json.dumps(output_data, indent=2))
-
-def remove_from_preds_file(output_path: Path, instance_id: str):
-    """Remove an instance from the predictions file."""
-    if not output_path.exists():
-        return
-    with _OUTPUT_FILE_LOCK:
-        output_data = json.loads(output_path.read_text())
-        if instance_id in output_data:
-            del output_data[instance_id]
-            output_path.write_text(json.dumps(output_data, indent=2))
-
 def save_traj(
     agent: Any | None,
     path: Path,
     *,
     print_path: bool = True,
     result: str | None = None,
+    env: Any | None = None,
     **kwargs,
 ):
     """Save the trajectory of the agent to a file.
@@ -76,29 +52,16 @@ def save_traj(
         path: The path to save the trajectory to.
         print_path: Whether to print confirmation of path to the terminal.
         result: The result/submission of the agent.
+        env: The environment the agent ran in (its cache counters are saved).
         **kwargs: Additional information to save (will be merged into top level)
 
     """
     data = {
-        "info": {
-            "submission": result,
-        },
-        "messages": [],
-        "trajectory_format": "mini-swe-agent-1",
+        "info": trajectory_info(agent, result, env),
+        "messages": agent_messages(agent) if hasattr(agent, 'id_to_message') else [],
+        "trajectory_format": TRAJECTORY_FORMAT,
     } | kwargs
-    if agent is not None:
-        # Save final messages
-        if hasattr(agent, 'messages'):
-            data["messages"] = agent.messages
-        
-        if hasattr(agent, 'get_context'):
-            data["context"] = agent.get_context()
-            
-        data["info"]["config"] = {
-            "agent": agent.name,
-            "model": agent.llm.model_name,
-        }
-        
+
     path.parent.mkdir(parents=True, exist_ok=True)
     path.write_text(json.dumps(data, indent=2))
     if print_path:
@@ -0,0 +1,207 @@
+"""
+Distributing instances over processes and hosts.
+
+`--shard i/N` gives every process a fixed, disjoint slice of the instances (by a
+stable hash of the instance id). `WorkQueue` instead lets any number of worker
+processes, possibly on different hosts sharing a filesystem, pull instances from
+one sqlite file: an instance is leased to one worker at a time, a heartbeat thread
+renews the leases of a live worker, and the lease of a worker that died expires
+so another worker picks the instance up again.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """
+    Parse "i/N" (0 <= i < N) into (i, N).
+    """
+    index, sep, count = spec.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError(f"Invalid shard {spec!r}, expected i/N") from None
+    if not sep or count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {spec!r}, expected i/N with 0 <= i < N")
+    return index, count
+
+
+def in_shard(instance_id: str, index: int, count: int) -> bool:
+    """
+    Whether an instance belongs to shard `index` of `count` (independent of dataset order).
+    """
+    return zlib.crc32(instance_id.encode("utf-8")) % count == index
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """
+    sqlite-backed queue of instances shared by the worker processes of a run.
+
+    Every process may `add` the instances it selected (already queued ones are
+    ignored), then its workers call `next()` until it returns None and `complete()`
+    each instance they processed. Instances are handed out in the order they were
+    added. An instance whose lease expired `max_attempts` times is given up on.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        owner: str | None = None,
+        lease_seconds: float = 600.0,
+        max_attempts: int = 3,
+        poll_interval: float = 10.0,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.owner = owner or worker_id()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        # Set to hand out no more instances; `closed` also ends the heartbeat
+        self.stopped = threading.Event()
+        self.closed = threading.Event()
+        # The default rollback journal, unlike WAL, works on network filesystems
+        self.conn = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False, isolation_level=None)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " instance_id TEXT PRIMARY KEY, position INTEGER, instance TEXT,"
+            " state TEXT, owner TEXT, lease_expires REAL, attempts INTEGER, updated REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, position)")
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat, name="queue-heartbeat", daemon=True)
+
+    def start(self) -> "WorkQueue":
+        self.heartbeat_thread.start()
+        return self
+
+    def add(self, instances: Iterable[dict]) -> int:
+        """
+        Queue the instances that are not queued yet; returns how many were added.
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                position = self.conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM tasks").fetchone()[0]
+                before = self.conn.total_changes
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO tasks (instance_id, position, instance, state, attempts, updated)"
+                    " VALUES (?, ?, ?, 'pending', 0, ?)",
+                    [
+                        (instance["instance_id"], position + i, json.dumps(instance), time.time())
+                        for i, instance in enumerate(instances)
+                    ],
+                )
+                added = self.conn.total_changes - before
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def lease(self) -> Optional[dict]:
+        """
+        Lease the next pending (or abandoned) instance, or None if there is none right now.
+        """
+        now = time.time()
+        with self.lock:
+            # IMMEDIATE takes the write lock up front, so two workers never lease the same row
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT instance_id, instance FROM tasks"
+                    " WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ? AND attempts < ?)"
+                    " ORDER BY position LIMIT 1",
+                    (now, self.max_attempts),
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE tasks SET state = 'leased', owner = ?, lease_expires = ?,"
+                        " attempts = attempts + 1, updated = ? WHERE instance_id = ?",
+                        (self.owner, now + self.lease_seconds, now, row[0]),
+                    )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return json.loads(row[1]) if row is not None else None
+
+    def next(self) -> Optional[dict]:
+        """
+        Lease the next instance, waiting while other workers hold leases that may
+        still expire. None once nothing is left to do (or after `stop`).
+        """
+        while not self.stopped.is_set():
+            instance = self.lease()
+            if instance is not None:
+                return instance
+            with self.lock:
+                held = self.conn.execute(
+                    "SELECT COUNT(*) FROM tasks WHERE state = 'leased' AND owner != ? AND attempts < ?",
+                    (self.owner, self.max_attempts),
+                ).fetchone()[0]
+            if not held:
+                return None
+            self.stopped.wait(self.poll_interval)
+        return None
+
+    def complete(self, instance_id: str) -> bool:
+        """
+        Mark a leased instance as done; False if the lease was lost to another worker.
+        """
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE tasks SET state = 'done', updated = ? WHERE instance_id = ? AND owner = ? AND state = 'leased'",
+                (time.time(), instance_id, self.owner),
+            )
+        return cursor.rowcount > 0
+
+    def _heartbeat(self) -> None:
+        while not self.closed.wait(self.lease_seconds / 3):
+            try:
+                with self.lock:
+                    self.conn.execute(
+                        "UPDATE tasks SET lease_expires = ? WHERE owner = ? AND state = 'leased'",
+                        (time.time() + self.lease_seconds, self.owner),
+                    )
+            except sqlite3.Error as e:
+                print(f"Could not renew leases in {self.path}: {e}")
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            rows = self.conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall()
+        return dict(rows)
+
+    def stop(self) -> None:
+        """
+        Make `next()` return None; leases of running instances are still renewed.
+        """
+        self.stopped.set()
+
+    def close(self) -> None:
+        """
+        Stop the heartbeat and hand the instances still leased by this worker back to the queue.
+        """
+        self.stopped.set()
+        self.closed.set()
+        if self.heartbeat_thread.is_alive():
+            self.heartbeat_thread.join()
+        with self.lock:
+            self.conn.execute(
+                "UPDATE tasks SET state = 'pending', owner = NULL, attempts = attempts - 1, updated = ?"
+                " WHERE owner = ? AND state = 'leased'",
+                (time.time(), self.owner),
+            )
+            self.conn.close()